@@ -0,0 +1,87 @@
+"""Time to first visible text for AI replies, streamed vs blocking, against a local fake gateway.
+
+    python benchmarks/bench_ai_stream.py [--chunks 60] [--gap 0.05]
+
+The fake server speaks the OpenAI chat-completions API and emits --chunks
+tokens --gap seconds apart (or returns them all at the end when not
+streaming). "first text" is when the user first sees reply content: the
+first edit of the placeholder, or the reply itself in blocking mode.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import types
+
+from aiohttp import web
+
+PORT = 18765
+os.environ['AI_BASE_URL'] = f'http://127.0.0.1:{PORT}/v1'
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fakes import FakeBot, context, fake_gateway  # noqa: E402
+
+
+def message_update(bot: FakeBot, uid: int, text: str):
+    async def reply_text(*args, **kwargs):
+        return await bot.call('reply_text', uid, *args, **kwargs)
+
+    user = types.SimpleNamespace(id=uid, username=f'p{uid}', first_name='P')
+    message = types.SimpleNamespace(text=text, message_id=1, chat_id=uid, reply_text=reply_text,
+                                    chat=types.SimpleNamespace(type='private', id=uid))
+    return types.SimpleNamespace(callback_query=None, effective_user=user,
+                                 effective_chat=types.SimpleNamespace(id=uid), message=message)
+
+
+async def measure(stream: bool, uid: int):
+    main.AI_STREAM = stream
+    bot = FakeBot()
+    start = time.perf_counter()
+    await main.chat_handler(message_update(bot, uid, f'!question {uid}'), context(bot))
+    total = time.perf_counter() - start
+    edits = sum(1 for name, _, _ in bot.calls if name == 'edit_message_text')
+    return total, edits
+
+
+async def run(chunks: int, gap: float):
+    runner = web.AppRunner(fake_gateway(chunks, gap), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PORT).start()
+    await main.dm.initialize()
+    print(f"{'mode':<10}{'first text s':>14}{'total s':>10}{'edits':>7}")
+    for uid, stream in enumerate((False, True), start=1):
+        seen = []
+        original = FakeBot.call
+        start = time.perf_counter()
+
+        async def call(self, name, *args, **kwargs):
+            if name == 'edit_message_text' or (name == 'reply_text' and args[1] != '💭 ...'):
+                seen.append(time.perf_counter() - start)
+            return await original(self, name, *args, **kwargs)
+
+        FakeBot.call = call
+        try:
+            total, edits = await measure(stream, uid)
+        finally:
+            FakeBot.call = original
+        print(f"{'stream' if stream else 'blocking':<10}{seen[0]:>14.2f}{total:>10.2f}{edits:>7}")
+    ttft = main.stream_stats['ttft_total'] / max(1, main.stream_stats['streams'])
+    print(f"gateway TTFT (stream_stats): {ttft * 1000:.0f} ms")
+    await main.dm.shutdown()
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=60)
+    parser.add_argument('--gap', type=float, default=0.05)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix='bench_ai_stream_') as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args.chunks, args.gap))
@@ -0,0 +1,68 @@
+"""Latency per button tap with a FakeBot that injects network delay.
+
+    python benchmarks/bench_callback_latency.py [--delay 0.05] [--taps 20]
+
+"deferred" is button_handler, which overlaps bookkeeping with the handler
+and sends the answer together with the first edit (or as the alert).
+"serial" replays the old pipeline on the same handlers: answer first,
+then the username check, then dispatch.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fakes import FakeBot, callback_update, context  # noqa: E402
+
+SCREENS = ('back_menu', 'ranking', 'help', 'game_coinflip', 'cf_play_heads')
+
+
+async def serial_tap(update, ctx):
+    q = update.callback_query
+    await q.answer()
+    await main.update_username_if_needed(q.from_user.id, q.from_user)
+    await main.callbacks.dispatch(update, ctx)
+
+
+async def median_ms(bot, handler, data: str, taps: int) -> float:
+    samples = []
+    for i in range(taps):
+        # A fresh user and message per tap, so neither the identity nor the edit cache hides the cost.
+        update = callback_update(bot, 1000 + i, data, message_id=i)
+        start = time.perf_counter()
+        await handler(update, context(bot))
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+async def run(delay: float, taps: int):
+    main.rate_limiter = main.RateLimiter(user_rate=1e9, user_burst=10**9)
+    await main.dm.initialize()
+    bot = FakeBot(delay)
+    print(f"{'screen':<16}{'serial ms':>11}{'deferred ms':>13}")
+    for data in SCREENS:
+        main.identity_cache.clear()
+        serial = await median_ms(bot, serial_tap, data, taps)
+        main.identity_cache.clear()
+        deferred = await median_ms(bot, main.button_handler, data, taps)
+        print(f"{data:<16}{serial:>11.0f}{deferred:>13.0f}")
+    await main.dm.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--delay', type=float, default=0.05)
+    parser.add_argument('--taps', type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix='bench_callback_') as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args.delay, args.taps))
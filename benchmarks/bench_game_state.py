@@ -0,0 +1,66 @@
+"""Micro-benchmark of round-tripping minigame state.
+
+    python benchmarks/bench_game_state.py [--number 200000]
+
+"slotted" is load_game/save_game on the registered GameState classes
+(positional list state); "dict" is the old pattern of a plain class
+re-created with cls(**data) and stored as its __dict__ copy. Also reports
+the encoded size and per-object memory of each form.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class DictGuessNumberGame:
+    """The previous GuessNumberGame layout: instance __dict__, keyword round trip."""
+
+    def __init__(self, min_val=1, max_val=100, bet=0, secret_number=None, guesses=0, game_over=False):
+        self.min_val = min_val
+        self.max_val = max_val
+        self.secret_number = secret_number if secret_number is not None else 50
+        self.guesses = guesses
+        self.game_over = game_over
+        self.bet = bet
+
+    def to_dict(self):
+        return self.__dict__.copy()
+
+
+def slotted_round_trip(user):
+    game = main.load_game(user, 'guess_number')
+    game.guesses += 1
+    main.save_game(user, game)
+
+
+def dict_round_trip(user):
+    game = DictGuessNumberGame(**user['minigames']['guess_number'])
+    game.guesses += 1
+    user['minigames']['guess_number'] = game.to_dict()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=200000)
+    args = parser.parse_args()
+
+    slotted_user = {'minigames': {}}
+    main.save_game(slotted_user, main.GuessNumberGame(bet=100))
+    dict_user = {'minigames': {'guess_number': DictGuessNumberGame(bet=100).to_dict()}}
+
+    slotted = timeit.timeit(lambda: slotted_round_trip(slotted_user), number=args.number) / args.number * 1e6
+    legacy = timeit.timeit(lambda: dict_round_trip(dict_user), number=args.number) / args.number * 1e6
+    slotted_json = len(main._compact_json(slotted_user['minigames']['guess_number']))
+    legacy_json = len(main._compact_json(dict_user['minigames']['guess_number']))
+    slotted_obj = sys.getsizeof(main.GuessNumberGame())
+    legacy_obj = sys.getsizeof(DictGuessNumberGame()) + sys.getsizeof(DictGuessNumberGame().__dict__)
+
+    print(f"{'':<10}{'us/round trip':>15}{'JSON bytes':>12}{'object bytes':>14}")
+    print(f"{'slotted':<10}{slotted:>15.2f}{slotted_json:>12}{slotted_obj:>14}")
+    print(f"{'dict':<10}{legacy:>15.2f}{legacy_json:>12}{legacy_obj:>14}")
@@ -0,0 +1,67 @@
+"""Per-update overhead of update_username_if_needed with and without the identity cache.
+
+    python benchmarks/bench_identity.py [--updates 50000] [--users 1000]
+
+"uncached" disables identity_cache, so every call goes through dm.get_user
+as the datastore path does; "cached" is the steady state where names rarely
+change; "renamed" changes the name on every call and pays for a transaction.
+Set STORAGE_BACKEND=sqlite to run the uncached path against SQLite.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import types
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+async def per_call(updates: int, users: int, renamed: bool = False) -> float:
+    people = [types.SimpleNamespace(username=f'player{uid}', first_name='P') for uid in range(users)]
+    start = time.perf_counter()
+    for i in range(updates):
+        uid = i % users
+        if renamed:
+            people[uid].username = f'player{uid}_{i}'
+        await main.update_username_if_needed(uid, people[uid])
+    return (time.perf_counter() - start) / updates * 1e6
+
+
+async def run(updates: int, users: int):
+    await main.dm.initialize()
+    await per_call(users, users)  # create the records
+    size = main.identity_cache.maxsize
+    try:
+        main.identity_cache.maxsize = 0
+        main.identity_cache.clear()
+        uncached = await per_call(updates, users)
+        main.identity_cache.maxsize = size
+        await per_call(users, users)  # warm the cache
+        hits, misses = main.identity_cache.hits, main.identity_cache.misses
+        cached = await per_call(updates, users)
+        hits, misses = main.identity_cache.hits - hits, main.identity_cache.misses - misses
+        hit_rate = hits / max(1, hits + misses)
+        renamed = await per_call(updates // 10, users, renamed=True)
+    finally:
+        main.identity_cache.maxsize = size
+        await main.dm.shutdown()
+    print(f"uncached {uncached:8.2f} us/update")
+    print(f"cached   {cached:8.2f} us/update  (hit rate {hit_rate:.0%})")
+    print(f"renamed  {renamed:8.2f} us/update")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix='bench_identity_') as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args.updates, args.users))
@@ -0,0 +1,64 @@
+"""Load test for RateLimiter: fairness under spam and memory under user churn.
+
+    python benchmarks/bench_rate_limiter.py [--users 5000] [--spammers 50] [--seconds 3]
+
+Normal users tap about twice a second, spammers as fast as the loop allows.
+Every normal request should be allowed no matter how hard the spammers push.
+The churn phase sends one request from each of many fresh users and reports
+the tracked-bucket count and traced memory, which stop growing once
+RATE_LIMIT_MAX_USERS is reached.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+async def fairness(users: int, spammers: int, seconds: float):
+    limiter = main.RateLimiter()
+    counts = {'normal': [0, 0], 'spam': [0, 0]}
+    deadline = time.monotonic() + seconds
+
+    async def client(uid: int, kind: str, pause: float):
+        await asyncio.sleep(random.random() * 0.5)
+        while time.monotonic() < deadline:
+            counts[kind][0 if limiter.allow(uid) else 1] += 1
+            await asyncio.sleep(pause * random.uniform(0.8, 1.2))
+
+    await asyncio.gather(*(client(uid, 'normal', 0.5) for uid in range(users)),
+                         *(client(-uid - 1, 'spam', 0) for uid in range(spammers)))
+    for kind, (allowed, dropped) in counts.items():
+        total = allowed + dropped
+        print(f"{kind:>6}: {total:>8} requests, {allowed / max(total, 1):7.2%} allowed")
+    print(f"global: {limiter.stats()}")
+
+
+def churn(total: int, step: int):
+    limiter = main.RateLimiter()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for uid in range(total):
+        limiter.allow(uid)
+        if (uid + 1) % step == 0:
+            used = tracemalloc.get_traced_memory()[0] - base
+            print(f"{uid + 1:>9} users seen: {len(limiter.buckets):>7} buckets, {used / 2**20:7.1f} MiB")
+    tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--spammers', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--churn', type=int, default=4 * main.RATE_LIMIT_MAX_USERS)
+    args = parser.parse_args()
+    asyncio.run(fairness(args.users, args.spammers, args.seconds))
+    churn(args.churn, args.churn // 8)
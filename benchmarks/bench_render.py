@@ -0,0 +1,135 @@
+"""Allocation per request for the menu, help, ranking and game-start screens.
+
+    python benchmarks/bench_render.py [--requests 200]
+
+Each handler runs against a FakeBot with edits stubbed out, so only
+building the text and keyboard is measured. The figure is the median
+tracemalloc peak above the starting point for one request. "old" is the
+previous handlers, which built every InlineKeyboardMarkup (and the menu
+text) on each request; "new" is the shared keyboards and cached renders.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import tracemalloc
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fakes import FakeBot, callback_update, context  # noqa: E402
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+SCREENS = ('back_menu', 'help', 'ranking', 'rps_start', 'game_coinflip')
+
+
+def button(text, data):
+    return InlineKeyboardButton(text, callback_data=data)
+
+
+def back_button():
+    return [button("↩️ Menu", 'back_menu')]
+
+
+async def edit(update, context, text, kb):
+    await main.safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, kb)
+
+
+async def old_menu(update, context):
+    uid = update.effective_user.id
+    await main.update_username_if_needed(uid, update.effective_user)
+    user = await main.dm.get_user(uid)
+    rank, next_rank = main.get_user_rank(user.get('total_exp', 0))
+    exp_str = f"{main.fmt(user.get('total_exp', 0))}"
+    if next_rank:
+        exp_str += f" / {main.fmt(next_rank['exp'])}"
+    txt = f"""
+👤 **{user.get('username', 'Player')}**
+- 🏆 **Rank:** {rank['name']}
+- ⭐ **EXP:** {exp_str}
+- 💰 **Xu:** {main.fmt(user['coins'])}
+"""
+    kb = InlineKeyboardMarkup([
+        [button("🪙 Tung Đồng Xu", 'game_coinflip'), button("🎰 Máy Xèng", 'game_slots')],
+        [button("💎 Kho Báu", 'game_treasure'), button("✊ Oẳn Tù Tì", 'rps_start')],
+        [button("🔢 Đoán Số", 'guess_start'), button("🃏 Cao/Thấp", 'game_highlow')],
+        [button("🎲 Chẵn Lẻ", 'game_chanle'), button("🎲 Tài Xỉu", 'game_taixiu'), button("🎲 Lắc Xúc Xắc", 'game_diceroll')],
+        [button("🎡 Vòng Quay", 'game_luckywheel'), button("🎁 Điểm Danh", 'daily_bonus')],
+        [button("📊 Thống Kê", 'stats'), button("🏆 Bảng Xếp Hạng", 'ranking')],
+        [button("📖 Hướng Dẫn", 'help')]
+    ])
+    await edit(update, context, txt, kb)
+
+
+async def old_help(update, context):
+    await edit(update, context, main.HELP_TEXT, InlineKeyboardMarkup([back_button()]))
+
+
+async def old_ranking(update, context):
+    txt = "🏆 **BẢNG XẾP HẠNG** 🏆\n\nChọn loại bảng xếp hạng bạn muốn xem."
+    kb = InlineKeyboardMarkup([[button("💰 Top Xu", 'top_coins'), button("⭐ Top Rank", 'top_rank')], back_button()])
+    await edit(update, context, txt, kb)
+
+
+async def old_rps_start(update, context):
+    bet = main.get_game_bet(await main.dm.get_user(update.effective_user.id))
+    keyboard = [[button("✌️ Kéo", 'rps_play_scissors'), button("✋ Bao", 'rps_play_paper'), button("✊ Búa", 'rps_play_rock')],
+                back_button()]
+    await edit(update, context, f"Oẳn tù tì!\nCược: **{main.fmt(bet)} xu**", InlineKeyboardMarkup(keyboard))
+
+
+async def old_coin_flip_start(update, context):
+    bet = main.get_game_bet(await main.dm.get_user(update.effective_user.id))
+    keyboard = [[button("🪙 Ngửa (Heads)", 'cf_play_heads'), button("🌑 Sấp (Tails)", 'cf_play_tails')], back_button()]
+    text = f"🪙 **TUNG ĐỒNG XU** 🪙\n\nCược: **{main.fmt(bet)} xu**\nChọn Sấp hoặc Ngửa:"
+    await edit(update, context, text, InlineKeyboardMarkup(keyboard))
+
+
+OLD = {'back_menu': old_menu, 'help': old_help, 'ranking': old_ranking,
+       'rps_start': old_rps_start, 'game_coinflip': old_coin_flip_start}
+
+
+async def median_peak(handler, update, ctx, requests: int) -> int:
+    for _ in range(5):
+        await handler(update, ctx)
+    peaks = []
+    tracemalloc.start()
+    for _ in range(requests):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        await handler(update, ctx)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    peaks.sort()
+    return peaks[len(peaks) // 2]
+
+
+async def run(requests: int):
+    await main.dm.initialize()
+
+    async def no_edit(*args, **kwargs):
+        return None
+
+    main.safe_edit_message = no_edit
+    bot = FakeBot()
+    print(f"{'screen':<16}{'old B/req':>11}{'new B/req':>11}")
+    for data in SCREENS:
+        _, handler, args = main.callbacks.resolve(data)
+        update = callback_update(bot, 42, data)
+        old = await median_peak(OLD[data], update, context(bot, args), requests)
+        new = await median_peak(handler, update, context(bot, args), requests)
+        print(f"{data:<16}{old:>11}{new:>11}")
+    await main.dm.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix='bench_render_') as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args.requests))
@@ -0,0 +1,42 @@
+"""Micro-benchmark of callback dispatch: CallbackRouter.resolve vs the old startswith chain.
+
+    python benchmarks/bench_router.py [--number 500000]
+
+The old chain is reproduced inline (seven startswith checks, then a handler
+dict rebuilt on every call) so both sides resolve the same callback data.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+PREFIXES = ('rps_play_', 'cf_play_', 'taixiu_', 'treasure_chest_', 'hl_play_', 'dr_play_', 'chanle_play_')
+EXACT = ('game_treasure', 'game_chanle', 'game_highlow', 'game_taixiu', 'game_luckywheel', 'daily_bonus', 'stats',
+         'ranking', 'top_coins', 'top_rank', 'help', 'back_menu', 'guess_start', 'rps_start', 'game_coinflip',
+         'game_slots', 'game_diceroll')
+SAMPLES = ('rps_play_rock', 'taixiu_tai_10', 'chanle_play_chan', 'back_menu', 'game_diceroll', 'nope')
+
+
+def startswith_chain(data: str):
+    for prefix in PREFIXES:
+        if data.startswith(prefix):
+            return prefix
+    handlers = {key: key for key in EXACT}
+    return handlers.get(data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=500000)
+    args = parser.parse_args()
+    print(f"{'callback data':<20}{'router ns':>12}{'chain ns':>12}")
+    for data in SAMPLES:
+        router = timeit.timeit(lambda: main.callbacks.resolve(data), number=args.number) / args.number * 1e9
+        chain = timeit.timeit(lambda: startswith_chain(data), number=args.number) / args.number * 1e9
+        print(f"{data:<20}{router:>12.0f}{chain:>12.0f}")
+    print(f"routes: {len(main.callbacks.hits)}")
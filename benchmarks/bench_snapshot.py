@@ -0,0 +1,88 @@
+"""Event-loop stall while saving a snapshot: old in-loop dump vs JsonStorage.
+
+    python benchmarks/bench_snapshot.py [--sizes 10000 100000 1000000]
+
+A ticker task sleeps 1 ms at a time and records the longest gap between
+wake-ups; that gap is how long update processing would have been frozen.
+"old" is the previous Storage.save (json.dumps(indent=2) on the loop, then
+an aiofiles write in place). "compact" is JsonStorage.compact(), which
+builds the snapshot from cached fragments in a worker thread and replaces
+the file atomically. "flush 1%" is a regular autosave with 1% of users dirty.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import aiofiles
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def synthetic_users(n: int):
+    users = {}
+    for i in range(n):
+        uid = str(100000000 + i)
+        user = main.dm.new_user(uid)
+        user.update(username=f'@player{i}', coins=random.random() * 1e6, total_exp=random.randrange(10**7))
+        users[uid] = user
+    return users
+
+
+async def max_stall(action) -> float:
+    gaps = []
+    running = True
+
+    async def ticker():
+        last = time.perf_counter()
+        while running:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    await action()
+    running = False
+    await task
+    return max(gaps)
+
+
+async def old_save(users):
+    async with aiofiles.open('old_snapshot.json', 'w', encoding='utf-8') as f:
+        await f.write(json.dumps(users, ensure_ascii=False, indent=2))
+
+
+async def bench(n: int):
+    users = synthetic_users(n)
+    storage = main.JsonStorage()
+    await storage.import_users(users)
+    dirty = {uid: users[uid] for uid in random.sample(list(users), max(1, n // 100))}
+
+    old = await max_stall(lambda: old_save(users))
+    compact = await max_stall(storage.compact)
+    flush = await max_stall(lambda: storage.flush(dirty))
+    print(f"{n:>9}{old * 1000:>12.1f}{compact * 1000:>12.1f}{flush * 1000:>12.1f}")
+
+
+async def run(sizes):
+    print(f"{'users':>9}{'old ms':>12}{'compact ms':>12}{'flush 1% ms':>12}")
+    for n in sizes:
+        await bench(n)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix='bench_snapshot_') as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args.sizes))
@@ -0,0 +1,71 @@
+"""Update throughput with a fake Bot: sequential vs PerUserUpdateProcessor.
+
+    python benchmarks/bench_updates.py [--users 50] [--per-user 10] [--latency 0.02] [--slow 0]
+
+Each update awaits a fake Bot round trip of up to --latency seconds; with
+--slow N, N users send one extra 2 s update first (a slow AI call). The
+report shows updates/s and whether every user's updates ran in order.
+SimpleUpdateProcessor is PTB's unordered concurrent processor, for reference.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from telegram import Chat, Message, Update, User  # noqa: E402
+from telegram.ext import SimpleUpdateProcessor  # noqa: E402
+
+
+def message_update(update_id: int, uid: int) -> Update:
+    chat = Chat(uid, 'private')
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=User(uid, 'p', False), text='1'))
+
+
+async def bench(name: str, processor, users: int, per_user: int, latency: float, slow: int):
+    order = {}
+    fast_done = []
+
+    async def handle(update: Update, delay: float):
+        await asyncio.sleep(delay)
+        order.setdefault(update.effective_user.id, []).append(update.update_id)
+
+    updates = [(message_update(i, uid), 2.0) for i, uid in enumerate(range(1, slow + 1))]
+    base = len(updates)
+    updates += [(message_update(base + i * users + uid, uid + 1), latency * random.random())
+                for i in range(per_user) for uid in range(users)]
+
+    async def run(update: Update, delay: float):
+        await processor.process_update(update, handle(update, delay))
+        if delay < 2.0:
+            fast_done.append(time.perf_counter())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(u, d) for u, d in updates))
+    fast = len(fast_done) / (max(fast_done) - start)
+    in_order = all(ids == sorted(ids) for ids in order.values())
+    print(f"{name:<24}{fast:>12.0f}{'yes' if in_order else 'NO':>10}")
+
+
+async def run(args):
+    print(f"{'processor':<24}{'updates/s':>12}{'ordered':>10}")
+    await bench('sequential (1 slot)', main.PerUserUpdateProcessor(1), args.users, args.per_user, args.latency, args.slow)
+    await bench(f'per-user ({main.CONCURRENT_UPDATES} slots)', main.PerUserUpdateProcessor(main.CONCURRENT_UPDATES),
+                args.users, args.per_user, args.latency, args.slow)
+    await bench(f'unordered ({main.CONCURRENT_UPDATES} slots)', SimpleUpdateProcessor(main.CONCURRENT_UPDATES),
+                args.users, args.per_user, args.latency, args.slow)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--per-user', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--slow', type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,71 @@
+"""Resident size of the in-memory user store: plain dicts vs slotted UserRecord.
+
+    python benchmarks/bench_user_store.py [--sizes 100000 1000000]
+
+Users are loaded the way DataManager loads them: a bot_data.json snapshot
+is parsed and every record migrated. "dict" keeps the parsed dicts as-is
+(COMPACT_USER_STORE=0); "record" converts each one with DataManager._compact
+like initialize() does. Sizes are tracemalloc's live bytes for the users
+mapping alone, measured after the parse buffer has been released.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def snapshot(n: int) -> bytes:
+    users = {}
+    for i in range(n):
+        uid = str(100000000 + i)
+        user = main.dm.new_user(uid)
+        user.update(username=f'@player{i}', coins=random.random() * 1e6, total_exp=random.randrange(10**7))
+        if i % 10 == 0:
+            user['stats']['cl_win'] = random.randrange(50)
+            user['minigame_streaks']['rps'] = {'losses': 1, 'guaranteed_win': False}
+        users[uid] = user
+    return json.dumps(users, ensure_ascii=False).encode('utf-8')
+
+
+def load(raw: bytes, compact: bool):
+    main.COMPACT_USER_STORE = compact
+    users = json.loads(raw)
+    for uid, user in users.items():
+        main.migrate_user(user)
+        users[uid] = main.DataManager._compact(uid, user)
+    return users
+
+
+def measure(raw: bytes, compact: bool) -> int:
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    users = load(raw, compact)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del users
+    return size
+
+
+def run(sizes):
+    print(f"{'users':>9}{'dict MB':>10}{'record MB':>11}{'B/user old':>12}{'B/user new':>12}{'saved':>8}")
+    for n in sizes:
+        raw = snapshot(n)
+        old, new = measure(raw, False), measure(raw, True)
+        print(f"{n:>9}{old / 2**20:>10.1f}{new / 2**20:>11.1f}{old / n:>12.0f}{new / n:>12.0f}{1 - new / old:>8.0%}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    args = parser.parse_args()
+    run(args.sizes)
@@ -0,0 +1,151 @@
+"""End-to-end callback latency in polling vs webhook mode.
+
+    python benchmarks/bench_webhook.py [--taps 200]
+
+A local fake Bot API server answers getMe/getUpdates/editMessageText/
+answerCallbackQuery. Each tap is a synthetic 'back_menu' callback from a
+fresh user; latency runs from handing the update to Telegram's side (queued
+for getUpdates, or POSTed to the webhook) until the bot's
+answerCallbackQuery reaches the fake server.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from telegram.ext import Application, CallbackQueryHandler  # noqa: E402
+
+TOKEN = '123:bench'
+API_PORT = 18081
+WEBHOOK_PORT = 18082
+BOT_USER = {'id': 123, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.updates = []
+        self.arrived = asyncio.Event()
+        self.answered = {}
+
+    def callback_update(self, update_id: int) -> dict:
+        user = {'id': 10000 + update_id, 'is_bot': False, 'first_name': 'P', 'username': f'p{update_id}'}
+        message = {'message_id': 1, 'date': 0, 'chat': {'id': user['id'], 'type': 'private'}, 'from': BOT_USER, 'text': 'menu'}
+        return {'update_id': update_id, 'callback_query': {'id': str(update_id), 'from': user, 'chat_instance': 'c',
+                                                           'data': 'back_menu', 'message': message}}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post()) if request.can_read_body else {}
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'getUpdates':
+            result = await self.get_updates(int(params.get('offset', 0)), float(params.get('timeout', 0)))
+        elif method == 'answerCallbackQuery':
+            self.answered[params['callback_query_id']] = time.perf_counter()
+            result = True
+        elif method == 'editMessageText':
+            result = {'message_id': 1, 'date': 0, 'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                      'text': params['text']}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def get_updates(self, offset: int, timeout: float) -> list:
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates
+
+
+def build_app(polling: bool) -> Application:
+    builder = (Application.builder().token(TOKEN).base_url(f'http://127.0.0.1:{API_PORT}/bot')
+               .concurrent_updates(main.PerUserUpdateProcessor(main.CONCURRENT_UPDATES)))
+    if not polling:
+        builder = builder.updater(None)
+    app = builder.build()
+    app.add_handler(CallbackQueryHandler(main.button_handler))
+    return app
+
+
+async def wait_answered(api: FakeBotAPI, query_id: str):
+    while query_id not in api.answered:
+        await asyncio.sleep(0.0002)
+
+
+async def run_mode(api: FakeBotAPI, polling: bool, taps: int, first_id: int):
+    app = build_app(polling)
+    await app.initialize()
+    latencies = []
+    runner = None
+    session = aiohttp.ClientSession()
+    try:
+        if polling:
+            await app.updater.start_polling(poll_interval=0, timeout=10, allowed_updates=main.allowed_update_types(app))
+        else:
+            runner = web.AppRunner(main.create_webhook_app(app))
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', WEBHOOK_PORT).start()
+        await app.start()
+        for update_id in range(first_id, first_id + taps):
+            update = api.callback_update(update_id)
+            start = time.perf_counter()
+            if polling:
+                api.updates.append(update)
+                api.arrived.set()
+            else:
+                await session.post(f'http://127.0.0.1:{WEBHOOK_PORT}{main.WEBHOOK_PATH}', json=update,
+                                   headers={'X-Telegram-Bot-Api-Secret-Token': main.WEBHOOK_SECRET})
+            await wait_answered(api, str(update_id))
+            latencies.append(api.answered[str(update_id)] - start)
+    finally:
+        await session.close()
+        if polling:
+            api.arrived.set()
+            await app.updater.stop()
+        if runner:
+            await runner.cleanup()
+        await app.stop()
+        await app.shutdown()
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000  # noqa: E731
+    print(f"{'polling' if polling else 'webhook':<8} p50 {pick(0.5):6.2f} ms  p90 {pick(0.9):6.2f} ms  p99 {pick(0.99):6.2f} ms")
+
+
+async def run(taps: int):
+    api = FakeBotAPI()
+    server = web.Application()
+    server.router.add_post('/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', API_PORT).start()
+    await main.dm.initialize()
+    try:
+        await run_mode(api, True, taps, 1)
+        await run_mode(api, False, taps, taps + 1)
+    finally:
+        await main.dm.shutdown()
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--taps', type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix='bench_webhook_') as workdir:
+        os.chdir(workdir)
+        asyncio.run(run(args.taps))
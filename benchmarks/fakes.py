@@ -0,0 +1,77 @@
+"""Minimal stand-ins for the Bot, for updates and for the AI gateway, shared by the benchmarks and tests."""
+import asyncio
+import json
+import types
+
+from aiohttp import web
+
+
+class FakeBot:
+    """Records every Bot API call and answers after an optional simulated network delay."""
+
+    def __init__(self, delay: float = 0.0):
+        self.calls = []
+        self.delay = delay
+
+    async def call(self, name, *args, **kwargs):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.calls.append((name, args, kwargs))
+        return types.SimpleNamespace(message_id=1, chat_id=args[0] if args else kwargs.get('chat_id'))
+
+    def __getattr__(self, name):
+        async def method(*args, **kwargs):
+            return await self.call(name, *args, **kwargs)
+        return method
+
+
+def callback_update(bot: FakeBot, uid: int, data: str, chat_id: int = None, message_id: int = 10):
+    chat_id = chat_id or uid
+    user = types.SimpleNamespace(id=uid, username=f'p{uid}', first_name='P')
+
+    async def answer(*args, **kwargs):
+        return await bot.call('answer', *args, **kwargs)
+
+    query = types.SimpleNamespace(id=f'{uid}:{data}:{message_id}', from_user=user, data=data, answer=answer,
+                                  message=types.SimpleNamespace(chat_id=chat_id, message_id=message_id))
+    return types.SimpleNamespace(callback_query=query, effective_user=user,
+                                 effective_chat=types.SimpleNamespace(id=chat_id), message=None)
+
+
+def context(bot: FakeBot, args=None):
+    return types.SimpleNamespace(bot=bot, args=args or [])
+
+
+# app[GATEWAY].requests counts calls; while .fail is positive, each call
+# decrements it and answers 500 instead.
+GATEWAY = web.AppKey('gateway', types.SimpleNamespace)
+
+
+def fake_gateway(chunks: int, gap: float) -> web.Application:
+    """OpenAI chat-completions endpoint emitting `chunks` tokens `gap` seconds apart."""
+    async def completions(request: web.Request):
+        state = request.app[GATEWAY]
+        state.requests += 1
+        if state.fail > 0:
+            state.fail -= 1
+            return web.json_response({'error': {'message': 'upstream failed', 'type': 'server_error'}}, status=500)
+        body = await request.json()
+        if not body.get('stream'):
+            await asyncio.sleep(chunks * gap)
+            message = {'role': 'assistant', 'content': 'token ' * chunks}
+            return web.json_response({'id': 'x', 'object': 'chat.completion', 'created': 0, 'model': 'fake',
+                                      'choices': [{'index': 0, 'finish_reason': 'stop', 'message': message}]})
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        for _ in range(chunks):
+            await asyncio.sleep(gap)
+            chunk = {'id': 'x', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'fake',
+                     'choices': [{'index': 0, 'delta': {'content': 'token '}, 'finish_reason': None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    app = web.Application()
+    app[GATEWAY] = types.SimpleNamespace(requests=0, fail=0)
+    app.router.add_post('/v1/chat/completions', completions)
+    return app
@@ -1,18 +1,38 @@
 import asyncio
 import base64
+import bisect
+import contextlib
+import contextvars
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import itertools
 import json
 import logging
+import operator
 import os
 import random
+import secrets
+import signal
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Awaitable, Callable, Deque, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
 
 import aiofiles
+from aiohttp import web
 import pytz
 from dotenv import load_dotenv
-from github import Github
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+from github import Github, GithubException, UnknownObjectException
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot, CallbackQuery, ChatMember
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import Application, BaseUpdateProcessor, ChatMemberHandler, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
 from openai import AsyncOpenAI
 
 load_dotenv()
@@ -23,23 +43,109 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
 GITHUB_REPO = os.getenv('GITHUB_REPO', 'htuananh1/Data-manager')
 GITHUB_FILE_PATH = "bot_data.json"
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com')
+GITHUB_PUSH_INTERVAL = int(os.getenv('GITHUB_PUSH_INTERVAL', '600'))
+GITHUB_RATE_LIMIT_RESERVE = 50
 LOCAL_BACKUP_FILE = "local_backup.json"
+JOURNAL_FILE = "local_backup.journal"
+JOURNAL_COMPACT_THRESHOLD = 50000
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+SQLITE_DB_FILE = os.getenv('SQLITE_DB_FILE', 'bot_data.db')
+USER_LOCK_STRIPES = 1024
+LEDGER_FILE = "coin_ledger.log"
+LEDGER_COMMIT_INTERVAL = 0.02
+LEADERBOARD_KEYS = ('coins', 'total_exp')
+SCHEMA_VERSION = 2
+COMPACT_USER_STORE = os.getenv('COMPACT_USER_STORE', '').lower() in ('1', 'true', 'yes')
+# Quarter-decade buckets from 1 to 1e12, used for percentile histograms.
+HISTOGRAM_BOUNDS = [0] + [round(10 ** (k / 4)) for k in range(49)]
+SNAPSHOT_COMPRESS = os.getenv('SNAPSHOT_COMPRESS', '').lower() in ('1', 'true', 'yes')
 VIETNAM_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
 SAVE_INTERVAL = 30
 MIN_UPDATE_INTERVAL = 0.1
-GLOBAL_RATE_LIMIT = 25
+USER_BURST = 5
+RATE_LIMIT_MAX_USERS = 100000
+IDENTITY_CACHE_SIZE = 100000
+RENDER_CACHE_SIZE = 4096
+EDIT_CACHE_SIZE = 50000
+ADMIN_CACHE_TTL = 300
+ADMIN_CACHE_SIZE = 10000
+AI_CACHE_SIZE = 2048
+AI_CACHE_TTL = 600
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_GROUP_INTERVAL = 1.0
+TELEGRAM_PRIVATE_INTERVAL = 0.0
+CONCURRENT_UPDATES = 64
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# Without a configured secret a random one is registered on every start, so
+# the endpoint never accepts unauthenticated updates.
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
 BOT_OWNER_ID = 2026797305
 AI_GATEWAY_API_KEY = os.getenv('AI_GATEWAY_API_KEY')
 AI_MODEL = 'openai/gpt-4o'
+AI_BASE_URL = os.getenv('AI_BASE_URL', 'https://ai-gateway.vercel.sh/v1')
+AI_STREAM = os.getenv('AI_STREAM', '1').lower() in ('1', 'true', 'yes')
+STREAM_EDIT_INTERVAL = 1.0
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAM_CURSOR = " ▌"
 
 ai_client = AsyncOpenAI(
     api_key=AI_GATEWAY_API_KEY,
-    base_url='https://ai-gateway.vercel.sh/v1'
+    base_url=AI_BASE_URL
 )
 
 UserData = Dict[str, Any]
 
-class GuessNumberGame:
+class GameState:
+    """Base for slotted minigame state.
+
+    State is stored in the user record as a positional list following
+    __slots__, which must list the __init__ parameters in order;
+    from_state() also accepts the older dict form.
+    """
+
+    __slots__ = ()
+    NAME = ''
+
+    def to_state(self) -> List[Any]:
+        return list(self._pack(self))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in self.__slots__}
+
+    @classmethod
+    def from_state(cls, data: Any) -> 'GameState':
+        if isinstance(data, dict):
+            return cls(**data)
+        return cls(*data)
+
+    from_dict = from_state
+
+GAME_REGISTRY: Dict[str, type] = {}
+
+def register_game(name: str):
+    def wrap(cls):
+        cls.NAME = name
+        getter = operator.attrgetter(*cls.__slots__)
+        cls._pack = getter if len(cls.__slots__) > 1 else lambda obj: (getter(obj),)
+        GAME_REGISTRY[name] = cls
+        return cls
+    return wrap
+
+def load_game(user: UserData, name: str) -> Optional[GameState]:
+    state = user.get('minigames', {}).get(name)
+    return GAME_REGISTRY[name].from_state(state) if state else None
+
+def save_game(user: UserData, game: GameState):
+    user['minigames'][game.NAME] = game.to_state()
+
+@register_game('guess_number')
+class GuessNumberGame(GameState):
+    __slots__ = ('min_val', 'max_val', 'bet', 'secret_number', 'guesses', 'game_over')
+
     def __init__(self, min_val: int = 1, max_val: int = 100, bet: int = 0, secret_number: Optional[int] = None, guesses: int = 0, game_over: bool = False):
         self.min_val = min_val
         self.max_val = max_val
@@ -55,14 +161,10 @@ class GuessNumberGame:
             return "correct"
         return "higher" if guess < self.secret_number else "lower"
 
-    def to_dict(self) -> Dict[str, Any]:
-        return self.__dict__
-
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'GuessNumberGame':
-        return cls(**data)
+@register_game('highlow')
+class HighLowGame(GameState):
+    __slots__ = ('bet', 'current_card', 'game_over', 'win')
 
-class HighLowGame:
     def __init__(self, bet: int = 0, current_card: Optional[int] = None, game_over: bool = False, win: bool = False):
         self.bet = bet
         self.current_card = current_card if current_card is not None else random.randint(1, 13)
@@ -81,14 +183,10 @@ class HighLowGame:
         self.game_over = True
         return new_card
 
-    def to_dict(self) -> Dict[str, Any]:
-        return self.__dict__
-
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'HighLowGame':
-        return cls(**data)
+@register_game('diceroll')
+class DiceRollGame(GameState):
+    __slots__ = ('bet', 'game_over', 'win', 'dice_result')
 
-class DiceRollGame:
     def __init__(self, bet: int = 0, game_over: bool = False, win: bool = False, dice_result: Optional[Tuple[int, int]] = None):
         self.bet = bet
         self.game_over = game_over
@@ -103,55 +201,357 @@ class DiceRollGame:
         self.win = (d1 + d2 == 7)
         return self.dice_result
 
-    def to_dict(self) -> Dict[str, Any]:
-        return self.__dict__
-
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'DiceRollGame':
-        return cls(**data)
+class LRUCache:
+    """Bounded mapping with least-recently-used eviction and optional expiry."""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[Any, Tuple[float, Any]]' = OrderedDict()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires, value = item
+        if expires and expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Any, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl if self.ttl else 0, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
 
 class RateLimiter:
-    def __init__(self):
-        self.user_last_action: Dict[int, float] = {}
-        self.global_semaphore = asyncio.Semaphore(GLOBAL_RATE_LIMIT)
-        self.lock = asyncio.Lock()
-
-    async def acquire(self, user_id: int):
-        async with self.global_semaphore:
-            async with self.lock:
-                last_action = self.user_last_action.get(user_id, 0)
-            
-            wait_time = MIN_UPDATE_INTERVAL - (asyncio.get_event_loop().time() - last_action)
-            if wait_time > 0:
-                await asyncio.sleep(wait_time)
-            
-            async with self.lock:
-                self.user_last_action[user_id] = asyncio.get_event_loop().time()
+    """Per-user token buckets; a user's excess requests are dropped, never queued.
+
+    There is deliberately no global bucket: total load is bounded by
+    CONCURRENT_UPDATES and the OutboundScheduler, and a bot-wide drop rate
+    would discard taps from well-behaved users whenever the bot is busy.
+    Buckets idle long enough to refill completely carry no state worth
+    keeping, so they expire out of a bounded LRU.
+    """
+
+    def __init__(self, user_rate: float = 1 / MIN_UPDATE_INTERVAL, user_burst: int = USER_BURST,
+                 max_users: int = RATE_LIMIT_MAX_USERS):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.buckets = LRUCache(max_users, ttl=user_burst / user_rate)
+        self.allowed = 0
+        self.dropped = 0
+
+    def allow(self, user_id: int) -> bool:
+        now = time.monotonic()
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+        self.buckets.set(user_id, bucket)
+        if not bucket.take(now):
+            self.dropped += 1
+            return False
+        self.allowed += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {'allowed': self.allowed, 'dropped': self.dropped, 'tracked_users': len(self.buckets)}
 
 rate_limiter = RateLimiter()
 
-def get_user_rank(exp: float) -> Tuple[Dict, Optional[Dict]]:
-    ranks = [
-        {"name": "🌱 Newbie", "exp": 0},
-        {"name": "🌳 Apprentice", "exp": 5000},
-        {"name": "🌲 Adept", "exp": 20000},
-        {"name": "🌴 Expert", "exp": 100000},
-        {"name": "🔥 Master", "exp": 500000},
-        {"name": "🌟 Grandmaster", "exp": 2000000},
-        {"name": "⚡ Legend", "exp": 5000000},
-        {"name": "🔮 Mystic", "exp": 10000000},
-        {"name": "🌌 Celestial", "exp": 25000000},
-        {"name": "👑 God", "exp": 100000000}
-    ]
-    user_rank = ranks[0]
-    next_rank = None
-    for i, rank in enumerate(ranks):
-        if exp >= rank["exp"]:
-            user_rank = rank
-            next_rank = ranks[i + 1] if i + 1 < len(ranks) else None
+class OutboundJob:
+    __slots__ = ('chat_id', 'key', 'factory', 'future')
+
+    def __init__(self, chat_id: int, key: Optional[Tuple], factory: Callable[[], Awaitable], future: asyncio.Future):
+        self.chat_id = chat_id
+        self.key = key
+        self.factory = factory
+        self.future = future
+
+class OutboundScheduler:
+    """Central queue for outgoing Telegram API calls.
+
+    Sends are paced by a global token bucket and a minimum interval per chat
+    (group chats are slower), one request in flight per chat. RetryAfter
+    pushes the chat back and re-queues the job. Jobs submitted with a key,
+    e.g. (chat_id, message_id) for edits, collapse while pending so only the
+    newest payload is sent and every caller gets that result.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, group_interval: float = TELEGRAM_GROUP_INTERVAL,
+                 private_interval: float = TELEGRAM_PRIVATE_INTERVAL):
+        self.group_interval = group_interval
+        self.private_interval = private_interval
+        self._bucket = TokenBucket(global_rate, global_rate)
+        self._queues: Dict[int, Deque[OutboundJob]] = {}
+        self._pending: Dict[Tuple, OutboundJob] = {}
+        self._ready: List[Tuple[float, int]] = []
+        self._not_before: Dict[int, float] = {}
+        self._busy: Set[int] = set()
+        # In-flight sends; the loop only keeps weak references to tasks.
+        self._sends: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        if self._sends:
+            await asyncio.gather(*self._sends, return_exceptions=True)
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.cancel()
+        self._queues.clear()
+        self._pending.clear()
+        self._ready.clear()
+
+    async def submit(self, chat_id: int, factory: Callable[[], Awaitable], key: Optional[Tuple] = None) -> Any:
+        if not self._task:
+            return await factory()
+        job = self._pending.get(key) if key is not None else None
+        if job:
+            job.factory = factory
+            self.coalesced += 1
+        else:
+            job = OutboundJob(chat_id, key, factory, asyncio.get_running_loop().create_future())
+            self._enqueue(job)
+        return await asyncio.shield(job.future)
+
+    def _enqueue(self, job: OutboundJob, front: bool = False):
+        if job.key is not None:
+            self._pending[job.key] = job
+        queue = self._queues.get(job.chat_id)
+        if queue is None:
+            queue = self._queues[job.chat_id] = deque()
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        if len(queue) == 1 and job.chat_id not in self._busy:
+            self._schedule(job.chat_id)
+
+    def _schedule(self, chat_id: int):
+        heapq.heappush(self._ready, (self._not_before.get(chat_id, 0.0), chat_id))
+        self._wakeup.set()
+
+    def _interval(self, chat_id: int) -> float:
+        return self.group_interval if chat_id < 0 else self.private_interval
+
+    async def _run(self):
+        while True:
+            if not self._ready:
+                now = time.monotonic()
+                self._not_before = {c: t for c, t in self._not_before.items() if t > now}
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = time.monotonic()
+            not_before, chat_id = self._ready[0]
+            delay = not_before - now
+            if delay <= 0 and not self._bucket.take(now):
+                delay = 1 / self._bucket.rate
+            if delay > 0:
+                self._wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                continue
+            heapq.heappop(self._ready)
+            queue = self._queues.get(chat_id)
+            if not queue:
+                continue
+            job = queue.popleft()
+            if not queue:
+                del self._queues[chat_id]
+            if job.key is not None:
+                self._pending.pop(job.key, None)
+            self._busy.add(chat_id)
+            task = asyncio.create_task(self._send(job))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _send(self, job: OutboundJob):
+        chat_id = job.chat_id
+        try:
+            result = await job.factory()
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+            self.retried += 1
+            self._not_before[chat_id] = time.monotonic() + retry_after
+            self._requeue(job)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
         else:
-            break
-    return user_rank, next_rank
+            self.sent += 1
+            self._not_before[chat_id] = time.monotonic() + self._interval(chat_id)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._busy.discard(chat_id)
+            if chat_id in self._queues:
+                self._schedule(chat_id)
+
+    def _requeue(self, job: OutboundJob):
+        newer = self._pending.get(job.key) if job.key is not None else None
+        if newer is None:
+            self._enqueue(job, front=True)
+            return
+
+        # A fresher edit of the same message is already queued; answer with its result.
+        def relay(f: asyncio.Future):
+            if job.future.done():
+                return
+            if f.cancelled():
+                job.future.cancel()
+            elif f.exception():
+                job.future.set_exception(f.exception())
+            else:
+                job.future.set_result(f.result())
+        newer.future.add_done_callback(relay)
+
+    def stats(self) -> Dict[str, int]:
+        return {'sent': self.sent, 'coalesced': self.coalesced, 'retried': self.retried, 'failed': self.failed,
+                'queued': sum(len(q) for q in self._queues.values())}
+
+outbound = OutboundScheduler()
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+
+class CallbackRouter:
+    """Maps callback_data to handlers registered once at import time.
+
+    Exact routes are a single dict lookup. Prefix routes (ending in '_') live
+    in a trie over the '_'-separated segments, walked once over the data with
+    the longest registered prefix winning; the remaining segments become
+    context.args for the handler.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Handler] = {}
+        self._trie: Dict[Optional[str], Any] = {}
+        self.hits: Dict[str, int] = {}
+        self.unknown = 0
+
+    def exact(self, key: str) -> Callable[[Handler], Handler]:
+        def wrap(handler: Handler) -> Handler:
+            self._exact[key] = handler
+            self.hits.setdefault(key, 0)
+            return handler
+        return wrap
+
+    def prefix(self, prefix: str) -> Callable[[Handler], Handler]:
+        if not prefix.endswith('_'):
+            raise ValueError(f"Callback prefix must end with '_': {prefix!r}")
+
+        def wrap(handler: Handler) -> Handler:
+            node = self._trie
+            for part in prefix[:-1].split('_'):
+                node = node.setdefault(part, {})
+            node[None] = (prefix + '*', handler)
+            self.hits.setdefault(prefix + '*', 0)
+            return handler
+        return wrap
+
+    def resolve(self, data: str) -> Tuple[Optional[str], Optional[Handler], List[str]]:
+        handler = self._exact.get(data)
+        if handler:
+            return data, handler, []
+        parts = data.split('_')
+        node, match, depth = self._trie, None, 0
+        for i, part in enumerate(parts[:-1]):
+            node = node.get(part)
+            if node is None:
+                break
+            if None in node:
+                match, depth = node[None], i + 1
+        if match is None:
+            return None, None, []
+        route, handler = match
+        args = parts[depth:]
+        return route, handler, [] if args == [''] else args
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        data = update.callback_query.data or ''
+        route, handler, args = self.resolve(data)
+        if handler is None:
+            self.unknown += 1
+            logger.warning(f"Unknown callback data: {data!r}")
+            return False
+        self.hits[route] += 1
+        context.args = args
+        await handler(update, context)
+        return True
+
+callbacks = CallbackRouter()
+
+RANKS = [
+    {"name": "🌱 Newbie", "exp": 0},
+    {"name": "🌳 Apprentice", "exp": 5000},
+    {"name": "🌲 Adept", "exp": 20000},
+    {"name": "🌴 Expert", "exp": 100000},
+    {"name": "🔥 Master", "exp": 500000},
+    {"name": "🌟 Grandmaster", "exp": 2000000},
+    {"name": "⚡ Legend", "exp": 5000000},
+    {"name": "🔮 Mystic", "exp": 10000000},
+    {"name": "🌌 Celestial", "exp": 25000000},
+    {"name": "👑 God", "exp": 100000000}
+]
+RANK_THRESHOLDS = [r["exp"] for r in RANKS]
+
+def get_rank_index(exp: float) -> int:
+    return max(bisect.bisect_right(RANK_THRESHOLDS, exp or 0) - 1, 0)
+
+def get_user_rank(exp: float) -> Tuple[Dict, Optional[Dict]]:
+    i = get_rank_index(exp)
+    return RANKS[i], RANKS[i + 1] if i + 1 < len(RANKS) else None
 
 def fmt(num: float) -> str:
     if num is None:
@@ -164,38 +564,943 @@ def fmt(num: float) -> str:
         return f"{num/1e6:.1f}M".replace('.0', '')
     return f"{num/1e9:.1f}B".replace('.0', '')
 
+def _json_default(obj: Any) -> Any:
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _compact_json(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+def atomic_write(path: str, chunks: Iterable[bytes], compress: bool = False) -> None:
+    """Write via a temp file, fsync and rename so readers never see a torn file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            out = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=5) if compress else f
+            for chunk in chunks:
+                out.write(chunk)
+            if compress:
+                out.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+    with contextlib.suppress(OSError):
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
 class Storage:
+    """Persistence backend for user records.
+
+    Eager backends hand every record to DataManager at open(); lazy ones
+    serve single rows through load_user() and answer ranking queries themselves.
+    """
+    lazy = False
+    # Highest coin-ledger sequence number already reflected in stored records.
+    ledger_seq = 0
+
+    async def open(self) -> Dict[str, UserData]:
+        raise NotImplementedError
+
+    async def flush(self, records: Dict[str, UserData], compact: bool = False, ledger_seq: Optional[int] = None) -> bool:
+        raise NotImplementedError
+
+    async def import_users(self, users: Dict[str, UserData]) -> None:
+        raise NotImplementedError
+
+    async def export(self) -> bytes:
+        """Full snapshot in the bot_data.json format, built off the event loop."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+class JsonStorage(Storage):
+    """Snapshot in LOCAL_BACKUP_FILE plus an append-only journal of changed records.
+
+    Each record's compact JSON is cached once it is journaled, so a snapshot
+    is just a join of cached fragments and can be built off the event loop.
+
+    The cache is the price of that: one UTF-8 fragment per user, for every
+    user, on top of the records DataManager already keeps (roughly 300 bytes
+    each; bytes rather than str, since one emoji in a name would widen a str
+    to four bytes per character). Caching only recently dirty users would
+    mean re-parsing the old snapshot at compaction, which holds the GIL for
+    the whole file and brings back the stall. Populations that outgrow this
+    belong on the SQLite backend, which caches nothing.
+    """
+
+    def __init__(self, snapshot_path: str = LOCAL_BACKUP_FILE, journal_path: str = JOURNAL_FILE):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self._journal_records = 0
+        self._fragments: Dict[str, bytes] = {}
+
+    async def open(self) -> Dict[str, UserData]:
+        data = await self.load()
+        if data:
+            await self.import_users(data)
+        return data
+
+    async def load(self) -> Dict[str, UserData]:
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self._read_snapshot)
+        await self.replay_journal(data)
+        return data
+
+    def _read_snapshot(self) -> Dict[str, UserData]:
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                raw = f.read()
+            if raw[:2] == b'\x1f\x8b':
+                raw = gzip.decompress(raw)
+            return json.loads(raw.decode('utf-8'))
+        except (FileNotFoundError, OSError, json.JSONDecodeError, UnicodeDecodeError):
+            return {}
+
+    async def flush(self, records: Dict[str, UserData], compact: bool = False, ledger_seq: Optional[int] = None) -> bool:
+        if compact or self._journal_records + len(records) >= JOURNAL_COMPACT_THRESHOLD:
+            if not await self.compact(records, ledger_seq):
+                return False
+            logger.info(f"Compacted journal into snapshot ({len(self._fragments)} users).")
+            return True
+        if not records:
+            return True
+        if not await self._write(self.journal_path, self.encode_journal(records, ledger_seq), 'a'):
+            return False
+        self._journal_records += len(records)
+        if ledger_seq is not None:
+            self.ledger_seq = max(self.ledger_seq, ledger_seq)
+        return True
+
+    async def import_users(self, users: Dict[str, UserData]) -> None:
+        """Re-encode every record (in a worker, the dict is not shared yet) and snapshot it."""
+        loop = asyncio.get_running_loop()
+        self._fragments = await loop.run_in_executor(None, lambda: {str(uid): _compact_json(user).encode('utf-8') for uid, user in users.items()})
+        await self.compact()
+
     @staticmethod
-    async def save(data: Dict) -> None:
+    async def _write(path: str, payload: str, mode: str) -> bool:
+        """Write and fsync; the ledger is only truncated behind durable records."""
         try:
-            async with aiofiles.open(LOCAL_BACKUP_FILE, 'w', encoding='utf-8') as f:
-                await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+            async with aiofiles.open(path, mode, encoding='utf-8') as f:
+                await f.write(payload)
+                await f.flush()
+                await asyncio.get_running_loop().run_in_executor(None, os.fsync, f.fileno())
+            return True
         except Exception as e:
-            logger.error(f"Async save failed: {e}")
+            logger.error(f"Async write to {path} failed: {e}")
+            return False
+
+    def encode_journal(self, records: Dict[str, UserData], ledger_seq: Optional[int] = None) -> str:
+        lines = []
+        for uid, data in records.items():
+            fragment = _compact_json(data)
+            self._fragments[uid] = fragment.encode('utf-8')
+            lines.append(f'{{"uid":{json.dumps(uid)},"data":{fragment}}}\n')
+        if ledger_seq is not None:
+            lines.append(self._ledger_marker(ledger_seq))
+        return ''.join(lines)
 
     @staticmethod
-    async def load() -> Dict:
-        if not os.path.exists(LOCAL_BACKUP_FILE):
-            return {}
+    def _ledger_marker(ledger_seq: int) -> str:
+        return f'{{"ledger_seq":{ledger_seq}}}\n'
+
+    async def replay_journal(self, data: Dict) -> int:
+        """Apply journaled records on top of the snapshot; the last line for a uid wins."""
+        if not os.path.exists(self.journal_path):
+            return 0
+        applied = 0
+        async with aiofiles.open(self.journal_path, 'r', encoding='utf-8') as f:
+            async for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping torn journal line.")
+                    continue
+                if 'ledger_seq' in entry:
+                    self.ledger_seq = max(self.ledger_seq, entry['ledger_seq'])
+                    continue
+                data[entry['uid']] = entry['data']
+                applied += 1
+        if applied:
+            logger.info(f"Replayed {applied} journal records.")
+        return applied
+
+    async def compact(self, records: Optional[Dict[str, UserData]] = None, ledger_seq: Optional[int] = None) -> bool:
+        """Fold the journal into a fresh snapshot and start a new journal.
+
+        Pending records are encoded on the same tick as the fragment copy and
+        journaled first, so a crash before the truncate replays to the same state.
+        The new journal starts with the ledger watermark the snapshot covers.
+        Returns False if any step failed to reach the disk.
+        """
+        journal = self.encode_journal(records or {}, ledger_seq)
+        ledger_seq = max(self.ledger_seq, ledger_seq or 0)
+        fragments = self._fragments.copy()
+        if journal and not await self._write(self.journal_path, journal, 'a'):
+            return False
+        loop = asyncio.get_running_loop()
         try:
-            async with aiofiles.open(LOCAL_BACKUP_FILE, 'r', encoding='utf-8') as f:
-                return json.loads(await f.read())
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
+            await loop.run_in_executor(None, self._write_snapshot, fragments)
+            # Replaced atomically: a torn marker would lose the watermark and
+            # replay ledger entries the snapshot already contains.
+            marker = self._ledger_marker(ledger_seq).encode('utf-8')
+            await loop.run_in_executor(None, atomic_write, self.journal_path, [marker])
+        except OSError as e:
+            logger.error(f"Snapshot write failed: {e}")
+            return False
+        self._journal_records = 0
+        self.ledger_seq = ledger_seq
+        return True
+
+    async def export(self) -> bytes:
+        fragments = self._fragments.copy()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: b''.join(self._snapshot_chunks(fragments)))
+
+    def _write_snapshot(self, fragments: Dict[str, bytes]) -> None:
+        atomic_write(self.snapshot_path, self._snapshot_chunks(fragments), compress=SNAPSHOT_COMPRESS)
+
+    @staticmethod
+    def _snapshot_chunks(fragments: Dict[str, bytes], batch: int = 1000) -> Iterator[bytes]:
+        # Small chunks keep each GIL-holding step short while the loop keeps running.
+        items = iter(fragments.items())
+        sep = b'{'
+        while True:
+            part = [b'%s:%s' % (json.dumps(uid).encode('utf-8'), frag) for uid, frag in itertools.islice(items, batch)]
+            if not part:
+                break
+            yield sep + b','.join(part)
+            sep = b','
+        yield b'{}' if sep == b'{' else b'}'
+
+class SqliteStorage(Storage):
+    """One row per user in SQLite (WAL mode) with indexed ranking columns.
+
+    All statements run on a single worker thread; rows are encoded on the
+    event loop so the thread never sees a record mid-mutation.
+    """
+    lazy = True
+    RANK_COLUMNS = ('coins', 'total_exp')
+
+    def __init__(self, path: str = SQLITE_DB_FILE):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self) -> None:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # FULL so a commit is on disk before the coin ledger is truncated behind it.
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                username TEXT,
+                coins REAL NOT NULL DEFAULT 0,
+                total_exp REAL NOT NULL DEFAULT 0,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_users_coins ON users(coins);
+            CREATE INDEX IF NOT EXISTS idx_users_total_exp ON users(total_exp);
+            CREATE INDEX IF NOT EXISTS idx_users_username ON users(username COLLATE NOCASE);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        conn.commit()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'ledger_seq'").fetchone()
+        self.ledger_seq = int(row[0]) if row else 0
+        self._conn = conn
+
+    async def open(self) -> Dict[str, UserData]:
+        await self._run(self._connect)
+        if await self.is_empty() and (os.path.exists(LOCAL_BACKUP_FILE) or os.path.exists(JOURNAL_FILE)):
+            legacy_storage = JsonStorage()
+            legacy = await legacy_storage.load()
+            if legacy:
+                await self._run(self._upsert, [self._row(str(uid), user) for uid, user in legacy.items()], legacy_storage.ledger_seq)
+                logger.info(f"Migrated {len(legacy)} users from {LOCAL_BACKUP_FILE} to SQLite.")
+        return {}
+
+    async def is_empty(self) -> bool:
+        return await self._run(lambda: self._conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None)
+
+    @staticmethod
+    def _row(uid: str, user: UserData) -> Tuple:
+        return (uid, user.get('username', ''), user.get('coins', 0), user.get('total_exp', 0), _compact_json(user))
+
+    def _upsert(self, rows: List[Tuple], ledger_seq: Optional[int] = None) -> None:
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO users (user_id, username, coins, total_exp, data) VALUES (?, ?, ?, ?, ?)", rows)
+            if ledger_seq is not None and ledger_seq > self.ledger_seq:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('ledger_seq', ?)", (str(ledger_seq),))
+                self.ledger_seq = ledger_seq
+
+    async def flush(self, records: Dict[str, UserData], compact: bool = False, ledger_seq: Optional[int] = None) -> bool:
+        rows = [self._row(uid, user) for uid, user in records.items()]
+        try:
+            if rows:
+                await self._run(self._upsert, rows, ledger_seq)
+            if compact:
+                await self._run(lambda: self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)"))
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"SQLite flush failed: {e}")
+            return False
+
+    async def import_users(self, users: Dict[str, UserData]) -> None:
+        await self._run(self._upsert, [self._row(str(uid), user) for uid, user in users.items()])
+
+    async def export(self) -> bytes:
+        def build() -> bytes:
+            rows = self._conn.execute("SELECT user_id, data FROM users").fetchall()
+            return ('{' + ','.join(f'{json.dumps(uid)}:{data}' for uid, data in rows) + '}').encode('utf-8')
+        return await self._run(build)
+
+    async def load_user(self, uid: str) -> Optional[UserData]:
+        row = await self._run(lambda: self._conn.execute("SELECT data FROM users WHERE user_id = ?", (uid,)).fetchone())
+        return json.loads(row[0]) if row else None
+
+    async def top_users(self, key: str, limit: int) -> List[UserData]:
+        if key not in self.RANK_COLUMNS:
+            raise ValueError(f"Unsupported ranking key: {key}")
+        rows = await self._run(lambda: self._conn.execute(f"SELECT data FROM users ORDER BY {key} DESC LIMIT ?", (limit,)).fetchall())
+        return [json.loads(r[0]) for r in rows]
+
+    async def count_above(self, key: str, value: float) -> int:
+        if key not in self.RANK_COLUMNS:
+            raise ValueError(f"Unsupported ranking key: {key}")
+        return await self._run(lambda: self._conn.execute(f"SELECT COUNT(*) FROM users WHERE {key} > ?", (value,)).fetchone()[0])
+
+    async def count_users(self) -> int:
+        return await self._run(lambda: self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+
+    async def count_by_band(self, key: str, bounds: List[float]) -> List[int]:
+        """Rows per [bounds[i], bounds[i + 1]) band in one grouped scan; band 0 also takes anything lower."""
+        if key not in self.RANK_COLUMNS:
+            raise ValueError(f"Unsupported ranking key: {key}")
+        cases = ' '.join(f"WHEN {key} >= ? THEN {i}" for i in range(len(bounds) - 1, 0, -1))
+        sql = f"SELECT CASE {cases} ELSE 0 END AS band, COUNT(*) FROM users GROUP BY band"
+        rows = await self._run(lambda: self._conn.execute(sql, bounds[:0:-1]).fetchall())
+        counts = [0] * len(bounds)
+        for band, n in rows:
+            counts[band] = n
+        return counts
+
+    async def find_by_username(self, username: str) -> Optional[str]:
+        row = await self._run(lambda: self._conn.execute("SELECT user_id FROM users WHERE username = ? COLLATE NOCASE LIMIT 1", (username,)).fetchone())
+        return row[0] if row else None
+
+    async def close(self) -> None:
+        if self._conn:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+def create_storage() -> Storage:
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteStorage()
+    return JsonStorage()
+
+class GitHubReplicator:
+    """Pushes player snapshots back to GITHUB_REPO on a fixed cadence.
+
+    Every PyGithub call runs in the default executor. A push is skipped when
+    the snapshot hash matches the last pushed (or fetched) content and is
+    deferred while the API quota is below GITHUB_RATE_LIMIT_RESERVE. `repo`
+    only needs get_contents/create_file/update_file, so a local fake works.
+    """
+
+    def __init__(self, repo, snapshot_fn: Callable[[], Awaitable[bytes]], interval: float = GITHUB_PUSH_INTERVAL,
+                 path: str = GITHUB_FILE_PATH, rate_limit_fn: Optional[Callable[[], Tuple[int, float]]] = None):
+        self.repo = repo
+        self.snapshot_fn = snapshot_fn
+        self.interval = interval
+        self.path = path
+        self.rate_limit_fn = rate_limit_fn
+        self.pushes = 0
+        self.skipped = 0
+        self._sha: Optional[str] = None
+        self._digest: Optional[str] = None
+        self._remote_checked = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def _call(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+    def start(self):
+        self._task = asyncio.create_task(self._push_loop())
+
+    async def stop(self, final_push: bool = True):
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if final_push:
+            await self.push_once()
+
+    async def _push_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                backoff = await self.push_once()
+            except Exception as e:
+                logger.error(f"GitHub push failed: {e}")
+                continue
+            if backoff > 0:
+                logger.warning(f"GitHub push deferred for {backoff:.0f}s.")
+                await asyncio.sleep(backoff)
+
+    async def push_once(self) -> float:
+        """Push the current snapshot if it changed; returns seconds to back off."""
+        payload = await self.snapshot_fn()
+        digest = hashlib.sha256(payload).hexdigest()
+        if not self._remote_checked:
+            await self._fetch_remote()
+        if digest == self._digest:
+            self.skipped += 1
+            return 0
+        backoff = await self._rate_limit_backoff()
+        if backoff > 0:
+            return backoff
+        message = f"Auto backup {datetime.now(VIETNAM_TZ):%Y-%m-%d %H:%M}"
+        try:
+            if self._sha:
+                result = await self._call(self.repo.update_file, self.path, message, payload, self._sha)
+            else:
+                result = await self._call(self.repo.create_file, self.path, message, payload)
+        except GithubException as e:
+            # A stale sha (409) or quota error: refetch before the next attempt.
+            self._remote_checked = False
+            return self._retry_after(e)
+        self._sha = result['content'].sha
+        self._digest = digest
+        self.pushes += 1
+        logger.info(f"Pushed {len(payload)} bytes to GitHub.")
+        return 0
+
+    async def _fetch_remote(self):
+        try:
+            contents = await self._call(self.repo.get_contents, self.path)
+        except UnknownObjectException:
+            self._sha, self._digest = None, None
+        else:
+            self._sha = contents.sha
+            self._digest = hashlib.sha256(base64.b64decode(contents.content)).hexdigest()
+        self._remote_checked = True
+
+    async def _rate_limit_backoff(self) -> float:
+        if not self.rate_limit_fn:
+            return 0
+        remaining, reset_at = await self._call(self.rate_limit_fn)
+        if remaining >= GITHUB_RATE_LIMIT_RESERVE:
+            return 0
+        return max(0.0, reset_at - time.time())
+
+    @staticmethod
+    def _retry_after(e: GithubException) -> float:
+        headers = {k.lower(): v for k, v in (e.headers or {}).items()}
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+        if headers.get('x-ratelimit-remaining') == '0' and 'x-ratelimit-reset' in headers:
+            return max(0.0, float(headers['x-ratelimit-reset']) - time.time())
+        logger.error(f"GitHub push failed: {e}")
+        return 0
+
+class CoinLedger:
+    """Append-only, group-committed log of coin/EXP deltas.
+
+    Entries are buffered and written with one fsync per batch; callers await
+    the batch carrying their entry. Entries already covered by a storage
+    flush are dropped by truncate_through().
+    """
+
+    def __init__(self, path: str = LEDGER_FILE, commit_interval: float = LEDGER_COMMIT_INTERVAL):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.seq = 0
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._truncate_seq: Optional[int] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ledger')
+
+    @staticmethod
+    def _parse(line: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return None
+
+    def _repair_tail(self):
+        """Drop a torn last line (or terminate a complete one) so the next append starts on a fresh line."""
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if not data or data.endswith(b'\n'):
+                return
+            start = data.rfind(b'\n') + 1
+            if self._parse(data[start:].decode('utf-8', 'replace')) is not None:
+                f.write(b'\n')
+            else:
+                logger.warning("Dropping torn ledger tail.")
+                f.truncate(start)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_entries(self, after_seq: int) -> List[Dict[str, Any]]:
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        self._repair_tail()
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                entry = self._parse(line)
+                if entry is None:
+                    logger.warning("Skipping torn ledger line.")
+                    continue
+                self.seq = max(self.seq, entry['seq'])
+                if entry['seq'] > after_seq:
+                    entries.append(entry)
+        self.seq = max(self.seq, after_seq)
+        return entries
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._writer_loop())
+
+    def append(self, uid: str, coins: float, exp: float, memo: Optional[str] = None) -> Optional[asyncio.Future]:
+        if not self._task:
+            return None
+        self.seq += 1
+        entry = {"seq": self.seq, "uid": uid, "coins": coins, "exp": exp}
+        if memo:
+            entry["memo"] = memo
+        line = _compact_json(entry) + '\n'
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((line, fut))
+        self._wakeup.set()
+        return fut
+
+    def truncate_through(self, seq: int):
+        if not self._task:
+            return
+        self._truncate_seq = max(self._truncate_seq or 0, seq)
+        self._wakeup.set()
+
+    async def _writer_loop(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.commit_interval)
+            self._wakeup.clear()
+            await self._commit()
+
+    async def _commit(self):
+        batch, self._pending = self._pending, []
+        truncate_seq, self._truncate_seq = self._truncate_seq, None
+        payload = ''.join(line for line, _ in batch)
+        ok = False
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, payload, truncate_seq)
+            ok = True
+        except Exception as e:
+            logger.error(f"Ledger commit failed: {e}")
+        finally:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_result(ok)
+
+    def _write_batch(self, payload: str, truncate_seq: Optional[int]):
+        if payload:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError:
+                with contextlib.suppress(OSError):
+                    self._repair_tail()
+                raise
+        if truncate_seq is not None and os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+                keep = []
+                for line in f:
+                    entry = self._parse(line)
+                    if entry and entry['seq'] > truncate_seq:
+                        keep.append(line)
+            atomic_write(self.path, [''.join(keep).encode('utf-8')])
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            await self._commit()
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+class LeaderboardIndex:
+    """Order-statistics index over one numeric user field, highest first.
+
+    Entries (-value, uid) live in sorted buckets of about LOAD items, so an
+    update is a bisect plus a small list insert, top-N walks the first
+    buckets, and a rank is a bisect plus a sum over bucket sizes.
+    """
+
+    LOAD = 1000
+
+    def __init__(self, key: str):
+        self.key = key
+        self._values: Dict[str, float] = {}
+        self._buckets: List[List[Tuple[float, str]]] = []
+        self._maxes: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def rebuild(self, users: Dict[str, UserData]):
+        self._values = {uid: u.get(self.key, 0) for uid, u in users.items()}
+        items = sorted((-v, uid) for uid, v in self._values.items())
+        self._buckets = [items[i:i + self.LOAD] for i in range(0, len(items), self.LOAD)]
+        self._maxes = [b[-1] for b in self._buckets]
+
+    def update(self, uid: str, value: float):
+        old = self._values.get(uid)
+        if old is not None:
+            if old == value:
+                return
+            self._remove((-old, uid))
+        self._values[uid] = value
+        self._insert((-value, uid))
+
+    def _insert(self, item: Tuple[float, str]):
+        if not self._buckets:
+            self._buckets.append([item])
+            self._maxes.append(item)
+            return
+        i = bisect.bisect_left(self._maxes, item)
+        if i == len(self._buckets):
+            i -= 1
+            self._buckets[i].append(item)
+            self._maxes[i] = item
+        else:
+            bisect.insort(self._buckets[i], item)
+        bucket = self._buckets[i]
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[i:i + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._maxes[i:i + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+
+    def _remove(self, item: Tuple[float, str]):
+        i = bisect.bisect_left(self._maxes, item)
+        bucket = self._buckets[i]
+        del bucket[bisect.bisect_left(bucket, item)]
+        if bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+
+    def top(self, limit: int) -> List[str]:
+        return [uid for _, uid in itertools.islice(itertools.chain.from_iterable(self._buckets), limit)]
+
+    def count_above(self, value: float) -> int:
+        item = (-value, '')
+        i = bisect.bisect_left(self._maxes, item)
+        if i == len(self._buckets):
+            return len(self._values)
+        return sum(len(b) for b in self._buckets[:i]) + bisect.bisect_left(self._buckets[i], item)
+
+class FenwickTree:
+    """Binary indexed tree of counts: point add and prefix sum in O(log n)."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._tree = [0] * (size + 1)
+
+    def add(self, i: int, delta: int):
+        i += 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i: int) -> int:
+        """Sum of counts in buckets [0, i)."""
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+class BucketHistogram:
+    """Population of users per value bucket, kept in a Fenwick tree.
+
+    Bucket i holds values in [bounds[i], bounds[i + 1]); values below
+    bounds[0] fall into bucket 0.
+    """
+
+    def __init__(self, key: str, bounds: Iterable[float]):
+        self.key = key
+        self.bounds = sorted(set(bounds))
+        self._tree = FenwickTree(len(self.bounds))
+        self._buckets: Dict[str, int] = {}
+
+    @property
+    def total(self) -> int:
+        return len(self._buckets)
+
+    def bucket(self, value: float) -> int:
+        return max(bisect.bisect_right(self.bounds, value or 0) - 1, 0)
+
+    def rebuild(self, users: Dict[str, UserData]):
+        self._tree = FenwickTree(len(self.bounds))
+        self._buckets = {}
+        for uid, u in users.items():
+            self.update(uid, u.get(self.key, 0))
+
+    def update(self, uid: str, value: float):
+        b = self.bucket(value)
+        old = self._buckets.get(uid)
+        if old == b:
+            return
+        if old is not None:
+            self._tree.add(old, -1)
+        self._buckets[uid] = b
+        self._tree.add(b, 1)
+
+    def count_at_least(self, value: float) -> int:
+        """Users whose bucket starts at or above value's bucket."""
+        return self.total - self._tree.prefix(self.bucket(value))
+
+    def count_above(self, value: float) -> int:
+        """Users in buckets strictly above value's bucket."""
+        return self.total - self._tree.prefix(self.bucket(value) + 1)
+
+def _migrate_v1(user: UserData):
+    """Fill the fields added after the original schema and drop finished minigames."""
+    defaults = {
+        'total_exp': 0, 'minigames': {},
+        'stats': {'cl_win': 0, 'cl_lose': 0, 'hl_win': 0, 'hl_lose': 0},
+        'daily_streak': 0, 'last_daily': None,
+        'minigame_streaks': {}
+    }
+    for k, v in defaults.items():
+        user.setdefault(k, v)
+    user['minigames'] = {name: game for name, game in (user['minigames'] or {}).items()
+                         if game and not game.get('game_over', True)}
+
+def _migrate_v2(user: UserData):
+    """Re-encode dict-shaped minigame state positionally."""
+    for name, state in user['minigames'].items():
+        if isinstance(state, dict) and name in GAME_REGISTRY:
+            user['minigames'][name] = GAME_REGISTRY[name].from_state(state).to_state()
+
+# MIGRATIONS[i] upgrades a record from schema version i to i + 1.
+MIGRATIONS: List[Callable[[UserData], None]] = [_migrate_v1, _migrate_v2]
+
+def migrate_user(user: UserData) -> bool:
+    """Bring a record up to SCHEMA_VERSION in place; True if anything ran."""
+    version = user.get('schema_version', 0)
+    if version >= SCHEMA_VERSION:
+        return False
+    for step in MIGRATIONS[version:]:
+        step(user)
+    user['schema_version'] = SCHEMA_VERSION
+    return True
+
+_UNSET = object()
+
+class UserRecord(MutableMapping):
+    """Slotted stand-in for a user dict, used when COMPACT_USER_STORE is set.
+
+    Known fields live in slots and anything else in a small overflow dict.
+    Nested dicts in LAZY stay None until touched, and shrink() drops them
+    again once they are back to their empty value. to_dict() produces the
+    same JSON as the plain dict form, so snapshots stay interchangeable.
+    """
+
+    FIELDS = ('user_id', 'username', 'coins', 'total_exp', 'daily_streak', 'last_daily',
+              'created_at', 'schema_version', 'stats', 'minigames', 'minigame_streaks')
+    LAZY: Dict[str, Callable[[], Dict]] = {
+        'stats': lambda: {'cl_win': 0, 'cl_lose': 0, 'hl_win': 0, 'hl_lose': 0},
+        'minigames': dict,
+        'minigame_streaks': dict,
+    }
+    __slots__ = FIELDS + ('_extra',)
+    _SLOTS = frozenset(FIELDS)
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        for field in self.FIELDS:
+            setattr(self, field, _UNSET)
+        self._extra: Optional[Dict[str, Any]] = None
+        if data:
+            for k, v in data.items():
+                self[k] = v
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._SLOTS:
+            value = getattr(self, key)
+            if value is _UNSET:
+                raise KeyError(key)
+            if value is None and key in self.LAZY:
+                value = self.LAZY[key]()
+                setattr(self, key, value)
+            return value
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key: str, value: Any):
+        if key in self._SLOTS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key: str):
+        if key in self._SLOTS:
+            if getattr(self, key) is _UNSET:
+                raise KeyError(key)
+            setattr(self, key, _UNSET)
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        for field in self.FIELDS:
+            if getattr(self, field) is not _UNSET:
+                yield field
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.to_dict()!r})"
+
+    def shrink(self):
+        for field, empty in self.LAZY.items():
+            value = getattr(self, field)
+            if value is not None and value is not _UNSET and value == empty():
+                setattr(self, field, None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        for k in self:
+            value = getattr(self, k) if k in self._SLOTS else self._extra[k]
+            data[k] = self.LAZY[k]() if value is None and k in self.LAZY else value
+        return data
 
 class DataManager:
     def __init__(self):
         self.users: Dict[str, UserData] = {}
-        self.lock = asyncio.Lock()
-        self.github = Github(GITHUB_TOKEN) if GITHUB_TOKEN else None
-        self.repo = self.github.get_repo(GITHUB_REPO) if self.github else None
+        # Striped per-user locks; unrelated users rarely share a stripe.
+        self._user_locks = [asyncio.Lock() for _ in range(USER_LOCK_STRIPES)]
+        self.storage = create_storage()
+        self.github = Github(GITHUB_TOKEN, base_url=GITHUB_API_URL) if GITHUB_TOKEN else None
+        self.repo = None
+        self.replicator: Optional[GitHubReplicator] = None
         self._autosave_task: Optional[asyncio.Task] = None
+        self._dirty: Set[str] = set()
+        self._flush_lock = asyncio.Lock()
+        self.ledger = CoinLedger()
+        # (coins, total_exp) as of the last ledger entry, for users in or just
+        # out of a transaction; flush() drops the idle ones.
+        self._ledger_base: Dict[str, Tuple[float, float]] = {}
+        # Only used by eager storage; the SQLite backend ranks with its own indexes.
+        self.leaderboards = {key: LeaderboardIndex(key) for key in LEADERBOARD_KEYS}
+        self.histograms = {
+            'coins': BucketHistogram('coins', HISTOGRAM_BOUNDS),
+            'total_exp': BucketHistogram('total_exp', HISTOGRAM_BOUNDS + RANK_THRESHOLDS),
+        }
+        # Lower-cased @username -> uid, plus the reverse so renames drop the old name.
+        self._usernames: Dict[str, str] = {}
+        self._username_of: Dict[str, str] = {}
 
     async def initialize(self):
-        self.users = await Storage.load()
-        if not self.users:
+        if self.github:
+            loop = asyncio.get_running_loop()
+            try:
+                self.repo = await loop.run_in_executor(None, self.github.get_repo, GITHUB_REPO)
+            except GithubException as e:
+                logger.error(f"Cannot open GitHub repo {GITHUB_REPO}: {e}")
+        self.users = await self.storage.open()
+        if not self.users and (not self.storage.lazy or await self.storage.is_empty()):
             await self.sync_from_github()
+        self._migrate_all()
+        self._reindex()
+        self.ledger.start()
+        await self.replay_ledger()
         self._autosave_task = asyncio.create_task(self.auto_save_loop())
+        if self.repo and GITHUB_PUSH_INTERVAL > 0:
+            github = self.github
+            self.replicator = GitHubReplicator(self.repo, self.export_snapshot,
+                                               rate_limit_fn=lambda: (github.rate_limiting[0], github.rate_limiting_resettime))
+            self.replicator.start()
+
+    async def export_snapshot(self) -> bytes:
+        await self.flush()
+        return await self.storage.export()
+
+    async def replay_ledger(self):
+        """Re-apply coin/EXP deltas logged after the last persisted flush."""
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(None, self.ledger.read_entries, self.storage.ledger_seq)
+        for entry in entries:
+            user = await self.get_user(entry['uid'])
+            user['coins'] = user.get('coins', 0) + entry['coins']
+            user['total_exp'] = user.get('total_exp', 0) + entry['exp']
+            self._dirty.add(str(entry['uid']))
+            self._index(str(entry['uid']), user)
+        self._ledger_base.clear()
+        if entries:
+            logger.info(f"Replayed {len(entries)} ledger entries.")
+            await self.flush()
+        else:
+            self.ledger.truncate_through(self.ledger.seq)
+
+    async def flush(self, compact: bool = False, truncate_ledger: bool = True):
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, set()
+            # Records are encoded before the first await, so later edits stay dirty.
+            records = {uid: self.users[uid] for uid in dirty if uid in self.users}
+            ledger_seq = self.ledger.seq
+            if not await self.storage.flush(records, compact, ledger_seq):
+                self._dirty |= dirty
+                return
+            if truncate_ledger:
+                self.ledger.truncate_through(ledger_seq)
+            self._prune_ledger_base()
+
+    def _prune_ledger_base(self):
+        # Outside a transaction every delta is already ledgered, so an idle
+        # user's base equals its record and the next transaction re-reads it.
+        stripes = len(self._user_locks)
+        self._ledger_base = {uid: base for uid, base in self._ledger_base.items()
+                             if self._user_locks[hash(uid) % stripes].locked()}
+
+    async def _flush_for_read(self):
+        """Make pending records visible to lazy storage's ranking queries.
+
+        A no-op once nothing is dirty or mid-flush, so a view that runs several
+        queries pays for at most one upsert; the ledger is left for autosave to
+        truncate.
+        """
+        if self._dirty or self._flush_lock.locked():
+            await self.flush(truncate_ledger=False)
 
     async def sync_from_github(self):
         if not self.repo:
@@ -203,8 +1508,10 @@ class DataManager:
         loop = asyncio.get_event_loop()
         try:
             file_content = await loop.run_in_executor(None, self.repo.get_contents, GITHUB_FILE_PATH)
-            self.users = json.loads(base64.b64decode(file_content.content).decode())
-            await Storage.save(self.users)
+            users = json.loads(base64.b64decode(file_content.content).decode())
+            await self.storage.import_users(users)
+            if not self.storage.lazy:
+                self.users = users
             logger.info("Successfully synced from GitHub.")
         except Exception as e:
             logger.error(f"GitHub sync failed: {e}")
@@ -212,46 +1519,227 @@ class DataManager:
     async def auto_save_loop(self):
         while True:
             await asyncio.sleep(SAVE_INTERVAL)
-            async with self.lock:
-                await Storage.save(self.users)
-            logger.debug("Autosave complete.")
+            if not self._dirty:
+                continue
+            count = len(self._dirty)
+            await self.flush()
+            logger.debug(f"Autosave complete ({count} users).")
 
     async def get_user(self, uid: int) -> UserData:
         uid_str = str(uid)
-        async with self.lock:
-            user = self.users.get(uid_str)
-            if not user:
-                user = self.users[uid_str] = self.new_user(uid_str)
-            
-            defaults = {
-                'total_exp': 0, 'minigames': {},
-                'stats': {'cl_win': 0, 'cl_lose': 0, 'hl_win': 0, 'hl_lose': 0},
-                'daily_streak': 0, 'last_daily': None,
-                'minigame_streaks': {}
-            }
-            for k, v in defaults.items():
-                user.setdefault(k, v)
+        loaded = None
+        if self.storage.lazy and uid_str not in self.users:
+            loaded = await self.storage.load_user(uid_str)
+        user = self.users.get(uid_str)
+        if not user:
+            if loaded:
+                if migrate_user(loaded):
+                    self._dirty.add(uid_str)
+                user = self.users[uid_str] = self._compact(uid_str, loaded)
+            else:
+                user = self.users[uid_str] = self._compact(uid_str, self.new_user(uid_str))
+                self._dirty.add(uid_str)
+                self._index(uid_str, user)
+        return user
+
+    async def update_user(self, uid: int, data: UserData, memo: Optional[str] = None):
+        committed = self._stage(uid, data, memo)
+        if committed:
+            await committed
+
+    def _stage(self, uid: int, data: UserData, memo: Optional[str] = None) -> Optional[asyncio.Future]:
+        """Store, index and ledger one record without yielding; returns the ledger commit to await."""
+        uid_str = str(uid)
+        if isinstance(data, UserRecord):
+            data.shrink()
+        self.users[uid_str] = data
+        self._dirty.add(uid_str)
+        self._index(uid_str, data)
+        return self._log_deltas(uid_str, data, memo)
+
+    def _migrate_all(self):
+        migrated = [uid for uid, user in self.users.items() if migrate_user(user)]
+        if migrated:
+            self._dirty.update(migrated)
+            logger.info(f"Migrated {len(migrated)} users to schema v{SCHEMA_VERSION}.")
+        if COMPACT_USER_STORE:
+            for uid, user in self.users.items():
+                self.users[uid] = self._compact(uid, user)
 
-            for game_name, game_obj_dict in list(user['minigames'].items()):
-                if not game_obj_dict or game_obj_dict.get('game_over', True):
-                    del user['minigames'][game_name]
+    @staticmethod
+    def _compact(uid_str: str, user: UserData) -> UserData:
+        if not COMPACT_USER_STORE or isinstance(user, UserRecord):
             return user
-
-    async def update_user(self, uid: int, data: UserData):
-        async with self.lock:
-            self.users[str(uid)] = data
+        record = UserRecord(user)
+        if record.user_id == uid_str:
+            record.user_id = uid_str  # share the key's string object
+        record.shrink()
+        return record
+
+    def _reindex(self):
+        if self.storage.lazy:
+            return
+        for index in itertools.chain(self.leaderboards.values(), self.histograms.values()):
+            index.rebuild(self.users)
+        self._usernames.clear()
+        self._username_of.clear()
+        for uid_str, user in self.users.items():
+            self._index_username(uid_str, user.get('username'))
+
+    def _index(self, uid_str: str, user: UserData):
+        if self.storage.lazy:
+            return
+        for index in itertools.chain(self.leaderboards.values(), self.histograms.values()):
+            index.update(uid_str, user.get(index.key, 0))
+        self._index_username(uid_str, user.get('username'))
+
+    def _index_username(self, uid_str: str, username: Optional[str]):
+        key = username.lower() if username and username.startswith('@') else None
+        old = self._username_of.get(uid_str)
+        if old == key:
+            return
+        # Only drop the old name if this user still owns it; someone else may
+        # have claimed it since.
+        if old is not None and self._usernames.get(old) == uid_str:
+            del self._usernames[old]
+        if key is None:
+            self._username_of.pop(uid_str, None)
+        else:
+            self._username_of[uid_str] = key
+            self._usernames[key] = uid_str
+
+    def _track(self, uid_str: str, user: UserData):
+        self._ledger_base.setdefault(uid_str, (user.get('coins', 0), user.get('total_exp', 0)))
+
+    def _log_deltas(self, uid_str: str, user: UserData, memo: Optional[str] = None) -> Optional[asyncio.Future]:
+        coins, exp = user.get('coins', 0), user.get('total_exp', 0)
+        base_coins, base_exp = self._ledger_base.get(uid_str, (coins, exp))
+        self._ledger_base[uid_str] = (coins, exp)
+        if coins == base_coins and exp == base_exp:
+            return None
+        return self.ledger.append(uid_str, coins - base_coins, exp - base_exp, memo)
+
+    @contextlib.asynccontextmanager
+    async def _locked(self, uids: Iterable[Any]):
+        # Stripes are always taken in ascending order, so overlapping
+        # multi-user transactions cannot deadlock.
+        stripes = sorted({hash(str(uid)) % len(self._user_locks) for uid in uids})
+        async with contextlib.AsyncExitStack() as stack:
+            for stripe in stripes:
+                await stack.enter_async_context(self._user_locks[stripe])
+            yield
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, uid: int):
+        """Hold uid's lock while the caller reads and mutates its record; commit on exit.
+
+        An exception escaping the block (typically Rejected, raised before any
+        mutation) skips the commit, so no-op paths never restage the record.
+        """
+        async with self._locked([uid]):
+            user = await self.get_user(uid)
+            self._track(str(uid), user)
+            yield user
+            await self.update_user(uid, user)
+
+    async def transfer(self, src: Optional[int], amounts: Dict[int, float], memo: str = 'transfer') -> Tuple[bool, Dict[int, UserData]]:
+        """Move coins from src to every recipient in `amounts` as one atomic step.
+
+        src=None mints the coins (owner grants). Returns (False, users) without
+        touching any balance when src cannot cover the total.
+        """
+        uids = list(amounts) + ([src] if src is not None else [])
+        async with self._locked(uids):
+            users = {uid: await self.get_user(uid) for uid in uids}
+            for uid, user in users.items():
+                self._track(str(uid), user)
+            total = sum(amounts.values())
+            if src is not None and users[src]['coins'] < total:
+                return False, users
+            if src is not None:
+                users[src]['coins'] -= total
+            for uid, amount in amounts.items():
+                users[uid]['coins'] += amount
+            # Every leg is ledgered before the first await, so a flush can never
+            # snapshot a debited balance under a ledger_seq that misses the transfer.
+            committed = [self._stage(uid, user, memo) for uid, user in users.items()]
+            await asyncio.gather(*(fut for fut in committed if fut))
+        logger.info(f"{memo}: {src if src is not None else 'mint'} -> {amounts}")
+        return True, users
 
     def new_user(self, uid: str) -> UserData:
-        return {"user_id": uid, "username": "", "coins": 100, "created_at": datetime.now().isoformat()}
+        user = {"user_id": uid, "username": "", "coins": 100, "created_at": datetime.now().isoformat()}
+        migrate_user(user)
+        return user
 
     async def get_top_users(self, key: str, limit: int = 10) -> List[UserData]:
-        async with self.lock:
-            return sorted(self.users.values(), key=lambda x: x.get(key, 0), reverse=True)[:limit]
+        if self.storage.lazy:
+            await self._flush_for_read()
+            return await self.storage.top_users(key, limit)
+        if key in self.leaderboards:
+            return [self.users[uid] for uid in self.leaderboards[key].top(limit)]
+        return sorted(self.users.values(), key=lambda x: x.get(key, 0), reverse=True)[:limit]
+
+    async def get_user_position(self, uid: int, key: str) -> Optional[int]:
+        uid_str = str(uid)
+        user = self.users.get(uid_str)
+        if self.storage.lazy:
+            await self._flush_for_read()
+            if user is None:
+                user = await self.storage.load_user(uid_str)
+            if user is None:
+                return None
+            return await self.storage.count_above(key, user.get(key, 0)) + 1
+        if user is None:
+            return None
+        value = user.get(key, 0)
+        if key in self.leaderboards:
+            return self.leaderboards[key].count_above(value) + 1
+        return sum(1 for u in self.users.values() if u.get(key, 0) > value) + 1
+
+    async def get_percentile(self, uid: int, key: str) -> Optional[float]:
+        """Share of players (in %) at or above uid's bucket; smaller is better."""
+        user = await self.get_user(uid)
+        value = user.get(key, 0)
+        if self.storage.lazy:
+            await self._flush_for_read()
+            above, total = await self.storage.count_above(key, value), await self.storage.count_users()
+        else:
+            hist = self.histograms[key]
+            above, total = hist.count_above(value), hist.total
+        if not total:
+            return None
+        return min((above + 1) / total * 100, 100.0)
+
+    async def get_tier_distribution(self) -> List[int]:
+        """Number of players in each entry of RANKS."""
+        if self.storage.lazy:
+            await self._flush_for_read()
+            return await self.storage.count_by_band('total_exp', RANK_THRESHOLDS)
+        hist = self.histograms['total_exp']
+        at_least = [hist.count_at_least(t) for t in RANK_THRESHOLDS]
+        at_least[0] = hist.total
+        return [n - (at_least[i + 1] if i + 1 < len(at_least) else 0) for i, n in enumerate(at_least)]
+
+    async def find_user_by_username(self, username: str) -> Optional[int]:
+        if self.storage.lazy:
+            await self._flush_for_read()
+            uid = await self.storage.find_by_username(username)
+            return int(uid) if uid else None
+        uid = self._usernames.get(username.lower())
+        return int(uid) if uid else None
 
     async def shutdown(self):
         if self._autosave_task:
             self._autosave_task.cancel()
-        await Storage.save(self.users)
+        await self.flush(compact=True)
+        if self.replicator:
+            try:
+                await self.replicator.stop()
+            except Exception as e:
+                logger.error(f"Final GitHub push failed: {e}")
+        await self.ledger.close()
+        await self.storage.close()
         logger.info("DataManager shut down gracefully.")
 
 dm = DataManager()
@@ -279,58 +1767,203 @@ def _update_minigame_streak(user: UserData, game_name: str, won: bool):
             game_streak['guaranteed_win'] = True
             game_streak['losses'] = 0
 
-async def safe_edit_message(bot: Bot, chat_id: int, msg_id: int, text: str, kbd: InlineKeyboardMarkup):
+# Query id -> callback query whose answer is still owed. button_handler defers
+# the answer so it goes out alongside the first edit of that query's message,
+# or carries an alert, instead of costing a separate round trip up front.
+pending_answers: Dict[str, CallbackQuery] = {}
+# The query handled by the current task. An edit only releases this query's
+# answer, never that of another user tapping the same shared message.
+current_query: contextvars.ContextVar[Optional[CallbackQuery]] = contextvars.ContextVar('current_query', default=None)
+
+def defer_answer(q: CallbackQuery) -> bool:
+    if not q.message:
+        return False
+    pending_answers[q.id] = q
+    return True
+
+def release_answer(q: CallbackQuery, text: Optional[str] = None, show_alert: bool = False) -> Optional[Awaitable]:
+    """Return q's owed answer, or None if it was already sent."""
+    pending = pending_answers.pop(q.id, None)
+    if pending is None:
+        return None
+    return _answer(pending, text, show_alert)
+
+async def _answer(q: CallbackQuery, text: Optional[str] = None, show_alert: bool = False):
+    try:
+        await q.answer(text, show_alert=show_alert)
+    except Exception as e:
+        logger.debug(f"Callback answer failed: {e}")
+
+async def answer_alert(update: Update, text: str):
+    q = update.callback_query
+    await (release_answer(q, text, True) or _answer(q, text, True))
+
+class Rejected(Exception):
+    """Raised inside dm.transaction() to leave without committing.
+
+    button_handler shows the message (if any) as an alert once the user's
+    lock has been released, so no Telegram round trip runs under it.
+    """
+
+async def dispatch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await callbacks.dispatch(update, context)
+    except Rejected as e:
+        if e.args:
+            await answer_alert(update, e.args[0])
+
+# (chat_id, message_id) -> hash of the text and keyboard Telegram last accepted for it.
+edit_cache = LRUCache(EDIT_CACHE_SIZE)
+edit_stats = {'sent': 0, 'skipped': 0}
+
+async def safe_edit_message(bot: Bot, chat_id: int, msg_id: int, text: str, kbd: Optional[InlineKeyboardMarkup],
+                            parse_mode: Optional[str] = 'Markdown'):
+    q = current_query.get()
+    owed = None
+    if q and q.message and q.message.chat_id == chat_id and q.message.message_id == msg_id:
+        owed = release_answer(q)
+    if owed:
+        await asyncio.gather(owed, _edit_message(bot, chat_id, msg_id, text, kbd, parse_mode))
+    else:
+        await _edit_message(bot, chat_id, msg_id, text, kbd, parse_mode)
+
+async def _edit_message(bot: Bot, chat_id: int, msg_id: int, text: str, kbd: Optional[InlineKeyboardMarkup],
+                        parse_mode: Optional[str]):
+    key = (chat_id, msg_id)
+    render = hash((text, kbd))
+    if edit_cache.get(key) == render:
+        edit_stats['skipped'] += 1
+        return
+
+    async def edit():
+        # Recorded here rather than by the caller: a coalesced edit may send
+        # someone else's newer text.
+        try:
+            result = await bot.edit_message_text(text, chat_id, msg_id, reply_markup=kbd, parse_mode=parse_mode)
+        except Exception as e:
+            if "message is not modified" in str(e).lower():
+                edit_cache.set(key, render)
+            raise
+        edit_cache.set(key, render)
+        edit_stats['sent'] += 1
+        return result
+
     try:
-        await bot.edit_message_text(text, chat_id, msg_id, reply_markup=kbd, parse_mode='Markdown')
+        await outbound.submit(chat_id, edit, key=key)
     except Exception as e:
         if "message is not modified" not in str(e).lower():
+            edit_cache.pop(key)
             logger.warning(f"Edit failed: {e}")
 
+def _keyboard(*rows: List[Tuple[str, str]]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data) for text, data in row] for row in rows])
+
+# Keyboards are immutable once built, so the static ones are shared by every user.
+MENU_BUTTON = ("↩️ Menu", 'back_menu')
+BACK_KEYBOARD = _keyboard([MENU_BUTTON])
+MENU_KEYBOARD = _keyboard(
+    [("🪙 Tung Đồng Xu", 'game_coinflip'), ("🎰 Máy Xèng", 'game_slots')],
+    [("💎 Kho Báu", 'game_treasure'), ("✊ Oẳn Tù Tì", 'rps_start')],
+    [("🔢 Đoán Số", 'guess_start'), ("🃏 Cao/Thấp", 'game_highlow')],
+    [("🎲 Chẵn Lẻ", 'game_chanle'), ("🎲 Tài Xỉu", 'game_taixiu'), ("🎲 Lắc Xúc Xắc", 'game_diceroll')],
+    [("🎡 Vòng Quay", 'game_luckywheel'), ("🎁 Điểm Danh", 'daily_bonus')],
+    [("📊 Thống Kê", 'stats'), ("🏆 Bảng Xếp Hạng", 'ranking')],
+    [("📖 Hướng Dẫn", 'help')],
+)
+BACK_RANKING_KEYBOARD = _keyboard([("↩️ BXH", 'ranking')])
+RANKING_KEYBOARD = _keyboard([("💰 Top Xu", 'top_coins'), ("⭐ Top Rank", 'top_rank')], [MENU_BUTTON])
+RPS_KEYBOARD = _keyboard([("✌️ Kéo", 'rps_play_scissors'), ("✋ Bao", 'rps_play_paper'), ("✊ Búa", 'rps_play_rock')], [MENU_BUTTON])
+COINFLIP_KEYBOARD = _keyboard([("🪙 Ngửa (Heads)", 'cf_play_heads'), ("🌑 Sấp (Tails)", 'cf_play_tails')], [MENU_BUTTON])
+TREASURE_KEYBOARD = _keyboard([("Rương 1", 'treasure_chest_1'), ("Rương 2", 'treasure_chest_2'), ("Rương 3", 'treasure_chest_3')], [MENU_BUTTON])
+HIGHLOW_KEYBOARD = _keyboard([("⬆️ Cao Hơn", 'hl_play_high'), ("⬇️ Thấp Hơn", 'hl_play_low')], [MENU_BUTTON])
+DICEROLL_KEYBOARD = _keyboard([("🎲 Lắc Xúc Xắc", 'dr_play_roll')], [MENU_BUTTON])
+CHANLE_KEYBOARD = _keyboard([("Chẵn", 'chanle_play_chan'), ("Lẻ", 'chanle_play_le')], [MENU_BUTTON])
+
+HELP_TEXT = """
+📖 **HƯỚNG DẪN CHƠI GAME** 📖
+
+Chào mừng bạn đến với thế giới mini-game!
+
+**📜 QUY TẮC CHUNG**
+- **Cược Mặc Định:** 10% số xu hiện có (tối thiểu 10 xu). Thắng nhận x2.5 tiền cược.
+- **Phần Thưởng EXP:** Mỗi ván thắng được 1,000 EXP.
+- **Bảo Hiểm Thua:** Thua 3 ván liên tiếp = chắc chắn thắng ván tiếp theo!
+
+**🎲 DANH SÁCH TRÒ CHƠI**
+
+- **🪙 Tung Đồng Xu:** 50/50 Sấp hoặc Ngửa
+- **🎰 Máy Xèng:** Quay 3 biểu tượng giống nhau để thắng lớn
+- **💎 Kho Báu:** Chọn 1/3 rương chứa kho báu
+- **✊ Oẳn Tù Tì:** Kéo, Búa, Bao cổ điển
+- **🔢 Đoán Số:** Đoán số từ 1-100
+- **🃏 Cao/Thấp:** Đoán lá bài tiếp theo
+- **🎲 Chẵn Lẻ / Tài Xỉu:** Dựa vào tổng xúc xắc
+- **🎡 Vòng Quay:** Quay nhận thưởng ngẫu nhiên
+
+**🎁 TÍNH NĂNG KHÁC**
+- **/menu:** Menu chính
+- **/stats:** Thống kê cá nhân
+- **/ranking:** Bảng xếp hạng
+- **/daily:** Điểm danh hàng ngày
+- **/tip:** Chuyển xu cho người khác
+
+Chúc bạn chơi game vui vẻ! 🍀
+"""
+
+@functools.lru_cache(maxsize=None)
+def replay_keyboard(callback_data: str, label: str = "Chơi lại") -> InlineKeyboardMarkup:
+    return _keyboard([(label, callback_data), MENU_BUTTON])
+
+@functools.lru_cache(maxsize=1024)
+def taixiu_keyboard(bet: int) -> InlineKeyboardMarkup:
+    return _keyboard([("Tài (11-18)", f'taixiu_tai_{bet}'), ("Xỉu (3-10)", f'taixiu_xiu_{bet}')], [MENU_BUTTON])
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_menu(username: str, rank_index: int, exp: str, coins: str) -> str:
+    """Menu header, cached on the values it displays."""
+    next_rank = RANKS[rank_index + 1] if rank_index + 1 < len(RANKS) else None
+    exp_str = f"{exp} / {fmt(next_rank['exp'])}" if next_rank else exp
+    return f"""
+👤 **{username}**
+- 🏆 **Rank:** {RANKS[rank_index]['name']}
+- ⭐ **EXP:** {exp_str}
+- 💰 **Xu:** {coins}
+"""
+
+# uid -> display name last written for that user; lets unchanged names skip the datastore.
+identity_cache = LRUCache(IDENTITY_CACHE_SIZE)
+
 async def update_username_if_needed(user_id: int, telegram_user: Update.effective_user):
-    db_user = await dm.get_user(user_id)
     new_username = f"@{telegram_user.username}" if telegram_user.username else telegram_user.first_name
-    
+    if identity_cache.get(user_id) == new_username:
+        return
+    db_user = await dm.get_user(user_id)
     if db_user.get("username") != new_username:
-        db_user["username"] = new_username
-        await dm.update_user(user_id, db_user)
+        async with dm.transaction(user_id) as db_user:
+            db_user["username"] = new_username
+    identity_cache.set(user_id, new_username)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user:
         return
     user, uid = update.effective_user, update.effective_user.id
-    await rate_limiter.acquire(uid)
+    if not rate_limiter.allow(uid):
+        return
     await update_username_if_needed(uid, user)
     await update.message.reply_text("✨ **MINI GAME BOT** ✨\n\nChào mừng! Bot đã được cập nhật với các trò chơi mới. Sử dụng /menu để khám phá.", parse_mode='Markdown')
 
+@callbacks.exact('back_menu')
 async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user:
         return
     uid = update.effective_user.id
-    await rate_limiter.acquire(uid)
+    if not update.callback_query and not rate_limiter.allow(uid):
+        return
     await update_username_if_needed(uid, update.effective_user)
     user = await dm.get_user(uid)
-    rank, next_rank = get_user_rank(user.get('total_exp', 0))
-    
-    exp_str = f"{fmt(user.get('total_exp', 0))}"
-    if next_rank:
-        exp_str += f" / {fmt(next_rank['exp'])}"
+    txt = render_menu(user.get('username', 'Player'), get_rank_index(user.get('total_exp', 0)), fmt(user.get('total_exp', 0)), fmt(user['coins']))
+    kb = MENU_KEYBOARD
 
-    txt = f"""
-👤 **{user.get('username', 'Player')}**
-- 🏆 **Rank:** {rank['name']}
-- ⭐ **EXP:** {exp_str}
-- 💰 **Xu:** {fmt(user['coins'])}
-"""
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🪙 Tung Đồng Xu", callback_data='game_coinflip'), InlineKeyboardButton("🎰 Máy Xèng", callback_data='game_slots')],
-        [InlineKeyboardButton("💎 Kho Báu", callback_data='game_treasure'), InlineKeyboardButton("✊ Oẳn Tù Tì", callback_data='rps_start')],
-        [InlineKeyboardButton("🔢 Đoán Số", callback_data='guess_start'), InlineKeyboardButton("🃏 Cao/Thấp", callback_data='game_highlow')],
-        [InlineKeyboardButton("🎲 Chẵn Lẻ", callback_data='game_chanle'), InlineKeyboardButton("🎲 Tài Xỉu", callback_data='game_taixiu'), InlineKeyboardButton("🎲 Lắc Xúc Xắc", callback_data='game_diceroll')],
-        [InlineKeyboardButton("🎡 Vòng Quay", callback_data='game_luckywheel'), InlineKeyboardButton("🎁 Điểm Danh", callback_data='daily_bonus')],
-        [InlineKeyboardButton("📊 Thống Kê", callback_data='stats'), InlineKeyboardButton("🏆 Bảng Xếp Hạng", callback_data='ranking')],
-        [InlineKeyboardButton("📖 Hướng Dẫn", callback_data='help')]
-    ])
-    
     if update.callback_query:
         await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, kb)
     else:
@@ -340,165 +1973,145 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
-    await q.answer()
     uid = q.from_user.id
-    await update_username_if_needed(uid, q.from_user)
-    data = q.data
-    await rate_limiter.acquire(uid)
-
-    if data.startswith('rps_play_'):
-        await handle_rps(update, context)
-    elif data.startswith('cf_play_'):
-        await handle_coin_flip_play(update, context)
-    elif data.startswith('taixiu_'):
-        await handle_taixiu_bet(update, context)
-    elif data.startswith('treasure_chest_'):
-        await handle_treasure_choice(update, context)
-    elif data.startswith('hl_play_'):
-        await handle_highlow_play(update, context)
-    elif data.startswith('dr_play_'):
-        await handle_dice_roll_play(update, context)
-    elif data.startswith('chanle_play_'):
-        await handle_chanle_play(update, context)
-    else:
-        handlers = {
-            'game_treasure': handle_treasure_hunt, 'game_chanle': handle_chanle, 'game_highlow': handle_highlow_start,
-            'game_taixiu': handle_taixiu, 'game_luckywheel': handle_lucky_wheel, 'daily_bonus': handle_daily_bonus,
-            'stats': handle_stats, 'ranking': handle_ranking, 'top_coins': handle_top_coins, 'top_rank': handle_top_rank,
-            'help': handle_help, 'back_menu': menu, 'guess_start': guess_game, 'rps_start': rps_start, 
-            'game_coinflip': handle_coin_flip_start,
-            'game_slots': handle_slot_machine_start,
-            'game_diceroll': handle_dice_roll_start,
-        }
-        if data in handlers:
-            await handlers[data](update, context)
-
+    if not rate_limiter.allow(uid):
+        await _answer(q, "⏳ Bạn thao tác quá nhanh, thử lại sau giây lát!")
+        return
+    token = current_query.set(q)
+    work = [update_username_if_needed(uid, q.from_user), dispatch_callback(update, context)]
+    if not defer_answer(q):
+        work.append(_answer(q))
+    try:
+        await asyncio.gather(*work)
+    finally:
+        current_query.reset(token)
+        owed = release_answer(q)
+        if owed:
+            await owed
+
+@callbacks.exact('guess_start')
 async def guess_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user:
         return
     uid = update.effective_user.id
-    user = await dm.get_user(uid)
     
     if update.callback_query:
-        if 'guess_number' in user.get('minigames', {}):
-            await context.bot.answer_callback_query(update.callback_query.id, "Bạn đang trong ván chơi rồi!", show_alert=True)
-            return
+        async with dm.transaction(uid) as user:
+            if 'guess_number' in user.get('minigames', {}):
+                raise Rejected("Bạn đang trong ván chơi rồi!")
 
-        bet = get_game_bet(user)
-        if user['coins'] < bet:
-            await context.bot.answer_callback_query(update.callback_query.id, f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-            return
-        
-        user['coins'] -= bet
-        game = GuessNumberGame(bet=bet)
-        user['minigames']['guess_number'] = game.to_dict()
-        await dm.update_user(uid, user)
+            bet = get_game_bet(user)
+            if user['coins'] < bet:
+                raise Rejected(f"❌ Cần {fmt(bet)} xu!")
+
+            user['coins'] -= bet
+            game = GuessNumberGame(bet=bet)
+            save_game(user, game)
         
         text = f"🤔 **ĐOÁN SỐ** 🤔\n\nTôi đã nghĩ một số từ {game.min_val} đến {game.max_val}.\n(Cược: {fmt(bet)} xu)\nHãy trả lời tin nhắn này với số bạn đoán!"
-        await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+        await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, BACK_KEYBOARD)
         return
 
     if update.message and update.message.text:
-        game_dict = user.get('minigames', {}).get('guess_number')
-        if not game_dict:
+        # Plain chat text only takes the user's lock once it is a guess for a
+        # running game; every other reply is sent without holding it.
+        if 'guess_number' not in (await dm.get_user(uid)).get('minigames', {}):
             await update.message.reply_text("Bắt đầu game Đoán Số từ /menu đã.", reply_to_message_id=update.message.message_id)
             return
-        
-        game = GuessNumberGame.from_dict(game_dict)
-
         try:
             guess = int(update.message.text)
         except (ValueError, IndexError):
             await update.message.reply_text("Vui lòng nhập một số hợp lệ.", reply_to_message_id=update.message.message_id)
             return
 
-        result = game.make_guess(guess)
-        user['minigames']['guess_number'] = game.to_dict()
-
-        if result == "correct":
-            prize = game.bet * 2.5
-            exp = get_exp_reward(user, game.bet)
-            user['coins'] += prize
-            add_exp(user, exp)
-            del user['minigames']['guess_number']
-            txt = f"🎉 **CHÍNH XÁC!** 🎉\nSố bí mật là {game.secret_number}.\nBạn đoán đúng sau {game.guesses} lần.\n\n> 💰 **Thưởng:** {fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
-            await update.message.reply_text(txt, reply_to_message_id=update.message.message_id)
-        elif result == "higher":
-            await update.message.reply_text("⬆️ Cao hơn!", reply_to_message_id=update.message.message_id)
-        else:
-            await update.message.reply_text("⬇️ Thấp hơn!", reply_to_message_id=update.message.message_id)
-        
-        await dm.update_user(uid, user)
-
+        try:
+            async with dm.transaction(uid) as user:
+                game = load_game(user, 'guess_number')
+                if not game:
+                    raise Rejected("Bắt đầu game Đoán Số từ /menu đã.")
+                result = game.make_guess(guess)
+                save_game(user, game)
+
+                if result == "correct":
+                    prize = game.bet * 2.5
+                    exp = get_exp_reward(user, game.bet)
+                    user['coins'] += prize
+                    add_exp(user, exp)
+                    del user['minigames']['guess_number']
+                    txt = f"🎉 **CHÍNH XÁC!** 🎉\nSố bí mật là {game.secret_number}.\nBạn đoán đúng sau {game.guesses} lần.\n\n> 💰 **Thưởng:** {fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+                elif result == "higher":
+                    txt = "⬆️ Cao hơn!"
+                else:
+                    txt = "⬇️ Thấp hơn!"
+        except Rejected as e:
+            txt = e.args[0]
+
+        await update.message.reply_text(txt, reply_to_message_id=update.message.message_id)
+
+@callbacks.exact('rps_start')
 async def rps_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.callback_query:
         return
     bet = get_game_bet(await dm.get_user(update.effective_user.id))
-    keyboard = [[
-        InlineKeyboardButton("✌️ Kéo", callback_data='rps_play_scissors'),
-        InlineKeyboardButton("✋ Bao", callback_data='rps_play_paper'),
-        InlineKeyboardButton("✊ Búa", callback_data='rps_play_rock')
-    ], [InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]
     text = f"Oẳn tù tì!\nCược: **{fmt(bet)} xu**"
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, InlineKeyboardMarkup(keyboard))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, RPS_KEYBOARD)
 
+@callbacks.prefix('rps_play_')
 async def handle_rps(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
-    user_choice = q.data.split('_')[2]
+    user_choice = context.args[0]
     uid = q.from_user.id
-    user = await dm.get_user(uid)
-    
-    bet = get_game_bet(user)
-    if user['coins'] < bet:
-        await q.answer(f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-        return
-    user['coins'] -= bet
-
-    game_name = 'rps'
-    streaks = user.setdefault('minigame_streaks', {})
-    game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
-    forced_win = game_streak.get('guaranteed_win', False)
-    if forced_win:
-        game_streak['guaranteed_win'] = False
+    async with dm.transaction(uid) as user:
+        bet = get_game_bet(user)
+        if user['coins'] < bet:
+            raise Rejected(f"❌ Cần {fmt(bet)} xu!")
+        user['coins'] -= bet
 
-    choices = ['rock', 'paper', 'scissors']
-    bot_choice = random.choice(choices)
-    
-    outcomes = {('rock', 'scissors'): 'win', ('scissors', 'paper'): 'win', ('paper', 'rock'): 'win'}
-    choice_text = {'rock': '✊ Búa', 'paper': '✋ Bao', 'scissors': '✌️ Kéo'}
-    
-    result_text = f"Bạn chọn: {choice_text[user_choice]}\nBot chọn: {choice_text[bot_choice]}\n\n" 
-    
-    won = False
-    if user_choice == bot_choice:
-        result = f"⚖️ **HÒA!**\n(Hoàn lại {fmt(bet)} xu)"
-        user['coins'] += bet
-        won = True
-    elif (outcomes.get((user_choice, bot_choice)) == 'win') or forced_win:
-        if forced_win and outcomes.get((user_choice, bot_choice)) != 'win':
-            if user_choice == 'rock': bot_choice = 'scissors'
-            elif user_choice == 'paper': bot_choice = 'rock'
-            elif user_choice == 'scissors': bot_choice = 'paper'
-            result_text = f"Bạn chọn: {choice_text[user_choice]}\nBot chọn: {choice_text[bot_choice]}\n\n"
-
-        prize = bet * 2.5
-        exp = get_exp_reward(user, bet)
-        user['coins'] += prize
-        add_exp(user, exp)
-        result = f"🎉 **BẠN THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+        game_name = 'rps'
+        streaks = user.setdefault('minigame_streaks', {})
+        game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
+        forced_win = game_streak.get('guaranteed_win', False)
         if forced_win:
-            result = "✨ **Bảo hiểm kích hoạt!** ✨\n" + result
-        won = True
-    else:
-        result = f"😢 **BẠN THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
+            game_streak['guaranteed_win'] = False
+
+        choices = ['rock', 'paper', 'scissors']
+        bot_choice = random.choice(choices)
+
+        outcomes = {('rock', 'scissors'): 'win', ('scissors', 'paper'): 'win', ('paper', 'rock'): 'win'}
+        choice_text = {'rock': '✊ Búa', 'paper': '✋ Bao', 'scissors': '✌️ Kéo'}
+
+        result_text = f"Bạn chọn: {choice_text[user_choice]}\nBot chọn: {choice_text[bot_choice]}\n\n" 
+
         won = False
+        if user_choice == bot_choice:
+            result = f"⚖️ **HÒA!**\n(Hoàn lại {fmt(bet)} xu)"
+            user['coins'] += bet
+            won = True
+        elif (outcomes.get((user_choice, bot_choice)) == 'win') or forced_win:
+            if forced_win and outcomes.get((user_choice, bot_choice)) != 'win':
+                if user_choice == 'rock': bot_choice = 'scissors'
+                elif user_choice == 'paper': bot_choice = 'rock'
+                elif user_choice == 'scissors': bot_choice = 'paper'
+                result_text = f"Bạn chọn: {choice_text[user_choice]}\nBot chọn: {choice_text[bot_choice]}\n\n"
+
+            prize = bet * 2.5
+            exp = get_exp_reward(user, bet)
+            user['coins'] += prize
+            add_exp(user, exp)
+            result = f"🎉 **BẠN THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+            if forced_win:
+                result = "✨ **Bảo hiểm kích hoạt!** ✨\n" + result
+            won = True
+        else:
+            result = f"😢 **BẠN THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
+            won = False
 
-    _update_minigame_streak(user, game_name, won)
-    await dm.update_user(uid, user)
-    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + result, InlineKeyboardMarkup([[InlineKeyboardButton("Chơi lại", callback_data='rps_start'), InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+        _update_minigame_streak(user, game_name, won)
+    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + result, replay_keyboard('rps_start'))
 
+@callbacks.exact('game_coinflip')
 async def handle_coin_flip_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.callback_query:
         return
@@ -506,144 +2119,138 @@ async def handle_coin_flip_start(update: Update, context: ContextTypes.DEFAULT_T
     user = await dm.get_user(uid)
     bet = get_game_bet(user)
     if user['coins'] < bet:
-        await context.bot.answer_callback_query(update.callback_query.id, f"❌ Cần {fmt(bet)} xu!", show_alert=True)
+        await answer_alert(update, f"❌ Cần {fmt(bet)} xu!")
         return
 
-    keyboard = [[
-        InlineKeyboardButton("🪙 Ngửa (Heads)", callback_data='cf_play_heads'),
-        InlineKeyboardButton("🌑 Sấp (Tails)", callback_data='cf_play_tails')
-    ], [InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]
     text = f"🪙 **TUNG ĐỒNG XU** 🪙\n\nCược: **{fmt(bet)} xu**\nChọn Sấp hoặc Ngửa:"
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, InlineKeyboardMarkup(keyboard))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, COINFLIP_KEYBOARD)
 
+@callbacks.prefix('cf_play_')
 async def handle_coin_flip_play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
     uid = q.from_user.id
-    user = await dm.get_user(uid)
-    
-    user_choice = q.data.split('_')[2]
-    bet = get_game_bet(user)
+    async with dm.transaction(uid) as user:
+        user_choice = context.args[0]
+        bet = get_game_bet(user)
 
-    if user['coins'] < bet:
-        await q.answer(f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-        return
-    user['coins'] -= bet
+        if user['coins'] < bet:
+            raise Rejected(f"❌ Cần {fmt(bet)} xu!")
+        user['coins'] -= bet
 
-    game_name = 'coinflip'
-    streaks = user.setdefault('minigame_streaks', {})
-    game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
-    forced_win = game_streak.get('guaranteed_win', False)
-    if forced_win:
-        game_streak['guaranteed_win'] = False
+        game_name = 'coinflip'
+        streaks = user.setdefault('minigame_streaks', {})
+        game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
+        forced_win = game_streak.get('guaranteed_win', False)
+        if forced_win:
+            game_streak['guaranteed_win'] = False
 
-    actual_result = random.choice(['heads', 'tails'])
-    
-    won = forced_win or (user_choice == actual_result)
-    if forced_win:
-        result = user_choice
-    else:
-        result = actual_result
+        actual_result = random.choice(['heads', 'tails'])
 
-    _update_minigame_streak(user, game_name, won)
+        won = forced_win or (user_choice == actual_result)
+        if forced_win:
+            result = user_choice
+        else:
+            result = actual_result
 
-    result_text = f"Đồng xu rơi... **{actual_result.upper()}**!\n\n" 
+        _update_minigame_streak(user, game_name, won)
 
-    if won:
-        prize = bet * 2.5
-        exp = get_exp_reward(user, bet)
-        user['coins'] += prize
-        add_exp(user, exp)
-        txt = f"🎉 **BẠN THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
-        if forced_win:
-            txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
-    else:
-        txt = f"😢 **BẠN THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
-        
-    await dm.update_user(uid, user)
-    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, InlineKeyboardMarkup([[InlineKeyboardButton("Chơi lại", callback_data='game_coinflip'), InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+        result_text = f"Đồng xu rơi... **{actual_result.upper()}**!\n\n" 
+
+        if won:
+            prize = bet * 2.5
+            exp = get_exp_reward(user, bet)
+            user['coins'] += prize
+            add_exp(user, exp)
+            txt = f"🎉 **BẠN THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+            if forced_win:
+                txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
+        else:
+            txt = f"😢 **BẠN THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
 
+    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, replay_keyboard('game_coinflip'))
+
+@callbacks.exact('game_slots')
 async def handle_slot_machine_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
     uid = q.from_user.id
-    user = await dm.get_user(uid)
-    bet = get_game_bet(user)
-    if user['coins'] < bet:
-        await q.answer(f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-        return
-    
-    user['coins'] -= bet
+    async with dm.transaction(uid) as user:
+        bet = get_game_bet(user)
+        if user['coins'] < bet:
+            raise Rejected(f"❌ Cần {fmt(bet)} xu!")
 
-    game_name = 'slots'
-    streaks = user.setdefault('minigame_streaks', {})
-    game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
-    forced_win = game_streak.get('guaranteed_win', False)
-    if forced_win:
-        game_streak['guaranteed_win'] = False
+        user['coins'] -= bet
 
-    reels = ['🍒', '🍋', '🍊', '🍉', '💰', '💎', '💔']
-    
-    if forced_win:
-        win_symbol = random.choice(['💰', '🍉', '🍒'])
-        results = [win_symbol, win_symbol, win_symbol]
-    else:
-        results = random.choices(reels, weights=[10, 10, 10, 5, 4, 2, 15], k=3)
-
-    payouts = {
-        ('💎', '💎', '💎'): 10,
-        ('💰', '💰', '💰'): 5,
-        ('🍉', '🍉', '🍉'): 4,
-        ('🍊', '🍊', '🍊'): 3,
-        ('🍋', '🍋', '🍋'): 3,
-        ('🍒', '🍒', '🍒'): 3,
-    }
-    
-    win_multiplier = 0
-    if results[0] == results[1] == results[2]:
-        win_multiplier = payouts.get(tuple(results), 0)
-    else:
-        checked_symbols = set()
-        for symbol in results:
-            if symbol in checked_symbols:
-                continue
-            if results.count(symbol) == 2:
-                if symbol == '💎':
-                    win_multiplier = 2
-                    break
-                if symbol == '💰':
-                    win_multiplier = 1.5
-                    break
-                if symbol in ['🍉', '🍊', '🍋', '🍒']:
-                    win_multiplier = 1
-                    break
-            checked_symbols.add(symbol)
-
-    prize = int(bet * win_multiplier)
-    won = prize > bet
-    _update_minigame_streak(user, game_name, won)
-    
-    result_text = f"🎰 **MÁY XÈNG** 🎰\n\n`{results[0]} | {results[1]} | {results[2]}`\n\n" 
+        game_name = 'slots'
+        streaks = user.setdefault('minigame_streaks', {})
+        game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
+        forced_win = game_streak.get('guaranteed_win', False)
+        if forced_win:
+            game_streak['guaranteed_win'] = False
+
+        reels = ['🍒', '🍋', '🍊', '🍉', '💰', '💎', '💔']
 
-    if win_multiplier > 1:
-        user['coins'] += prize
-        exp = get_exp_reward(user, bet)
-        add_exp(user, exp)
-        txt = f"🎉 **THẮNG LỚN!**\n\n> 💰 **Thưởng:** +{fmt(prize - bet)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
         if forced_win:
-            txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
-    elif win_multiplier == 1:
-        user['coins'] += prize
-        txt = f"😌 **HÒA VỐN!**\n\n> Bạn được hoàn lại tiền cược: {fmt(bet)} xu"
-    else:
-        txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
+            win_symbol = random.choice(['💰', '🍉', '🍒'])
+            results = [win_symbol, win_symbol, win_symbol]
+        else:
+            results = random.choices(reels, weights=[10, 10, 10, 5, 4, 2, 15], k=3)
+
+        payouts = {
+            ('💎', '💎', '💎'): 10,
+            ('💰', '💰', '💰'): 5,
+            ('🍉', '🍉', '🍉'): 4,
+            ('🍊', '🍊', '🍊'): 3,
+            ('🍋', '🍋', '🍋'): 3,
+            ('🍒', '🍒', '🍒'): 3,
+        }
+
+        win_multiplier = 0
+        if results[0] == results[1] == results[2]:
+            win_multiplier = payouts.get(tuple(results), 0)
+        else:
+            checked_symbols = set()
+            for symbol in results:
+                if symbol in checked_symbols:
+                    continue
+                if results.count(symbol) == 2:
+                    if symbol == '💎':
+                        win_multiplier = 2
+                        break
+                    if symbol == '💰':
+                        win_multiplier = 1.5
+                        break
+                    if symbol in ['🍉', '🍊', '🍋', '🍒']:
+                        win_multiplier = 1
+                        break
+                checked_symbols.add(symbol)
 
-    await dm.update_user(uid, user)
-    kb = InlineKeyboardMarkup([[InlineKeyboardButton("Quay tiếp", callback_data='game_slots'), InlineKeyboardButton("↩️ Menu", callback_data='back_menu')] ])
+        prize = int(bet * win_multiplier)
+        won = prize > bet
+        _update_minigame_streak(user, game_name, won)
+
+        result_text = f"🎰 **MÁY XÈNG** 🎰\n\n`{results[0]} | {results[1]} | {results[2]}`\n\n" 
+
+        if win_multiplier > 1:
+            user['coins'] += prize
+            exp = get_exp_reward(user, bet)
+            add_exp(user, exp)
+            txt = f"🎉 **THẮNG LỚN!**\n\n> 💰 **Thưởng:** +{fmt(prize - bet)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+            if forced_win:
+                txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
+        elif win_multiplier == 1:
+            user['coins'] += prize
+            txt = f"😌 **HÒA VỐN!**\n\n> Bạn được hoàn lại tiền cược: {fmt(bet)} xu"
+        else:
+            txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
+
+    kb = replay_keyboard('game_slots', "Quay tiếp")
     await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, kb)
 
+@callbacks.exact('game_taixiu')
 async def handle_taixiu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.callback_query:
         return
@@ -651,66 +2258,61 @@ async def handle_taixiu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await dm.get_user(uid)
     bet = get_game_bet(user)
     if user['coins'] < bet:
-        await context.bot.answer_callback_query(update.callback_query.id, f"❌ Cần {fmt(bet)} xu!", show_alert=True)
+        await answer_alert(update, f"❌ Cần {fmt(bet)} xu!")
         return
     
-    keyboard = [[
-        InlineKeyboardButton("Tài (11-18)", callback_data=f'taixiu_tai_{bet}'),
-        InlineKeyboardButton("Xỉu (3-10)", callback_data=f'taixiu_xiu_{bet}')
-    ], [InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]
     text = f"🎲 **TÀI XỈU** 🎲\n\nCược: **{fmt(bet)} xu**\nChọn Tài hoặc Xỉu:"
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, InlineKeyboardMarkup(keyboard))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, taixiu_keyboard(bet))
 
+@callbacks.prefix('taixiu_')
 async def handle_taixiu_bet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
     uid = q.from_user.id
-    user = await dm.get_user(uid)
-    
-    _, choice, bet_str = q.data.split('_')
-    bet = int(bet_str)
+    async with dm.transaction(uid) as user:
+        choice, bet_str = context.args
+        bet = int(bet_str)
 
-    if user['coins'] < bet:
-        await q.answer(f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-        return
-    user['coins'] -= bet
-    
-    game_name = 'taixiu'
-    streaks = user.setdefault('minigame_streaks', {})
-    game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
-    forced_win = game_streak.get('guaranteed_win', False)
-    if forced_win:
-        game_streak['guaranteed_win'] = False
-
-    d1, d2, d3 = random.randint(1, 6), random.randint(1, 6), random.randint(1, 6)
-    total = d1 + d2 + d3
-    actual_result = 'tai' if 11 <= total <= 18 else 'xiu'
-    
-    won = forced_win or (choice == actual_result)
-    if forced_win:
-        result = choice
-    else:
-        result = actual_result
+        if user['coins'] < bet:
+            raise Rejected(f"❌ Cần {fmt(bet)} xu!")
+        user['coins'] -= bet
 
-    _update_minigame_streak(user, game_name, won)
+        game_name = 'taixiu'
+        streaks = user.setdefault('minigame_streaks', {})
+        game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
+        forced_win = game_streak.get('guaranteed_win', False)
+        if forced_win:
+            game_streak['guaranteed_win'] = False
 
-    result_text = f"Kết quả: `{d1}` + `{d2}` + `{d3}` = **{total}** ({actual_result.upper()})\n\n" 
+        d1, d2, d3 = random.randint(1, 6), random.randint(1, 6), random.randint(1, 6)
+        total = d1 + d2 + d3
+        actual_result = 'tai' if 11 <= total <= 18 else 'xiu'
 
-    if won:
-        prize = bet * 2.5
-        exp = get_exp_reward(user, bet)
-        user['coins'] += prize
-        add_exp(user, exp)
-        txt = f"🎉 **THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+        won = forced_win or (choice == actual_result)
         if forced_win:
-            txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
-    else:
-        txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
-        
-    await dm.update_user(uid, user)
-    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, InlineKeyboardMarkup([[InlineKeyboardButton("Chơi lại", callback_data='game_taixiu'), InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+            result = choice
+        else:
+            result = actual_result
 
+        _update_minigame_streak(user, game_name, won)
+
+        result_text = f"Kết quả: `{d1}` + `{d2}` + `{d3}` = **{total}** ({actual_result.upper()})\n\n" 
+
+        if won:
+            prize = bet * 2.5
+            exp = get_exp_reward(user, bet)
+            user['coins'] += prize
+            add_exp(user, exp)
+            txt = f"🎉 **THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+            if forced_win:
+                txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
+        else:
+            txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
+
+    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, replay_keyboard('game_taixiu'))
+
+@callbacks.exact('game_treasure')
 async def handle_treasure_hunt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.callback_query:
         return
@@ -718,123 +2320,109 @@ async def handle_treasure_hunt(update: Update, context: ContextTypes.DEFAULT_TYP
     user = await dm.get_user(uid)
     bet = get_game_bet(user)
     if user['coins'] < bet:
-        await context.bot.answer_callback_query(update.callback_query.id, f"❌ Cần {fmt(bet)} xu!", show_alert=True)
+        await answer_alert(update, f"❌ Cần {fmt(bet)} xu!")
         return
 
-    keyboard = [[
-        InlineKeyboardButton("Rương 1", callback_data='treasure_chest_1'),
-        InlineKeyboardButton("Rương 2", callback_data='treasure_chest_2'),
-        InlineKeyboardButton("Rương 3", callback_data='treasure_chest_3')
-    ], [InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]
-    
     text = f"💎 **SĂN KHO BÁU** 💎\n\nChọn một trong ba rương để mở.\nCược: **{fmt(bet)} xu**"
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, InlineKeyboardMarkup(keyboard))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, TREASURE_KEYBOARD)
 
+@callbacks.prefix('treasure_chest_')
 async def handle_treasure_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
     uid = q.from_user.id
-    user = await dm.get_user(uid)
-    bet = get_game_bet(user)
+    async with dm.transaction(uid) as user:
+        bet = get_game_bet(user)
 
-    if user['coins'] < bet:
-        await q.answer(f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-        return
-    
-    user['coins'] -= bet
+        if user['coins'] < bet:
+            raise Rejected(f"❌ Cần {fmt(bet)} xu!")
 
-    prizes = [0, 0, 2.5]
-    random.shuffle(prizes)
-    chosen_multiplier = random.choice(prizes)
-    prize_amount = int(bet * chosen_multiplier)
-    
-    if prize_amount > 0:
-        user['coins'] += prize_amount
-        exp = get_exp_reward(user, bet)
-        add_exp(user, exp)
-        txt = f"🎉 **BẠN TÌM THẤY KHO BÁU!**\n\n> 💰 **Thưởng:** +{fmt(prize_amount - bet)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
-    else:
-        txt = f"😢 **RƯƠNG RỖNG!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
+        user['coins'] -= bet
+
+        prizes = [0, 0, 2.5]
+        random.shuffle(prizes)
+        chosen_multiplier = random.choice(prizes)
+        prize_amount = int(bet * chosen_multiplier)
 
-    await dm.update_user(uid, user)
-    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, txt, InlineKeyboardMarkup([[InlineKeyboardButton("Chơi lại", callback_data='game_treasure'), InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+        if prize_amount > 0:
+            user['coins'] += prize_amount
+            exp = get_exp_reward(user, bet)
+            add_exp(user, exp)
+            txt = f"🎉 **BẠN TÌM THẤY KHO BÁU!**\n\n> 💰 **Thưởng:** +{fmt(prize_amount - bet)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+        else:
+            txt = f"😢 **RƯƠNG RỖNG!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
 
+    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, txt, replay_keyboard('game_treasure'))
+
+@callbacks.exact('game_highlow')
 async def handle_highlow_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.callback_query:
         return
     uid = update.effective_user.id
-    user = await dm.get_user(uid)
-    bet = get_game_bet(user)
+    async with dm.transaction(uid) as user:
+        bet = get_game_bet(user)
+
+        if user['coins'] < bet:
+            raise Rejected(f"❌ Cần {fmt(bet)} xu!")
+
+        user['coins'] -= bet
+        game = HighLowGame(bet=bet)
+        save_game(user, game)
 
-    if user['coins'] < bet:
-        await context.bot.answer_callback_query(update.callback_query.id, f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-        return
-    
-    user['coins'] -= bet
-    game = HighLowGame(bet=bet)
-    user['minigames']['highlow'] = game.to_dict()
-    await dm.update_user(uid, user)
-
-    keyboard = [[
-        InlineKeyboardButton("⬆️ Cao Hơn", callback_data='hl_play_high'),
-        InlineKeyboardButton("⬇️ Thấp Hơn", callback_data='hl_play_low')
-    ], [InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]
-    
     text = f"🃏 **CAO / THẤP** 🃏\n\nLá bài hiện tại là: **{game.current_card}**\nCược: **{fmt(bet)} xu**\n\nĐoán xem lá tiếp theo cao hơn hay thấp hơn?"
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, InlineKeyboardMarkup(keyboard))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, HIGHLOW_KEYBOARD)
 
+@callbacks.prefix('hl_play_')
 async def handle_highlow_play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
     uid = q.from_user.id
-    user = await dm.get_user(uid)
-    game_dict = user.get('minigames', {}).get('highlow')
-    if not game_dict:
-        return
-
-    game = HighLowGame.from_dict(game_dict)
-    choice = q.data.split('_')[2]
-
-    game_name = 'highlow'
-    streaks = user.setdefault('minigame_streaks', {})
-    game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
-    forced_win = game_streak.get('guaranteed_win', False)
-    if forced_win:
-        game_streak['guaranteed_win'] = False
+    async with dm.transaction(uid) as user:
+        game = load_game(user, 'highlow')
+        if not game:
+            raise Rejected
+        choice = context.args[0]
+
+        game_name = 'highlow'
+        streaks = user.setdefault('minigame_streaks', {})
+        game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
+        forced_win = game_streak.get('guaranteed_win', False)
+        if forced_win:
+            game_streak['guaranteed_win'] = False
 
-    if forced_win:
-        if choice == 'high':
-            game.current_card = random.randint(1, 12)
-            new_card = random.randint(game.current_card + 1, 13)
+        if forced_win:
+            if choice == 'high':
+                game.current_card = random.randint(1, 12)
+                new_card = random.randint(game.current_card + 1, 13)
+            else:
+                game.current_card = random.randint(2, 13)
+                new_card = random.randint(1, game.current_card - 1)
+            game.win = True
         else:
-            game.current_card = random.randint(2, 13)
-            new_card = random.randint(1, game.current_card - 1)
-        game.win = True
-    else:
-        new_card = game.play(choice)
+            new_card = game.play(choice)
 
-    del user['minigames']['highlow']
+        del user['minigames']['highlow']
 
-    _update_minigame_streak(user, game_name, game.win)
+        _update_minigame_streak(user, game_name, game.win)
 
-    result_text = f"Lá bài mới là **{new_card}**.\n\n" 
+        result_text = f"Lá bài mới là **{new_card}**.\n\n" 
 
-    if game.win:
-        prize = game.bet * 2.5
-        exp = get_exp_reward(user, game.bet)
-        user['coins'] += prize
-        add_exp(user, exp)
-        txt = f"🎉 **THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
-        if forced_win:
-            txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
-    else:
-        txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(game.bet)} xu"
-    
-    await dm.update_user(uid, user)
-    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, InlineKeyboardMarkup([[InlineKeyboardButton("Chơi lại", callback_data='game_highlow'), InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+        if game.win:
+            prize = game.bet * 2.5
+            exp = get_exp_reward(user, game.bet)
+            user['coins'] += prize
+            add_exp(user, exp)
+            txt = f"🎉 **THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+            if forced_win:
+                txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
+        else:
+            txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(game.bet)} xu"
+
+    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, replay_keyboard('game_highlow'))
 
+@callbacks.exact('game_diceroll')
 async def handle_dice_roll_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.callback_query:
         return
@@ -843,71 +2431,66 @@ async def handle_dice_roll_start(update: Update, context: ContextTypes.DEFAULT_T
     bet = get_game_bet(user)
 
     if user['coins'] < bet:
-        await context.bot.answer_callback_query(update.callback_query.id, f"❌ Cần {fmt(bet)} xu!", show_alert=True)
+        await answer_alert(update, f"❌ Cần {fmt(bet)} xu!")
         return
 
-    keyboard = [[ 
-        InlineKeyboardButton("🎲 Lắc Xúc Xắc", callback_data='dr_play_roll')
-    ], [InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]
-
     text = f"🎲 **LẮC XÚC XẮC** 🎲\n\nCược: **{fmt(bet)} xu**\n\nNếu tổng 2 xúc xắc là 7, bạn thắng!"
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, InlineKeyboardMarkup(keyboard))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, DICEROLL_KEYBOARD)
 
+@callbacks.prefix('dr_play_')
 async def handle_dice_roll_play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
     uid = q.from_user.id
-    user = await dm.get_user(uid)
+    async with dm.transaction(uid) as user:
+        bet = get_game_bet(user)
 
-    bet = get_game_bet(user)
+        if user['coins'] < bet:
+            raise Rejected(f"❌ Cần {fmt(bet)} xu!")
 
-    if user['coins'] < bet:
-        await q.answer(f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-        return
-    
-    user['coins'] -= bet
+        user['coins'] -= bet
 
-    game_name = 'diceroll'
-    streaks = user.setdefault('minigame_streaks', {})
-    game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
-    forced_win = game_streak.get('guaranteed_win', False)
-    if forced_win:
-        game_streak['guaranteed_win'] = False
+        game_name = 'diceroll'
+        streaks = user.setdefault('minigame_streaks', {})
+        game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
+        forced_win = game_streak.get('guaranteed_win', False)
+        if forced_win:
+            game_streak['guaranteed_win'] = False
 
-    game = DiceRollGame(bet=bet)
-    
-    if forced_win:
-        d1 = random.randint(1, 6)
-        d2 = 7 - d1
-        if d2 < 1 or d2 > 6:
-            d1 = random.choice([1, 2, 3])
+        game = DiceRollGame(bet=bet)
+
+        if forced_win:
+            d1 = random.randint(1, 6)
             d2 = 7 - d1
-        game.dice_result = (d1, d2)
-        game.win = True
-    else:
-        d1, d2 = game.roll_dice()
+            if d2 < 1 or d2 > 6:
+                d1 = random.choice([1, 2, 3])
+                d2 = 7 - d1
+            game.dice_result = (d1, d2)
+            game.win = True
+        else:
+            d1, d2 = game.roll_dice()
 
-    total = d1 + d2
+        total = d1 + d2
 
-    _update_minigame_streak(user, game_name, game.win)
+        _update_minigame_streak(user, game_name, game.win)
 
-    result_text = f"Bạn lắc được: `{d1}` và `{d2}`. Tổng là **{total}**.\n\n" 
+        result_text = f"Bạn lắc được: `{d1}` và `{d2}`. Tổng là **{total}**.\n\n" 
 
-    if game.win:
-        prize = bet * 2.5
-        exp = get_exp_reward(user, bet)
-        user['coins'] += prize
-        add_exp(user, exp)
-        txt = f"🎉 **THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
-        if forced_win:
-            txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
-    else:
-        txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
-    
-    await dm.update_user(uid, user)
-    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, InlineKeyboardMarkup([[InlineKeyboardButton("Chơi lại", callback_data='game_diceroll'), InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+        if game.win:
+            prize = bet * 2.5
+            exp = get_exp_reward(user, bet)
+            user['coins'] += prize
+            add_exp(user, exp)
+            txt = f"🎉 **THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+            if forced_win:
+                txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
+        else:
+            txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
+
+    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, replay_keyboard('game_diceroll'))
 
+@callbacks.exact('game_chanle')
 async def handle_chanle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.callback_query:
         return
@@ -915,158 +2498,150 @@ async def handle_chanle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await dm.get_user(uid)
     bet = get_game_bet(user)
     if user['coins'] < bet:
-        await context.bot.answer_callback_query(update.callback_query.id, f"❌ Cần {fmt(bet)} xu!", show_alert=True)
+        await answer_alert(update, f"❌ Cần {fmt(bet)} xu!")
         return
 
-    keyboard = [[ 
-        InlineKeyboardButton("Chẵn", callback_data='chanle_play_chan'),
-        InlineKeyboardButton("Lẻ", callback_data='chanle_play_le')
-    ], [InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]
     text = f"🎲 **CHẴN LẺ** 🎲\n\nCược: **{fmt(bet)} xu**\nChọn Chẵn hoặc Lẻ:"
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, InlineKeyboardMarkup(keyboard))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, text, CHANLE_KEYBOARD)
 
+@callbacks.prefix('chanle_play_')
 async def handle_chanle_play(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
     uid = q.from_user.id
-    user = await dm.get_user(uid)
-    
-    user_choice = q.data.split('_')[2]
-    bet = get_game_bet(user)
+    async with dm.transaction(uid) as user:
+        user_choice = context.args[0]
+        bet = get_game_bet(user)
 
-    if user['coins'] < bet:
-        await q.answer(f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-        return
-    user['coins'] -= bet
+        if user['coins'] < bet:
+            raise Rejected(f"❌ Cần {fmt(bet)} xu!")
+        user['coins'] -= bet
 
-    game_name = 'chanle'
-    streaks = user.setdefault('minigame_streaks', {})
-    game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
-    
-    forced_win = game_streak.get('guaranteed_win', False)
-    if forced_win:
-        game_streak['guaranteed_win'] = False
+        game_name = 'chanle'
+        streaks = user.setdefault('minigame_streaks', {})
+        game_streak = streaks.setdefault(game_name, {'losses': 0, 'guaranteed_win': False})
 
-    d1, d2 = random.randint(1, 6), random.randint(1, 6)
-    total = d1 + d2
-    actual_result = 'chan' if total % 2 == 0 else 'le'
-    
-    won = forced_win or (user_choice == actual_result)
-    if forced_win:
-        result = user_choice
-    else:
-        result = actual_result
-    
-    _update_minigame_streak(user, game_name, won)
+        forced_win = game_streak.get('guaranteed_win', False)
+        if forced_win:
+            game_streak['guaranteed_win'] = False
 
-    result_text = f"Kết quả: `{d1}` + `{d2}` = **{total}** ({actual_result.upper()})\n\n" 
+        d1, d2 = random.randint(1, 6), random.randint(1, 6)
+        total = d1 + d2
+        actual_result = 'chan' if total % 2 == 0 else 'le'
 
-    if won:
-        prize = bet * 2.5
-        exp = get_exp_reward(user, bet)
-        user['coins'] += prize
-        add_exp(user, exp)
-        user.setdefault('stats', {}).setdefault('cl_win', 0)
-        user['stats']['cl_win'] += 1
-        txt = f"🎉 **THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+        won = forced_win or (user_choice == actual_result)
         if forced_win:
-            txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
-    else:
-        user.setdefault('stats', {}).setdefault('cl_lose', 0)
-        user['stats']['cl_lose'] += 1
-        txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
-        
-    await dm.update_user(uid, user)
-    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, InlineKeyboardMarkup([[InlineKeyboardButton("Chơi lại", callback_data='game_chanle'), InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+            result = user_choice
+        else:
+            result = actual_result
+
+        _update_minigame_streak(user, game_name, won)
+
+        result_text = f"Kết quả: `{d1}` + `{d2}` = **{total}** ({actual_result.upper()})\n\n" 
+
+        if won:
+            prize = bet * 2.5
+            exp = get_exp_reward(user, bet)
+            user['coins'] += prize
+            add_exp(user, exp)
+            user.setdefault('stats', {}).setdefault('cl_win', 0)
+            user['stats']['cl_win'] += 1
+            txt = f"🎉 **THẮNG!**\n\n> 💰 **Thưởng:** +{fmt(prize)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+            if forced_win:
+                txt = "✨ **Bảo hiểm kích hoạt!** ✨\n" + txt
+        else:
+            user.setdefault('stats', {}).setdefault('cl_lose', 0)
+            user['stats']['cl_lose'] += 1
+            txt = f"😢 **THUA!**\n\n> 💸 **Mất:** {fmt(bet)} xu"
 
+    await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_text + txt, replay_keyboard('game_chanle'))
+
+@callbacks.exact('game_luckywheel')
 async def handle_lucky_wheel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
     uid = q.from_user.id
-    user = await dm.get_user(uid)
-    bet = get_game_bet(user)
-    if user['coins'] < bet:
-        await q.answer(f"❌ Cần {fmt(bet)} xu!", show_alert=True)
-        return
-    
-    user['coins'] -= bet
+    async with dm.transaction(uid) as user:
+        bet = get_game_bet(user)
+        if user['coins'] < bet:
+            raise Rejected(f"❌ Cần {fmt(bet)} xu!")
 
-    outcomes = [(0, 0.20), (0.5, 0.30), (2, 0.20), (3, 0.15), (4, 0.10), (5, 0.05)]
-    multipliers, weights = zip(*outcomes)
-    chosen_multiplier = random.choices(multipliers, weights=weights, k=1)[0]
-    
-    prize = int(bet * chosen_multiplier)
-    user['coins'] += prize
-    
-    title = ""
-    details = f"Kết quả: **x{chosen_multiplier}**"
-    
-    if chosen_multiplier > 1:
-        title = "🎉 **THẮNG LỚN!**"
-        exp = get_exp_reward(user, bet)
-        add_exp(user, exp)
-        details += f"\n\n> 💰 **Thưởng:** +{fmt(prize - bet)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
-    elif chosen_multiplier == 1:
-        title = "😌 **HÒA VỐN!**"
-        details += f"(Hoàn lại {fmt(bet)} xu)"
-    else:
-        title = "😢 **THUA!**"
-        details += f"\n\n> 💸 **Mất:** {fmt(bet - prize)} xu"
+        user['coins'] -= bet
+
+        outcomes = [(0, 0.20), (0.5, 0.30), (2, 0.20), (3, 0.15), (4, 0.10), (5, 0.05)]
+        multipliers, weights = zip(*outcomes)
+        chosen_multiplier = random.choices(multipliers, weights=weights, k=1)[0]
+
+        prize = int(bet * chosen_multiplier)
+        user['coins'] += prize
+
+        title = ""
+        details = f"Kết quả: **x{chosen_multiplier}**"
+
+        if chosen_multiplier > 1:
+            title = "🎉 **THẮNG LỚN!**"
+            exp = get_exp_reward(user, bet)
+            add_exp(user, exp)
+            details += f"\n\n> 💰 **Thưởng:** +{fmt(prize - bet)} xu\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+        elif chosen_multiplier == 1:
+            title = "😌 **HÒA VỐN!**"
+            details += f"(Hoàn lại {fmt(bet)} xu)"
+        else:
+            title = "😢 **THUA!**"
+            details += f"\n\n> 💸 **Mất:** {fmt(bet - prize)} xu"
 
-    await dm.update_user(uid, user)
-    
     txt = f"🎡 **VÒNG QUAY MAY MẮN** 🎡\n\n{title}\n{details}"
-    kb = InlineKeyboardMarkup([[InlineKeyboardButton("Chơi lại", callback_data='game_luckywheel'), InlineKeyboardButton("↩️ Menu", callback_data='back_menu')] ])
+    kb = replay_keyboard('game_luckywheel')
     await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, txt, kb)
 
+@callbacks.exact('daily_bonus')
 async def handle_daily_bonus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.from_user:
         return
     uid = q.from_user.id
-    user = await dm.get_user(uid)
-    now = datetime.now(VIETNAM_TZ)
-    
-    streak = user.get('daily_streak', 0)
-    last_daily_str = user.get('last_daily')
-    
-    if last_daily_str:
-        last_daily = datetime.fromisoformat(last_daily_str).astimezone(VIETNAM_TZ)
-        if now.date() == last_daily.date():
-            await q.answer("Bạn đã nhận thưởng hôm nay rồi. Quay lại vào ngày mai!", show_alert=True)
-            return
-        streak = streak + 1 if (now.date() - last_daily.date()).days == 1 else 1
-    else:
-        streak = 1
-
-    streak = min(streak, 7)
-    base_prize = random.randint(1000, 2000)
-    streak_bonus = streak * 500
-    prize = base_prize + streak_bonus
-    exp = 150 + (streak * 25)
-
-    title = f"🎉 **ĐIỂM DANH NGÀY {streak}**"
-    if streak == 7:
-        jackpot = random.randint(5000, 10000)
-        prize += jackpot
-        title += " - JACKPOT!"
-        prize_details = f"> 💰 **Thưởng:** +{fmt(prize)} xu (có {fmt(jackpot)} xu thưởng!)"
-    else:
-        prize_details = f"> 💰 **Thưởng:** +{fmt(prize)} xu"
+    async with dm.transaction(uid) as user:
+        now = datetime.now(VIETNAM_TZ)
 
-    result_txt = f"{title}\n\n{prize_details}\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
-    user['coins'] += prize
-    add_exp(user, exp)
-        
-    user['last_daily'] = now.isoformat()
-    user['daily_streak'] = streak
-    await dm.update_user(uid, user)
+        streak = user.get('daily_streak', 0)
+        last_daily_str = user.get('last_daily')
+
+        if last_daily_str:
+            last_daily = datetime.fromisoformat(last_daily_str).astimezone(VIETNAM_TZ)
+            if now.date() == last_daily.date():
+                raise Rejected("Bạn đã nhận thưởng hôm nay rồi. Quay lại vào ngày mai!")
+            streak = streak + 1 if (now.date() - last_daily.date()).days == 1 else 1
+        else:
+            streak = 1
+
+        streak = min(streak, 7)
+        base_prize = random.randint(1000, 2000)
+        streak_bonus = streak * 500
+        prize = base_prize + streak_bonus
+        exp = 150 + (streak * 25)
+
+        title = f"🎉 **ĐIỂM DANH NGÀY {streak}**"
+        if streak == 7:
+            jackpot = random.randint(5000, 10000)
+            prize += jackpot
+            title += " - JACKPOT!"
+            prize_details = f"> 💰 **Thưởng:** +{fmt(prize)} xu (có {fmt(jackpot)} xu thưởng!)"
+        else:
+            prize_details = f"> 💰 **Thưởng:** +{fmt(prize)} xu"
+
+        result_txt = f"{title}\n\n{prize_details}\n> ⭐ **Kinh nghiệm:** +{fmt(exp)} EXP"
+        user['coins'] += prize
+        add_exp(user, exp)
+
+        user['last_daily'] = now.isoformat()
+        user['daily_streak'] = streak
     
-    kb = InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Menu", callback_data='back_menu')] ])
+    kb = BACK_KEYBOARD
     await safe_edit_message(context.bot, q.message.chat_id, q.message.message_id, result_txt, kb)
 
+@callbacks.exact('stats')
 async def handle_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.callback_query:
         return
@@ -1084,32 +2659,34 @@ async def handle_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 """
     if next_rank:
         exp_needed = next_rank['exp'] - user.get('total_exp', 0)
-        txt += f"📈 **Hạng tiếp:** {next_rank['name']} (còn {fmt(exp_needed)} EXP)"
-    
+        txt += f"📈 **Hạng tiếp:** {next_rank['name']} (còn {fmt(exp_needed)} EXP)\n"
+
+    exp_pct = await dm.get_percentile(uid, 'total_exp')
+    coin_pct = await dm.get_percentile(uid, 'coins')
+    tiers = await dm.get_tier_distribution()
+    if exp_pct is not None and coin_pct is not None:
+        txt += f"🎯 **Vị trí:** top {exp_pct:.1f}% EXP, top {coin_pct:.1f}% xu\n"
+    txt += f"👥 **Cùng hạng:** {tiers[get_rank_index(user.get('total_exp', 0))]} người chơi"
+
     s = user.get('stats', {})
     txt += f"\n\n**Thành Tích**\n🎲 Chẵn Lẻ: {s.get('cl_win', 0)} thắng - {s.get('cl_lose', 0)} thua"
     
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, BACK_KEYBOARD)
 
+@callbacks.exact('ranking')
 async def handle_ranking(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.callback_query:
         return
     txt = "🏆 **BẢNG XẾP HẠNG** 🏆\n\nChọn loại bảng xếp hạng bạn muốn xem."
-    kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("💰 Top Xu", callback_data='top_coins'), InlineKeyboardButton("⭐ Top Rank", callback_data='top_rank')],
-        [InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]
-    ])
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, kb)
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, RANKING_KEYBOARD)
 
+@callbacks.exact('top_coins')
 async def handle_top_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.callback_query:
         return
     uid = update.callback_query.from_user.id
     
-    async with dm.lock:
-        all_users_sorted = sorted(dm.users.values(), key=lambda x: x.get('coins', 0), reverse=True)
-    
-    top_10_users = all_users_sorted[:10]
+    top_10_users = await dm.get_top_users('coins', 10)
 
     txt = "🏆 **TOP 10 GIÀU CÓ** 🏆\n\n" 
     medals = ["🥇", "🥈", "🥉"] + [f"**{i}.**" for i in range(4, 11)]
@@ -1120,25 +2697,21 @@ async def handle_top_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
         txt += f"{medals[i]} {u.get('username', 'User')[:20]} - **{fmt(u.get('coins', 0))} xu**\n"
 
     if not user_in_top_10:
-        try:
-            user_rank_index = next(i for i, u in enumerate(all_users_sorted) if u.get('user_id') == str(uid))
-            user_data = all_users_sorted[user_rank_index]
+        position = await dm.get_user_position(uid, 'coins')
+        if position:
+            user_data = await dm.get_user(uid)
             txt += "...\n"
-            txt += f"**{user_rank_index + 1}.** {user_data.get('username', 'User')[:20]} - **{fmt(user_data.get('coins', 0))} xu** (Bạn)\n"
-        except StopIteration:
-            pass
+            txt += f"**{position}.** {user_data.get('username', 'User')[:20]} - **{fmt(user_data.get('coins', 0))} xu** (Bạn)\n"
 
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, InlineKeyboardMarkup([[InlineKeyboardButton("↩️ BXH", callback_data='ranking')]]))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, BACK_RANKING_KEYBOARD)
 
+@callbacks.exact('top_rank')
 async def handle_top_rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.callback_query:
         return
     uid = update.callback_query.from_user.id
 
-    async with dm.lock:
-        all_users_sorted = sorted(dm.users.values(), key=lambda x: x.get('total_exp', 0), reverse=True)
-    
-    top_10_users = all_users_sorted[:10]
+    top_10_users = await dm.get_top_users('total_exp', 10)
 
     txt = "🏆 **TOP 10 CẤP ĐỘ** 🏆\n\n" 
     medals = ["🥇", "🥈", "🥉"] + [f"**{i}.**" for i in range(4, 11)]
@@ -1150,57 +2723,167 @@ async def handle_top_rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
         txt += f"{medals[i]} {u.get('username', 'User')[:20]} - **{rank['name']}** ({fmt(u.get('total_exp', 0))} EXP)\n"
 
     if not user_in_top_10:
-        try:
-            user_rank_index = next(i for i, u in enumerate(all_users_sorted) if u.get('user_id') == str(uid))
-            user_data = all_users_sorted[user_rank_index]
+        position = await dm.get_user_position(uid, 'total_exp')
+        if position:
+            user_data = await dm.get_user(uid)
             rank, _ = get_user_rank(user_data.get('total_exp', 0))
             txt += "...\n"
-            txt += f"**{user_rank_index + 1}.** {user_data.get('username', 'User')[:20]} - **{rank['name']}** ({fmt(user_data.get('total_exp', 0))} EXP) (Bạn)\n"
-        except StopIteration:
-            pass
+            txt += f"**{position}.** {user_data.get('username', 'User')[:20]} - **{rank['name']}** ({fmt(user_data.get('total_exp', 0))} EXP) (Bạn)\n"
 
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, InlineKeyboardMarkup([[InlineKeyboardButton("↩️ BXH", callback_data='ranking')]]))
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, BACK_RANKING_KEYBOARD)
 
+@callbacks.exact('help')
 async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.callback_query:
         return
-    txt = """
-📖 **HƯỚNG DẪN CHƠI GAME** 📖
-
-Chào mừng bạn đến với thế giới mini-game!
-
-**📜 QUY TẮC CHUNG**
-- **Cược Mặc Định:** 10% số xu hiện có (tối thiểu 10 xu). Thắng nhận x2.5 tiền cược.
-- **Phần Thưởng EXP:** Mỗi ván thắng được 1,000 EXP.
-- **Bảo Hiểm Thua:** Thua 3 ván liên tiếp = chắc chắn thắng ván tiếp theo!
-
-**🎲 DANH SÁCH TRÒ CHƠI**
-
-- **🪙 Tung Đồng Xu:** 50/50 Sấp hoặc Ngửa
-- **🎰 Máy Xèng:** Quay 3 biểu tượng giống nhau để thắng lớn
-- **💎 Kho Báu:** Chọn 1/3 rương chứa kho báu
-- **✊ Oẳn Tù Tì:** Kéo, Búa, Bao cổ điển
-- **🔢 Đoán Số:** Đoán số từ 1-100
-- **🃏 Cao/Thấp:** Đoán lá bài tiếp theo
-- **🎲 Chẵn Lẻ / Tài Xỉu:** Dựa vào tổng xúc xắc
-- **🎡 Vòng Quay:** Quay nhận thưởng ngẫu nhiên
+    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, HELP_TEXT, BACK_KEYBOARD)
+
+def normalize_prompt(text: str) -> str:
+    return ' '.join(text.casefold().split())
+
+class AIResponseCache:
+    """AI replies keyed by normalized prompt, with LRU + TTL eviction.
+
+    Identical prompts already in flight wait on the same upstream call.
+    Each cached entry remembers how long its upstream call took, which is
+    counted as saved latency whenever the entry is served again.
+    """
+
+    def __init__(self, maxsize: int = AI_CACHE_SIZE, ttl: float = AI_CACHE_TTL):
+        self._cache = LRUCache(maxsize, ttl)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+
+    async def get(self, prompt: str, fetch: Callable[[str], Awaitable[Optional[str]]]) -> Optional[str]:
+        key = normalize_prompt(prompt)
+        cached = self._cache.get(key)
+        if cached is not None:
+            reply, latency = cached
+            self.hits += 1
+            self.saved_latency += latency
+            return reply
+        task = self._inflight.get(key)
+        if task:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.create_task(self._fetch(key, prompt, fetch))
+        return await asyncio.shield(task)
 
-**🎁 TÍNH NĂNG KHÁC**
-- **/menu:** Menu chính
-- **/stats:** Thống kê cá nhân
-- **/ranking:** Bảng xếp hạng
-- **/daily:** Điểm danh hàng ngày
-- **/tip:** Chuyển xu cho người khác
+    async def _fetch(self, key: str, prompt: str, fetch: Callable[[str], Awaitable[Optional[str]]]) -> Optional[str]:
+        start = time.monotonic()
+        try:
+            reply = await fetch(prompt)
+            if reply:
+                self._cache.set(key, (reply, time.monotonic() - start))
+            return reply
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.coalesced + self.misses
+        return {'hits': self.hits, 'coalesced': self.coalesced, 'misses': self.misses,
+                'hit_rate': (self.hits + self.coalesced) / total if total else 0.0,
+                'saved_latency': self.saved_latency}
+
+ai_cache = AIResponseCache()
+
+async def ask_ai(prompt: str) -> Optional[str]:
+    response = await ai_client.chat.completions.create(
+        model=AI_MODEL,
+        messages=[
+            {
+                'role': 'user',
+                'content': prompt
+            }
+        ]
+    )
+    return response.choices[0].message.content
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Split text into Telegram-sized parts, preferring line breaks.
+
+    Cuts depend only on the text before them, so a growing streamed reply
+    never moves an earlier boundary.
+    """
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit)
+        if cut <= limit // 2:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+stream_stats = {'streams': 0, 'ttft_total': 0.0}
+
+async def stream_ai_reply(bot: Bot, message: Any, prompt: str) -> Optional[str]:
+    """Stream a completion into a placeholder reply, editing at most every STREAM_EDIT_INTERVAL."""
+    placeholder = await message.reply_text("💭 ...")
+    chat_id = placeholder.chat_id
+    sent = [placeholder]
+    chunks: List[str] = []
+    start = time.monotonic()
+    last_edit = float('-inf')  # show the first token right away
+
+    async def render(text: str, cursor: str = ''):
+        # Split the bare text so boundaries match the final render; the
+        # cursor only ever rides on the last part, which leaves it room.
+        parts = split_message(text, TELEGRAM_MESSAGE_LIMIT - len(STREAM_CURSOR))
+        parts[-1] += cursor
+        for i, part in enumerate(parts):
+            if i < len(sent):
+                await safe_edit_message(bot, chat_id, sent[i].message_id, part, None, parse_mode=None)
+            else:
+                sent.append(await message.reply_text(part))
+        while len(sent) > len(parts):
+            with contextlib.suppress(TelegramError):
+                await bot.delete_message(chat_id, sent.pop().message_id)
 
-Chúc bạn chơi game vui vẻ! 🍀
-"""
-    await safe_edit_message(context.bot, update.effective_chat.id, update.callback_query.message.message_id, txt, InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Menu", callback_data='back_menu')]]))
+    try:
+        stream = await ai_client.chat.completions.create(
+            model=AI_MODEL,
+            messages=[
+                {
+                    'role': 'user',
+                    'content': prompt
+                }
+            ],
+            stream=True
+        )
+        async for event in stream:
+            delta = event.choices[0].delta.content if event.choices else None
+            if not delta:
+                continue
+            if not chunks:
+                ttft = time.monotonic() - start
+                stream_stats['streams'] += 1
+                stream_stats['ttft_total'] += ttft
+                logger.info(f"AI first token after {ttft * 1000:.0f} ms")
+            chunks.append(delta)
+            now = time.monotonic()
+            if now - last_edit >= STREAM_EDIT_INTERVAL:
+                last_edit = now
+                await render(''.join(chunks), STREAM_CURSOR)
+    except Exception:
+        await render(''.join(chunks) or "Xin lỗi, tôi không thể xử lý yêu cầu của bạn lúc này.")
+        raise
+
+    reply = ''.join(chunks)
+    await render(reply or "Tôi không có câu trả lời cho điều đó.")
+    return reply
 
 async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.message or not update.message.text:
         return
     uid = update.effective_user.id
-    await rate_limiter.acquire(uid)
+    if not rate_limiter.allow(uid):
+        return
     await update_username_if_needed(uid, update.effective_user)
 
     user_message = update.message.text[1:].lstrip()
@@ -1209,25 +2892,31 @@ async def chat_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Vui lòng nhập nội dung sau dấu ! Ví dụ: !hello")
         return
 
+    # Only the request that actually reaches the gateway streams; cache hits
+    # and coalesced duplicates reply with the finished text.
+    streamed = False
+
+    async def fetch(prompt: str) -> Optional[str]:
+        nonlocal streamed
+        if not AI_STREAM:
+            return await ask_ai(prompt)
+        streamed = True
+        return await stream_ai_reply(context.bot, update.message, prompt)
+
     try:
-        response = await ai_client.chat.completions.create(
-            model=AI_MODEL,
-            messages=[
-                {
-                    'role': 'user',
-                    'content': user_message
-                }
-            ]
-        )
-        bot_response = response.choices[0].message.content
+        bot_response = await ai_cache.get(user_message, fetch)
+        if streamed:
+            return
         if bot_response:
-            await update.message.reply_text(bot_response)
+            for part in split_message(bot_response):
+                await update.message.reply_text(part)
         else:
             await update.message.reply_text("Tôi không có câu trả lời cho điều đó.")
 
     except Exception as e:
         logger.error(f"Error calling OpenAI: {e}")
-        await update.message.reply_text("Xin lỗi, tôi không thể xử lý yêu cầu của bạn lúc này.")
+        if not streamed:
+            await update.message.reply_text("Xin lỗi, tôi không thể xử lý yêu cầu của bạn lúc này.")
 
 async def tip_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user:
@@ -1264,14 +2953,8 @@ async def tip_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if target_identifier.startswith('@'):
             target_username = target_identifier
-            found = False
-            async with dm.lock:
-                for uid, udata in dm.users.items():
-                    if udata.get('username') == target_username:
-                        target_user_id = int(uid)
-                        found = True
-                        break
-            if not found:
+            target_user_id = await dm.find_user_by_username(target_username)
+            if target_user_id is None:
                 await update.message.reply_text(f"Không tìm thấy người dùng {target_username}.")
                 return
         else:
@@ -1289,20 +2972,13 @@ async def tip_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Bạn không thể tip cho chính mình.")
         return
 
-    sender_user = await dm.get_user(sender_id)
+    ok, users = await dm.transfer(sender_id, {target_user_id: amount}, memo='tip')
+    sender_user, target_user = users[sender_id], users[target_user_id]
 
-    if sender_user['coins'] < amount:
+    if not ok:
         await update.message.reply_text(f"Bạn không đủ xu. Bạn chỉ có {fmt(sender_user['coins'])} xu.")
         return
 
-    target_user = await dm.get_user(target_user_id)
-    
-    sender_user['coins'] -= amount
-    target_user['coins'] += amount
-    
-    await dm.update_user(sender_id, sender_user)
-    await dm.update_user(target_user_id, target_user)
-
     sender_username = sender_user.get('username', f'User {sender_id}')
     target_username = target_user.get('username', f'User {target_user_id}')
     await update.message.reply_text(f"{sender_username} đã tip {target_username} {fmt(amount)} xu!")
@@ -1313,27 +2989,27 @@ async def give_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     args = context.args
-    target_user_id = None
+    target_user_ids: List[int] = []
     amount = 0
 
     try:
         if update.message.reply_to_message:
-            target_user_id = update.message.reply_to_message.from_user.id
+            target_user_ids = [update.message.reply_to_message.from_user.id]
             if not args:
                 await update.message.reply_text("Usage: /give <số tiền> khi reply.")
                 return
             amount = int(args[0])
         else:
             if not args:
-                await update.message.reply_text("Usage: /give <user_id> <số tiền> HOẶC /give <số tiền> (cho chính mình).")
+                await update.message.reply_text("Usage: /give <user_id> [user_id ...] <số tiền> HOẶC /give <số tiền> (cho chính mình).")
                 return
             
             if len(args) == 1:
                 amount = int(args[0])
-                target_user_id = update.effective_user.id
+                target_user_ids = [update.effective_user.id]
             else:
-                target_user_id = int(args[0])
-                amount = int(args[1])
+                target_user_ids = list(dict.fromkeys(int(a) for a in args[:-1]))
+                amount = int(args[-1])
 
     except (ValueError, IndexError):
         await update.message.reply_text("Format lệnh không hợp lệ.")
@@ -1343,16 +3019,101 @@ async def give_coins(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Số tiền phải lớn hơn 0.")
         return
 
-    if not target_user_id:
+    if not target_user_ids:
         await update.message.reply_text("Không thể xác định người nhận.")
         return
 
-    target_user = await dm.get_user(target_user_id)
-    target_user['coins'] += amount
-    await dm.update_user(target_user_id, target_user)
+    _, users = await dm.transfer(None, {uid: amount for uid in target_user_ids}, memo='give')
 
-    target_username = target_user.get('username', f'User {target_user_id}')
-    await update.message.reply_text(f"Đã cấp {fmt(amount)} xu cho {target_username}.")
+    if len(target_user_ids) == 1:
+        target_user_id = target_user_ids[0]
+        target_username = users[target_user_id].get('username', f'User {target_user_id}')
+        await update.message.reply_text(f"Đã cấp {fmt(amount)} xu cho {target_username}.")
+    else:
+        await update.message.reply_text(f"Đã cấp {fmt(amount)} xu cho {len(target_user_ids)} người dùng.")
+
+async def bot_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.effective_user or update.effective_user.id != BOT_OWNER_ID:
+        await update.message.reply_text("Bạn không có quyền sử dụng lệnh này.")
+        return
+
+    rl = rate_limiter.stats()
+    ob = outbound.stats()
+    ai = ai_cache.stats()
+    txt = (
+        "📈 **BOT STATS**\n\n"
+        f"**Rate limit:** {rl['allowed']} cho phép / {rl['dropped']} bị chặn ({rl['tracked_users']} người dùng đang theo dõi)\n"
+        f"**Outbound:** {ob['sent']} đã gửi, {ob['coalesced']} gộp, {ob['retried']} thử lại, {ob['failed']} lỗi, {ob['queued']} đang chờ\n"
+        f"**Identity cache:** {identity_cache.hits} hit / {identity_cache.misses} miss ({len(identity_cache)} mục)\n"
+        f"**Edit cache:** {edit_stats['sent']} đã gửi, {edit_stats['skipped']} bỏ qua ({len(edit_cache)} tin nhắn)\n"
+        f"**Admin cache:** {admin_cache.fetches} lần gọi API\n"
+        f"**AI stream:** {stream_stats['streams']} lượt, TTFT trung bình {stream_stats['ttft_total'] / max(stream_stats['streams'], 1) * 1000:.0f} ms\n"
+        f"**AI cache:** {ai['hits']} hit, {ai['coalesced']} gộp, {ai['misses']} miss ({ai['hit_rate'] * 100:.1f}%), tiết kiệm {ai['saved_latency']:.1f}s\n"
+        f"**Callback:** {sum(callbacks.hits.values())} lượt, {callbacks.unknown} không rõ\n"
+    )
+    busiest = sorted(callbacks.hits.items(), key=lambda kv: kv[1], reverse=True)[:5]
+    txt += "\n".join(f"  `{route}`: {count}" for route, count in busiest if count)
+    await update.message.reply_text(txt, parse_mode='Markdown')
+
+async def tier_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.effective_user or update.effective_user.id != BOT_OWNER_ID:
+        await update.message.reply_text("Bạn không có quyền sử dụng lệnh này.")
+        return
+
+    tiers = await dm.get_tier_distribution()
+    total = sum(tiers) or 1
+    lines = [f"{rank['name']} ({fmt(rank['exp'])}+): {count} ({count / total * 100:.1f}%)" for rank, count in zip(RANKS, tiers)]
+    await update.message.reply_text("📊 **PHÂN BỐ HẠNG**\n\n" + "\n".join(lines), parse_mode='Markdown')
+
+class AdminCache:
+    """Administrator ids per chat, kept for ADMIN_CACHE_TTL.
+
+    Concurrent lookups on a cold chat share one get_chat_administrators call,
+    and chat-member updates touching an admin drop the chat's entry.
+    """
+
+    def __init__(self, ttl: float = ADMIN_CACHE_TTL, maxsize: int = ADMIN_CACHE_SIZE):
+        self._cache = LRUCache(maxsize, ttl)
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self.fetches = 0
+
+    async def get(self, bot: Bot, chat_id: int) -> FrozenSet[int]:
+        admin_ids = self._cache.get(chat_id)
+        if admin_ids is not None:
+            return admin_ids
+        task = self._inflight.get(chat_id)
+        if task is None:
+            task = self._inflight[chat_id] = asyncio.create_task(self._fetch(bot, chat_id))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, bot: Bot, chat_id: int) -> FrozenSet[int]:
+        me = asyncio.current_task()
+        try:
+            self.fetches += 1
+            admins = await bot.get_chat_administrators(chat_id)
+            admin_ids = frozenset(admin.user.id for admin in admins)
+            # An invalidation during the fetch means this list may be stale.
+            if self._inflight.get(chat_id) is me:
+                self._cache.set(chat_id, admin_ids)
+            return admin_ids
+        finally:
+            if self._inflight.get(chat_id) is me:
+                del self._inflight[chat_id]
+
+    def invalidate(self, chat_id: int):
+        self._cache.pop(chat_id)
+        self._inflight.pop(chat_id, None)
+
+admin_cache = AdminCache()
+
+ADMIN_STATUSES = (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+
+async def chat_member_updated(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    change = update.chat_member or update.my_chat_member
+    if not change:
+        return
+    if change.old_chat_member.status in ADMIN_STATUSES or change.new_chat_member.status in ADMIN_STATUSES:
+        admin_cache.invalidate(change.chat.id)
 
 async def kick_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or update.message.chat.type not in ['group', 'supergroup']:
@@ -1362,8 +3123,7 @@ async def kick_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     user_id = update.effective_user.id
 
-    admins = await context.bot.get_chat_administrators(chat_id)
-    admin_ids = {admin.user.id for admin in admins}
+    admin_ids = await admin_cache.get(context.bot, chat_id)
 
     if user_id not in admin_ids:
         await update.message.reply_text("Bạn không phải admin.")
@@ -1377,7 +3137,7 @@ async def kick_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-                await context.bot.kick_chat_member(chat_id, target_user_id)
+        await context.bot.kick_chat_member(chat_id, target_user_id)
         await update.message.reply_text(f"Đã kick người dùng {target_user_id}.")
     except Exception as e:
         logger.error(f"Không thể kick user {target_user_id}: {e}")
@@ -1391,8 +3151,7 @@ async def ban_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     user_id = update.effective_user.id
 
-    admins = await context.bot.get_chat_administrators(chat_id)
-    admin_ids = {admin.user.id for admin in admins}
+    admin_ids = await admin_cache.get(context.bot, chat_id)
 
     if user_id not in admin_ids:
         await update.message.reply_text("Bạn không phải admin.")
@@ -1420,8 +3179,7 @@ async def unban_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     user_id = update.effective_user.id
 
-    admins = await context.bot.get_chat_administrators(chat_id)
-    admin_ids = {admin.user.id for admin in admins}
+    admin_ids = await admin_cache.get(context.bot, chat_id)
 
     if user_id not in admin_ids:
         await update.message.reply_text("Bạn không phải admin.")
@@ -1461,8 +3219,7 @@ async def mute_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     user_id = update.effective_user.id
 
-    admins = await context.bot.get_chat_administrators(chat_id)
-    admin_ids = {admin.user.id for admin in admins}
+    admin_ids = await admin_cache.get(context.bot, chat_id)
 
     if user_id not in admin_ids:
         await update.message.reply_text("Bạn không phải admin.")
@@ -1496,8 +3253,7 @@ async def unmute_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     user_id = update.effective_user.id
 
-    admins = await context.bot.get_chat_administrators(chat_id)
-    admin_ids = {admin.user.id for admin in admins}
+    admin_ids = await admin_cache.get(context.bot, chat_id)
 
     if user_id not in admin_ids:
         await update.message.reply_text("Bạn không phải admin.")
@@ -1534,8 +3290,7 @@ async def pin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     user_id = update.effective_user.id
 
-    admins = await context.bot.get_chat_administrators(chat_id)
-    admin_ids = {admin.user.id for admin in admins}
+    admin_ids = await admin_cache.get(context.bot, chat_id)
 
     if user_id not in admin_ids:
         await update.message.reply_text("Bạn không phải admin.")
@@ -1560,8 +3315,7 @@ async def unpin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.message.chat_id
     user_id = update.effective_user.id
 
-    admins = await context.bot.get_chat_administrators(chat_id)
-    admin_ids = {admin.user.id for admin in admins}
+    admin_ids = await admin_cache.get(context.bot, chat_id)
 
     if user_id not in admin_ids:
         await update.message.reply_text("Bạn không phải admin.")
@@ -1576,30 +3330,155 @@ async def unpin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def post_init(application: Application) -> None:
     await dm.initialize()
+    outbound.start()
     logger.info("🤖 Bot khởi động thành công!")
 
 async def post_shutdown(application: Application) -> None:
+    await outbound.stop()
     await dm.shutdown()
     logger.info("Bot đã tắt.")
 
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each user's updates in arrival order.
+
+    Every update chains onto the previous pending update of the same user (or
+    chat, when there is no user), so guesses and button presses of one user
+    apply in sequence while different users run in parallel.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._tails: Dict[int, asyncio.Future] = {}
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    # process_update is marked @final for type checkers only. It is overridden
+    # so an update waits for its predecessor *before* taking a semaphore slot;
+    # otherwise one user's queued updates would hold slots while idle.
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:  # type: ignore[misc]
+        key = self._key(update)
+        if key is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+        prev = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        try:
+            if prev is not None:
+                await asyncio.shield(prev)
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+        finally:
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+HANDLER_UPDATE_TYPES: Dict[type, Tuple[str, ...]] = {
+    CommandHandler: (Update.MESSAGE,),
+    MessageHandler: (Update.MESSAGE,),
+    CallbackQueryHandler: (Update.CALLBACK_QUERY,),
+    ChatMemberHandler: (Update.CHAT_MEMBER, Update.MY_CHAT_MEMBER),
+}
+
+def allowed_update_types(app: Application) -> List[str]:
+    """Update types Telegram should deliver, derived from the registered handlers."""
+    types: Set[str] = set()
+    for group in app.handlers.values():
+        for handler in group:
+            kinds = next((v for k, v in HANDLER_UPDATE_TYPES.items() if isinstance(handler, k)), None)
+            if kinds is None:
+                logger.warning(f"Không rõ loại update cho {type(handler).__name__}, nhận tất cả.")
+                return Update.ALL_TYPES
+            types.update(kinds)
+    return sorted(types)
+
+def create_webhook_app(app: Application) -> web.Application:
+    async def handle_update(request: web.Request) -> web.Response:
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await app.update_queue.put(Update.de_json(data, app.bot))
+        return web.Response()
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, handle_update)
+    return web_app
+
+async def run_webhook(app: Application, allowed_updates: List[str]) -> None:
+    """Serve updates over an aiohttp webhook, mirroring run_polling's lifecycle."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(create_webhook_app(app))
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+        )
+        await app.start()
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+        logger.info(f"Webhook đang lắng nghe {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH} ({', '.join(allowed_updates)})")
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
 def main() -> None:
     if not BOT_TOKEN:
         logger.critical("BOT_TOKEN chưa được cấu hình.")
         return
 
-    app = (
+    builder = (
         Application.builder()
         .token(BOT_TOKEN)
         .post_init(post_init)
         .post_shutdown(post_shutdown)
-        .build()
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
     )
+    if WEBHOOK_URL:
+        builder = builder.updater(None)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("menu", menu))
     app.add_handler(MessageHandler(filters.TEXT & filters.Regex(r'^!.*'), chat_handler))
     app.add_handler(CommandHandler("tip", tip_coins))
     app.add_handler(CommandHandler("give", give_coins))
+    app.add_handler(CommandHandler("botstats", bot_stats))
+    app.add_handler(CommandHandler("tiers", tier_stats))
     app.add_handler(CommandHandler("kick", kick_member))
     app.add_handler(CommandHandler("ban", ban_member))
     app.add_handler(CommandHandler("unban", unban_member))
@@ -1608,9 +3487,14 @@ def main() -> None:
     app.add_handler(CommandHandler("pin", pin_message))
     app.add_handler(CommandHandler("unpin", unpin_message))
     app.add_handler(CallbackQueryHandler(button_handler))
+    app.add_handler(ChatMemberHandler(chat_member_updated, ChatMemberHandler.ANY_CHAT_MEMBER))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, guess_game))
 
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    allowed_updates = allowed_update_types(app)
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(app, allowed_updates))
+    else:
+        app.run_polling(allowed_updates=allowed_updates)
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# main reads its configuration at import time.
+os.environ.setdefault('AI_GATEWAY_API_KEY', 'test')
+os.environ['GITHUB_TOKEN'] = ''
+os.environ.pop('WEBHOOK_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Run every test in its own directory; snapshot, journal and ledger paths are relative."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,76 @@
+import asyncio
+import time
+import types
+
+import main
+
+
+class AdminBot:
+    """get_chat_administrators that counts calls and can be held open."""
+
+    def __init__(self, admins):
+        self.admins = admins
+        self.calls = 0
+        self.gate = None
+
+    async def get_chat_administrators(self, chat_id):
+        self.calls += 1
+        admins = list(self.admins)
+        if self.gate:
+            await self.gate.wait()
+        return [types.SimpleNamespace(user=types.SimpleNamespace(id=uid)) for uid in admins]
+
+
+def test_admins_are_cached_for_the_ttl(monkeypatch):
+    offset = [0.0]
+    real = time.monotonic
+    monkeypatch.setattr(main.time, 'monotonic', lambda: real() + offset[0])
+    cache = main.AdminCache(ttl=300)
+    bot = AdminBot({1, 2})
+
+    async def scenario():
+        assert await cache.get(bot, -100) == {1, 2}
+        bot.admins = {1}
+        offset[0] += 299
+        assert await cache.get(bot, -100) == {1, 2}
+        offset[0] += 2
+        assert await cache.get(bot, -100) == {1}
+
+    asyncio.run(scenario())
+    assert bot.calls == cache.fetches == 2
+
+
+def test_concurrent_lookups_share_one_fetch():
+    cache = main.AdminCache()
+    bot = AdminBot({7})
+
+    async def scenario():
+        bot.gate = asyncio.Event()
+        waiters = [asyncio.create_task(cache.get(bot, -100)) for _ in range(10)]
+        await asyncio.sleep(0)
+        bot.gate.set()
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(scenario()) == [frozenset({7})] * 10
+    assert bot.calls == 1
+
+
+def test_invalidation_during_a_fetch_is_not_overwritten():
+    cache = main.AdminCache()
+    bot = AdminBot({1, 2})
+
+    async def scenario():
+        bot.gate = asyncio.Event()
+        stale = asyncio.create_task(cache.get(bot, -100))
+        while not bot.calls:
+            await asyncio.sleep(0)
+        # Admin 2 is demoted while the first list is still on its way.
+        bot.admins = {1}
+        cache.invalidate(-100)
+        bot.gate.set()
+        assert await stale == {1, 2}
+        bot.gate = None
+        return await cache.get(bot, -100)
+
+    assert asyncio.run(scenario()) == {1}
+    assert bot.calls == 2
@@ -0,0 +1,88 @@
+import asyncio
+
+import openai
+import pytest
+from aiohttp import web
+from openai import AsyncOpenAI
+
+import main
+from benchmarks.fakes import GATEWAY, fake_gateway
+
+
+def run(scenario, chunks=3, gap=0.02):
+    """Run scenario(gateway) with main.ai_client pointed at a local fake gateway."""
+    async def wrapped():
+        app = fake_gateway(chunks, gap)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        host, port = runner.addresses[0][:2]
+        client = AsyncOpenAI(api_key='test', base_url=f'http://{host}:{port}/v1', max_retries=0)
+        original, main.ai_client = main.ai_client, client
+        try:
+            await asyncio.wait_for(scenario(app[GATEWAY]), 5)
+        finally:
+            main.ai_client = original
+            await client.close()
+            await runner.cleanup()
+    asyncio.run(wrapped())
+
+
+def test_identical_prompts_in_flight_share_one_upstream_call():
+    cache = main.AIResponseCache()
+
+    async def scenario(gateway):
+        prompts = ['Hello world', 'hello   WORLD', ' hello world ', 'Hello world', 'HELLO WORLD']
+        replies = await asyncio.gather(*(cache.get(p, main.ask_ai) for p in prompts))
+        assert replies == ['token ' * 3] * 5
+        assert gateway.requests == 1
+        assert (cache.misses, cache.coalesced, cache.hits) == (1, 4, 0)
+        assert await cache.get('hello world', main.ask_ai) == 'token ' * 3
+        assert gateway.requests == 1 and cache.hits == 1
+
+    run(scenario)
+
+
+def test_entries_expire_after_the_ttl():
+    cache = main.AIResponseCache(ttl=0.2)
+
+    async def scenario(gateway):
+        await cache.get('q', main.ask_ai)
+        await cache.get('q', main.ask_ai)
+        assert gateway.requests == 1
+        await asyncio.sleep(0.3)
+        await cache.get('q', main.ask_ai)
+        assert gateway.requests == 2
+
+    run(scenario)
+
+
+def test_failures_are_not_cached():
+    cache = main.AIResponseCache()
+
+    async def scenario(gateway):
+        gateway.fail = 1
+        results = await asyncio.gather(*(cache.get('q', main.ask_ai) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, openai.InternalServerError) for r in results)
+        assert gateway.requests == 1
+        assert await cache.get('q', main.ask_ai) == 'token ' * 3
+        assert gateway.requests == 2
+
+    run(scenario)
+
+
+@pytest.mark.parametrize('reply', [None, ''])
+def test_empty_replies_are_not_cached(reply):
+    cache = main.AIResponseCache()
+    calls = []
+
+    async def fetch(prompt):
+        calls.append(prompt)
+        return reply
+
+    async def scenario():
+        assert await cache.get('q', fetch) == reply
+        assert await cache.get('q', fetch) == reply
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
@@ -0,0 +1,161 @@
+import asyncio
+import types
+
+import pytest
+
+import main
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        async def method(*args, **kwargs):
+            await asyncio.sleep(0.001)
+            self.calls.append((name, args, kwargs))
+            return types.SimpleNamespace(message_id=args[2] if len(args) > 2 else 1)
+        return method
+
+
+def tap(bot, uid, data, chat_id=None, message_id=10):
+    user = types.SimpleNamespace(id=uid, username=f'p{uid}', first_name='P')
+
+    async def answer(text=None, show_alert=False):
+        await asyncio.sleep(0.001)
+        bot.calls.append(('answer', (uid, text), {'show_alert': show_alert}))
+
+    query = types.SimpleNamespace(id=f'{uid}:{data}', from_user=user, data=data, answer=answer,
+                                  message=types.SimpleNamespace(chat_id=chat_id or uid, message_id=message_id))
+    update = types.SimpleNamespace(callback_query=query, effective_user=user,
+                                   effective_chat=types.SimpleNamespace(id=chat_id or uid), message=None)
+    return main.button_handler(update, types.SimpleNamespace(bot=bot, args=[]))
+
+
+def answers(bot, uid=None):
+    return [(args[1], kwargs['show_alert']) for name, args, kwargs in bot.calls
+            if name == 'answer' and (uid is None or args[0] == uid)]
+
+
+def run(scenario):
+    """Run scenario against a fresh main.dm; the ledger writer is bound to this event loop."""
+    async def wrapped():
+        await main.dm.initialize()
+        try:
+            await asyncio.wait_for(scenario, 5)
+        finally:
+            await main.dm.shutdown()
+    asyncio.run(wrapped())
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    monkeypatch.setattr(main, 'rate_limiter', main.RateLimiter())
+    monkeypatch.setattr(main, 'dm', main.DataManager())
+    main.edit_cache.clear()
+    yield FakeBot()
+    main.pending_answers.clear()
+
+
+def test_tap_is_answered_once_alongside_the_edit(bot):
+    run(tap(bot, 1, 'back_menu'))
+    assert answers(bot) == [(None, False)]
+    assert [name for name, _, _ in bot.calls].count('edit_message_text') == 1
+
+
+def test_alert_is_the_answer(bot):
+    async def scenario():
+        async with main.dm.transaction(1) as user:
+            user['coins'] = 0
+        await tap(bot, 1, 'game_slots')
+
+    run(scenario())
+    ((text, alert),) = answers(bot)
+    assert alert and text.startswith('❌ Cần')
+
+
+def test_shared_message_answers_each_tapper_separately(bot):
+    async def scenario():
+        async with main.dm.transaction(2) as user:
+            user['coins'] = 0
+        await asyncio.gather(tap(bot, 1, 'back_menu', chat_id=-100, message_id=55),
+                             tap(bot, 2, 'game_slots', chat_id=-100, message_id=55))
+
+    run(scenario())
+    assert answers(bot, 1) == [(None, False)]
+    ((text, alert),) = answers(bot, 2)
+    assert alert and text.startswith('❌ Cần')
+    assert not main.pending_answers
+
+
+def test_rate_limited_tap_gets_feedback(bot):
+    async def scenario():
+        for _ in range(main.USER_BURST + 1):
+            await tap(bot, 1, 'help')
+
+    run(scenario())
+    text, alert = answers(bot)[-1]
+    assert text and not alert
+
+
+def test_rejected_tap_alerts_outside_the_lock_without_restaging(bot, monkeypatch):
+    staged, locked = [], []
+    alert = main.answer_alert
+
+    async def answer_alert(update, text):
+        locked.append(any(lock.locked() for lock in main.dm._user_locks))
+        await alert(update, text)
+
+    async def scenario():
+        async with main.dm.transaction(1) as user:
+            user['coins'] = 0
+        monkeypatch.setattr(main.dm, 'update_user', lambda *a, **kw: staged.append(a))
+        monkeypatch.setattr(main, 'answer_alert', answer_alert)
+        await tap(bot, 1, 'game_slots')
+
+    run(scenario())
+    assert locked == [False]
+    assert staged == []
+    ((text, alert_shown),) = answers(bot)
+    assert alert_shown and text.startswith('❌ Cần')
+
+
+def edits(bot):
+    return [args[0] for name, args, _ in bot.calls if name == 'edit_message_text']
+
+
+def test_identical_edit_is_skipped(bot):
+    async def scenario():
+        for _ in range(3):
+            await main.safe_edit_message(bot, 1, 10, 'same', main.BACK_KEYBOARD)
+
+    asyncio.run(scenario())
+    assert edits(bot) == ['same']
+
+
+def test_changed_text_or_keyboard_goes_through(bot):
+    async def scenario():
+        await main.safe_edit_message(bot, 1, 10, 'a', main.BACK_KEYBOARD)
+        await main.safe_edit_message(bot, 1, 10, 'b', main.BACK_KEYBOARD)
+        await main.safe_edit_message(bot, 1, 10, 'b', main.MENU_KEYBOARD)
+        await main.safe_edit_message(bot, 1, 11, 'b', main.MENU_KEYBOARD)
+        await main.safe_edit_message(bot, 1, 10, 'a', main.BACK_KEYBOARD)
+
+    asyncio.run(scenario())
+    assert edits(bot) == ['a', 'b', 'b', 'b', 'a']
+
+
+def test_edit_cache_evicts_the_least_recent_message(bot, monkeypatch):
+    monkeypatch.setattr(main, 'edit_cache', main.LRUCache(2))
+
+    async def scenario():
+        await main.safe_edit_message(bot, 1, 10, 'x', None)
+        await main.safe_edit_message(bot, 1, 11, 'y', None)
+        await main.safe_edit_message(bot, 1, 10, 'x', None)  # hit, refreshes message 10
+        await main.safe_edit_message(bot, 1, 12, 'z', None)  # evicts message 11
+        await main.safe_edit_message(bot, 1, 11, 'y', None)
+        await main.safe_edit_message(bot, 1, 10, 'x', None)
+
+    asyncio.run(scenario())
+    assert edits(bot) == ['x', 'y', 'z', 'y', 'x']
+    assert len(main.edit_cache) == 2
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('name', sorted(main.GAME_REGISTRY))
+def test_state_round_trips_through_json(name):
+    game = main.GAME_REGISTRY[name](bet=40)
+    state = json.loads(main._compact_json(game.to_state()))
+    assert main.GAME_REGISTRY[name].from_state(state).to_dict() == game.to_dict()
+
+
+@pytest.mark.parametrize('name', sorted(main.GAME_REGISTRY))
+def test_legacy_dict_state_still_loads(name):
+    game = main.GAME_REGISTRY[name](bet=40)
+    assert main.GAME_REGISTRY[name].from_state(game.to_dict()).to_state() == game.to_state()
+
+
+def test_game_state_is_slotted():
+    for cls in main.GAME_REGISTRY.values():
+        assert not hasattr(cls(), '__dict__')
+
+
+def test_load_and_save_game():
+    user = {'minigames': {}}
+    assert main.load_game(user, 'guess_number') is None
+    game = main.GuessNumberGame(bet=10, secret_number=42)
+    main.save_game(user, game)
+    assert user['minigames']['guess_number'] == [1, 100, 10, 42, 0, False]
+    assert main.load_game(user, 'guess_number').make_guess(42) == 'correct'
@@ -0,0 +1,26 @@
+import asyncio
+import json
+
+import main
+
+USERS = {'1': {'user_id': '1', 'username': 'Tuấn 🐉', 'coins': 5}, '2': {'user_id': '2', 'username': '@b', 'coins': 7}}
+
+
+def test_snapshot_round_trips_non_ascii_records():
+    async def scenario():
+        storage = main.JsonStorage()
+        await storage.import_users(USERS)
+        await storage.flush({'2': dict(USERS['2'], coins=9)})
+        assert all(isinstance(frag, bytes) for frag in storage._fragments.values())
+        exported = json.loads(await storage.export())
+        assert await storage.compact()
+        return exported
+
+    exported = asyncio.run(scenario())
+    expected = {'1': USERS['1'], '2': dict(USERS['2'], coins=9)}
+    assert exported == expected
+    assert main.JsonStorage()._read_snapshot() == expected
+
+
+def test_empty_snapshot_is_valid_json():
+    assert b''.join(main.JsonStorage._snapshot_chunks({})) == b'{}'
@@ -0,0 +1,70 @@
+import asyncio
+import random
+
+import pytest
+
+import main
+
+BOUNDS = [0, 10, 100, 1000, 10000]
+
+
+def brute_bucket(value):
+    return max([i for i, bound in enumerate(BOUNDS) if value >= bound] or [0])
+
+
+def random_value(rng):
+    # Few distinct values, so ties, bucket edges and negatives all come up.
+    return rng.choice([rng.randrange(-5, 20000), rng.choice(BOUNDS), rng.choice(BOUNDS) - 1, 42])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_indexes_match_sorting_a_plain_dict(seed):
+    rng = random.Random(seed)
+    values = {str(uid): random_value(rng) for uid in range(60)}
+    board = main.LeaderboardIndex('coins')
+    board.LOAD = 4  # force bucket splits and removals of emptied buckets
+    hist = main.BucketHistogram('coins', BOUNDS)
+    board.rebuild({uid: {'coins': v} for uid, v in values.items()})
+    hist.rebuild({uid: {'coins': v} for uid, v in values.items()})
+
+    for _ in range(400):
+        uid = str(rng.randrange(80))
+        value = random_value(rng)
+        if uid in values and rng.random() < 0.3:
+            # Same bucket, different value; or a move across a bucket edge.
+            value = values[uid] + rng.choice([1, -1, 0])
+        values[uid] = value
+        board.update(uid, value)
+        hist.update(uid, value)
+
+        probe = random_value(rng)
+        ranking = sorted(values, key=lambda u: (-values[u], u))
+        assert len(board) == hist.total == len(values)
+        assert board.top(7) == ranking[:7]
+        assert board.count_above(probe) == sum(v > probe for v in values.values())
+        buckets = [brute_bucket(v) for v in values.values()]
+        assert hist.bucket(probe) == brute_bucket(probe)
+        assert hist.count_at_least(probe) == sum(b >= brute_bucket(probe) for b in buckets)
+        assert hist.count_above(probe) == sum(b > brute_bucket(probe) for b in buckets)
+
+
+def test_percentile_and_position_match_a_brute_force_count(monkeypatch):
+    monkeypatch.setattr(main, 'HISTOGRAM_BOUNDS', BOUNDS)
+    rng = random.Random(7)
+    dm = main.DataManager()
+    dm.users = {str(uid): {'user_id': str(uid), 'coins': random_value(rng), 'total_exp': 0} for uid in range(200)}
+    dm._reindex()
+    for uid in rng.sample(sorted(dm.users), 50):
+        dm.users[uid]['coins'] = random_value(rng)
+        dm._index(uid, dm.users[uid])
+
+    async def views(uid):
+        return await dm.get_user_position(uid, 'coins'), await dm.get_percentile(uid, 'coins')
+
+    for uid in range(0, 200, 7):
+        value = dm.users[str(uid)]['coins']
+        coins = [u['coins'] for u in dm.users.values()]
+        position, percentile = asyncio.run(views(uid))
+        assert position == sum(c > value for c in coins) + 1
+        above = sum(brute_bucket(c) > brute_bucket(value) for c in coins)
+        assert percentile == pytest.approx(min((above + 1) / len(coins) * 100, 100.0))
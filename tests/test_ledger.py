@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+import main
+
+
+async def crash(dm: main.DataManager):
+    """Stop without the final flush, as if the process died after the last ledger commit."""
+    dm._autosave_task.cancel()
+    await dm.ledger.close()
+    await dm.storage.close()
+
+
+async def restart() -> main.DataManager:
+    dm = main.DataManager()
+    await dm.initialize()
+    return dm
+
+
+def test_ledger_replays_unflushed_deltas():
+    async def scenario():
+        dm = await restart()
+        async with dm.transaction(1) as user:
+            user['coins'] += 50
+        await crash(dm)
+
+        dm = await restart()
+        assert dm.users['1']['coins'] == 150
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_ledger_is_not_replayed_over_a_flush():
+    async def scenario():
+        dm = await restart()
+        async with dm.transaction(1) as user:
+            user['coins'] += 50
+        await dm.flush()
+        async with dm.transaction(1) as user:
+            user['total_exp'] += 7
+        await crash(dm)
+
+        dm = await restart()
+        assert dm.users['1']['coins'] == 150
+        assert dm.users['1']['total_exp'] == 7
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_torn_tail_is_dropped_and_appends_keep_working(data_dir):
+    ledger = data_dir / main.LEDGER_FILE
+    ledger.write_text('{"seq":1,"uid":"1","coins":5,"exp":0}\n{"seq":2,"uid":"1","co', encoding='utf-8')
+
+    async def scenario():
+        dm = await restart()
+        assert dm.users['1']['coins'] == 105
+        for _ in range(3):
+            async with dm.transaction(1) as user:
+                user['coins'] += 1
+        await asyncio.wait_for(crash(dm), 5)
+
+        for line in ledger.read_text(encoding='utf-8').splitlines():
+            json.loads(line)
+        dm = await restart()
+        assert dm.users['1']['coins'] == 108
+        await dm.shutdown()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+
+
+def test_complete_tail_without_newline_is_kept(data_dir):
+    ledger = data_dir / main.LEDGER_FILE
+    ledger.write_text('{"seq":1,"uid":"1","coins":5,"exp":0}', encoding='utf-8')
+    entries = main.CoinLedger(str(ledger)).read_entries(0)
+    assert [e['seq'] for e in entries] == [1]
+    assert ledger.read_text(encoding='utf-8').endswith('\n')
+
+
+def test_truncate_skips_unparseable_lines(data_dir):
+    ledger = data_dir / main.LEDGER_FILE
+    ledger.write_text('{"seq":1,"uid":"1","coins":5,"exp":0}\n{"seq":2,"u\n{"seq":3,"uid":"1","coins":1,"exp":0}\n',
+                      encoding='utf-8')
+    main.CoinLedger(str(ledger))._write_batch('', 1)
+    assert [json.loads(line)['seq'] for line in ledger.read_text(encoding='utf-8').splitlines()] == [3]
+
+
+def test_failed_compaction_keeps_the_ledger(data_dir):
+    async def scenario():
+        dm = await restart()
+        async with dm.transaction(1) as user:
+            user['coins'] += 7
+
+        def disk_full(*args):
+            raise OSError('disk full')
+
+        dm.storage._write_snapshot = disk_full
+        await dm.flush(compact=True)
+        await dm.ledger._commit()
+        assert '1' in dm._dirty
+        await crash(dm)
+
+        dm = await restart()
+        assert dm.users['1']['coins'] == 107
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_flush_forgets_idle_ledger_bases():
+    async def scenario():
+        dm = await restart()
+        for uid in range(1, 51):
+            async with dm.transaction(uid) as user:
+                user['coins'] += 1
+        await dm.get_user(99)
+        await dm.flush()
+        assert dm._ledger_base == {}
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_flush_during_a_transaction_keeps_its_delta():
+    async def scenario():
+        dm = await restart()
+        async with dm.transaction(1) as user:
+            await dm.flush()
+            user['coins'] += 25
+        assert set(dm._ledger_base) == {'1'}
+        await crash(dm)
+
+        dm = await restart()
+        assert dm.users['1']['coins'] == 125
+        await dm.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,78 @@
+import asyncio
+import copy
+import json
+
+import main
+
+# Records as the original bot wrote them: no schema_version, fields added over
+# time missing, dict-shaped minigame state and finished games left behind.
+V0_USERS = {
+    '1': {'user_id': '1', 'username': '@old', 'coins': 500, 'created_at': '2024-01-01T00:00:00'},
+    '2': {
+        'user_id': '2', 'username': 'Bob', 'coins': 80, 'created_at': '2024-02-01T00:00:00',
+        'total_exp': 1200, 'daily_streak': 3, 'last_daily': '2024-03-01T08:00:00+07:00',
+        'stats': {'cl_win': 4, 'cl_lose': 1},
+        'minigames': {
+            'guess_number': {'min_val': 1, 'max_val': 100, 'bet': 10, 'secret_number': 42, 'guesses': 2, 'game_over': False},
+            'highlow': {'bet': 25, 'current_card': 7, 'game_over': True, 'win': True},
+            'diceroll': None,
+        },
+    },
+    '3': {'user_id': '3', 'username': '', 'coins': 0, 'created_at': '2024-03-01T00:00:00', 'minigames': None},
+}
+
+EXPECTED = {
+    '1': {
+        'user_id': '1', 'username': '@old', 'coins': 500, 'created_at': '2024-01-01T00:00:00',
+        'total_exp': 0, 'minigames': {}, 'stats': {'cl_win': 0, 'cl_lose': 0, 'hl_win': 0, 'hl_lose': 0},
+        'daily_streak': 0, 'last_daily': None, 'minigame_streaks': {}, 'schema_version': 2,
+    },
+    '2': {
+        'user_id': '2', 'username': 'Bob', 'coins': 80, 'created_at': '2024-02-01T00:00:00',
+        'total_exp': 1200, 'daily_streak': 3, 'last_daily': '2024-03-01T08:00:00+07:00',
+        'stats': {'cl_win': 4, 'cl_lose': 1},
+        'minigames': {'guess_number': [1, 100, 10, 42, 2, False]},
+        'minigame_streaks': {}, 'schema_version': 2,
+    },
+    '3': {
+        'user_id': '3', 'username': '', 'coins': 0, 'created_at': '2024-03-01T00:00:00',
+        'total_exp': 0, 'minigames': {}, 'stats': {'cl_win': 0, 'cl_lose': 0, 'hl_win': 0, 'hl_lose': 0},
+        'daily_streak': 0, 'last_daily': None, 'minigame_streaks': {}, 'schema_version': 2,
+    },
+}
+
+
+def test_v0_records_migrate_to_the_current_schema():
+    users = copy.deepcopy(V0_USERS)
+    assert all(main.migrate_user(user) for user in users.values())
+    assert users == EXPECTED
+    assert main.SCHEMA_VERSION == 2
+
+
+def test_migrated_records_are_left_alone():
+    users = copy.deepcopy(EXPECTED)
+    assert not any(main.migrate_user(user) for user in users.values())
+    assert users == EXPECTED
+
+
+def test_v1_record_only_reencodes_games():
+    user = copy.deepcopy(EXPECTED['2'])
+    user['schema_version'] = 1
+    user['minigames']['guess_number'] = V0_USERS['2']['minigames']['guess_number']
+    assert main.migrate_user(user)
+    assert user == EXPECTED['2']
+
+
+def test_v0_snapshot_is_migrated_and_persisted_on_load(data_dir):
+    (data_dir / main.LOCAL_BACKUP_FILE).write_text(json.dumps(V0_USERS), encoding='utf-8')
+
+    async def scenario():
+        dm = main.DataManager()
+        await dm.initialize()
+        assert {uid: dict(user) for uid, user in dm.users.items()} == EXPECTED
+        game = main.load_game(dm.users['2'], 'guess_number')
+        assert (game.secret_number, game.guesses) == (42, 2)
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+    assert main.JsonStorage()._read_snapshot() == EXPECTED
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+import main
+
+INTERVAL = 60.0
+
+
+class Clock:
+    """Real monotonic time plus a jump offset; the event loop reads it too, so timers jump with it."""
+
+    def __init__(self, real):
+        self.real = real
+        self.offset = 0.0
+
+    def __call__(self) -> float:
+        return self.real() + self.offset
+
+
+class FakeBot:
+    """Records sends per chat; a send can be held open or made to fail once."""
+
+    def __init__(self):
+        self.sent = []
+        self.gates = {}
+        self.failures = {}
+
+    def send(self, chat_id, text):
+        async def call():
+            gate = self.gates.get(text)
+            if gate:
+                await gate.wait()
+            failure = self.failures.pop(text, None)
+            if failure:
+                raise failure
+            self.sent.append((chat_id, text))
+            return text
+        return call
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(time.monotonic)
+    monkeypatch.setattr(main.time, 'monotonic', clock)
+    return clock
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+async def jump(clock, seconds):
+    clock.offset += seconds
+    await asyncio.sleep(0.01)
+    await settle()
+
+
+def run(scenario):
+    async def wrapped():
+        sched = main.OutboundScheduler(global_rate=1000, group_interval=INTERVAL, private_interval=INTERVAL)
+        sched.start()
+        try:
+            # The clock jumps move loop timers too, so the guard must outlast them.
+            await asyncio.wait_for(scenario(sched, FakeBot()), 10 * INTERVAL)
+        finally:
+            await sched.stop()
+    asyncio.run(wrapped())
+
+
+def test_pending_edits_of_one_message_collapse_to_the_newest(clock):
+    async def scenario(sched, bot):
+        bot.gates['first'] = gate = asyncio.Event()
+        first = asyncio.ensure_future(sched.submit(1, bot.send(1, 'first')))
+        await settle()
+        edits = [asyncio.ensure_future(sched.submit(1, bot.send(1, f'edit {i}'), key=(1, 7))) for i in range(3)]
+        await settle()
+        gate.set()
+        await first
+        await jump(clock, INTERVAL)
+        assert await asyncio.gather(*edits) == ['edit 2'] * 3
+        assert bot.sent == [(1, 'first'), (1, 'edit 2')]
+        assert sched.coalesced == 2
+
+    run(scenario)
+
+
+def test_each_chat_is_paced_independently(clock):
+    async def scenario(sched, bot):
+        jobs = [asyncio.ensure_future(sched.submit(chat, bot.send(chat, f'{chat}:{i}')))
+                for chat in (1, -100) for i in range(2)]
+        await settle()
+        assert sorted(bot.sent) == [(-100, '-100:0'), (1, '1:0')]
+        await jump(clock, INTERVAL / 2)
+        assert len(bot.sent) == 2
+        await jump(clock, INTERVAL / 2)
+        assert sorted(bot.sent) == [(-100, '-100:0'), (-100, '-100:1'), (1, '1:0'), (1, '1:1')]
+        await asyncio.gather(*jobs)
+        assert sched.stats()['sent'] == 4
+
+    run(scenario)
+
+
+def test_retry_after_requeues_the_job_once_the_chat_cools_down(clock):
+    async def scenario(sched, bot):
+        bot.failures['hello'] = RetryAfter(30)
+        job = asyncio.ensure_future(sched.submit(1, bot.send(1, 'hello')))
+        other = asyncio.ensure_future(sched.submit(2, bot.send(2, 'other')))
+        await settle()
+        assert bot.sent == [(2, 'other')] and not job.done()
+        await jump(clock, 29)
+        assert not job.done()
+        await jump(clock, 1)
+        assert await job == 'hello'
+        await other
+        assert sched.retried == 1 and sched.failed == 0
+
+    run(scenario)
+
+
+def test_retried_edit_is_answered_by_the_newer_pending_edit(clock):
+    async def scenario(sched, bot):
+        bot.gates['old'] = gate = asyncio.Event()
+        bot.failures['old'] = RetryAfter(5)
+        old = asyncio.ensure_future(sched.submit(1, bot.send(1, 'old'), key=(1, 7)))
+        await settle()
+        new = asyncio.ensure_future(sched.submit(1, bot.send(1, 'new'), key=(1, 7)))
+        await settle()
+        gate.set()
+        await settle()
+        assert not old.done()
+        await jump(clock, 5)
+        assert await asyncio.gather(old, new) == ['new', 'new']
+        assert bot.sent == [(1, 'new')]
+
+    run(scenario)
+
+
+def test_errors_reach_the_caller():
+    async def scenario(sched, bot):
+        bot.failures['bad'] = ValueError('rejected')
+        with pytest.raises(ValueError):
+            await sched.submit(1, bot.send(1, 'bad'))
+        assert sched.failed == 1
+
+    run(scenario)
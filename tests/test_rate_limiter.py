@@ -0,0 +1,57 @@
+import pytest
+
+import main
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(main.time, 'monotonic', clock)
+    return clock
+
+
+def test_burst_then_drop_then_refill(clock):
+    limiter = main.RateLimiter(user_rate=10, user_burst=5)
+    assert [limiter.allow(1) for _ in range(7)] == [True] * 5 + [False] * 2
+    clock.now += 0.1
+    assert limiter.allow(1)
+    assert not limiter.allow(1)
+    assert limiter.stats()['dropped'] == 3
+
+
+def test_spammer_does_not_affect_other_users(clock):
+    limiter = main.RateLimiter(user_rate=10, user_burst=5)
+    spam_allowed = 0
+    others_allowed = 0
+    for tick in range(100):
+        clock.now += 0.01
+        spam_allowed += sum(limiter.allow(-1) for _ in range(50))
+        others_allowed += sum(limiter.allow(uid) for uid in range(tick * 10, tick * 10 + 10))
+    assert others_allowed == 1000
+    # One second of spam: the burst plus one token per 0.1 s.
+    assert spam_allowed <= 5 + 10
+
+
+def test_bucket_memory_is_bounded(clock):
+    limiter = main.RateLimiter(user_rate=10, user_burst=5, max_users=100)
+    for uid in range(10_000):
+        limiter.allow(uid)
+    assert len(limiter.buckets) == 100
+
+
+def test_idle_bucket_expires_full(clock):
+    limiter = main.RateLimiter(user_rate=10, user_burst=5)
+    for _ in range(5):
+        limiter.allow(1)
+    assert not limiter.allow(1)
+    clock.now += 0.6
+    assert limiter.buckets.get(1) is None
+    assert all(limiter.allow(1) for _ in range(5))
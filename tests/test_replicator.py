@@ -0,0 +1,110 @@
+import asyncio
+import base64
+import types
+
+import pytest
+from github import GithubException, UnknownObjectException
+
+import main
+
+
+class FakeRepo:
+    """In-memory stand-in for the three PyGithub Repository calls the replicator makes."""
+
+    def __init__(self, content=None):
+        self.content = content
+        self.sha = 'sha0' if content is not None else None
+        self.calls = []
+        self.fail = None
+        self._version = 0
+
+    def get_contents(self, path):
+        self.calls.append(('get', path))
+        if self.content is None:
+            raise UnknownObjectException(404, {'message': 'Not Found'}, {})
+        return types.SimpleNamespace(sha=self.sha, content=base64.b64encode(self.content).decode())
+
+    def _store(self, payload):
+        if self.fail:
+            error, self.fail = self.fail, None
+            raise error
+        self._version += 1
+        self.content, self.sha = payload, f'sha{self._version}'
+        return {'content': types.SimpleNamespace(sha=self.sha)}
+
+    def create_file(self, path, message, payload):
+        self.calls.append(('create', path))
+        return self._store(payload)
+
+    def update_file(self, path, message, payload, sha):
+        self.calls.append(('update', path, sha))
+        return self._store(payload)
+
+
+def replicator(repo, payloads, rate_limit_fn=None):
+    payloads = iter(payloads)
+
+    async def snapshot():
+        return next(payloads)
+    return main.GitHubReplicator(repo, snapshot, path='data.json', rate_limit_fn=rate_limit_fn)
+
+
+def push(rep, times=1):
+    async def scenario():
+        return [await rep.push_once() for _ in range(times)]
+    return asyncio.run(scenario())
+
+
+def test_unchanged_snapshot_is_not_uploaded():
+    repo = FakeRepo(b'{"a":1}')
+    rep = replicator(repo, [b'{"a":1}', b'{"a":1}'])
+    assert push(rep, 2) == [0, 0]
+    assert repo.calls == [('get', 'data.json')]
+    assert (rep.pushes, rep.skipped) == (0, 2)
+
+
+def test_creates_then_updates_with_the_returned_sha():
+    repo = FakeRepo()
+    rep = replicator(repo, [b'v1', b'v2', b'v2'])
+    push(rep, 3)
+    assert repo.calls == [('get', 'data.json'), ('create', 'data.json'), ('update', 'data.json', 'sha1')]
+    assert repo.content == b'v2' and rep.pushes == 2 and rep.skipped == 1
+
+
+def test_existing_file_is_updated_against_its_remote_sha():
+    repo = FakeRepo(b'old')
+    push(replicator(repo, [b'new']))
+    assert repo.calls[-1] == ('update', 'data.json', 'sha0')
+
+
+def test_retry_after_header_sets_the_backoff_and_forces_a_refetch():
+    repo = FakeRepo(b'old')
+    repo.fail = GithubException(403, {'message': 'secondary rate limit'}, {'Retry-After': '42'})
+    rep = replicator(repo, [b'new', b'new'])
+    assert push(rep, 2) == [42.0, 0]
+    assert [c[0] for c in repo.calls] == ['get', 'update', 'get', 'update']
+    assert repo.content == b'new'
+
+
+def test_rate_limit_reset_header_sets_the_backoff(monkeypatch):
+    monkeypatch.setattr(main.time, 'time', lambda: 1000.0)
+    repo = FakeRepo()
+    repo.fail = GithubException(403, {'message': 'API rate limit exceeded'},
+                                {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '1090'})
+    assert push(replicator(repo, [b'v1'])) == [90.0]
+    assert repo.content is None
+
+
+def test_other_errors_do_not_back_off():
+    repo = FakeRepo()
+    repo.fail = GithubException(500, {'message': 'boom'}, {})
+    assert push(replicator(repo, [b'v1'])) == [0]
+
+
+@pytest.mark.parametrize('remaining, uploads', [(main.GITHUB_RATE_LIMIT_RESERVE - 1, 0), (main.GITHUB_RATE_LIMIT_RESERVE, 1)])
+def test_push_is_deferred_below_the_quota_reserve(monkeypatch, remaining, uploads):
+    monkeypatch.setattr(main.time, 'time', lambda: 1000.0)
+    repo = FakeRepo()
+    backoff = push(replicator(repo, [b'v1'], rate_limit_fn=lambda: (remaining, 1300.0)))
+    assert backoff == [300.0 if not uploads else 0]
+    assert sum(c[0] == 'create' for c in repo.calls) == uploads
@@ -0,0 +1,75 @@
+import asyncio
+import types
+
+import pytest
+
+import main
+
+
+def make_router():
+    router = main.CallbackRouter()
+    seen = []
+
+    def handler(name):
+        async def handle(update, context):
+            seen.append((name, context.args))
+        return handle
+
+    router.exact('help')(handler('help'))
+    router.exact('game_taixiu')(handler('game_taixiu'))
+    router.prefix('taixiu_')(handler('taixiu'))
+    router.prefix('rps_play_')(handler('rps_play'))
+    router.prefix('rps_')(handler('rps'))
+    return router, seen
+
+
+def dispatch(router, data):
+    update = types.SimpleNamespace(callback_query=types.SimpleNamespace(data=data))
+    context = types.SimpleNamespace(args=None)
+    return asyncio.run(router.dispatch(update, context))
+
+
+def test_exact_route_wins_over_prefix():
+    router, _ = make_router()
+    route, _, args = router.resolve('game_taixiu')
+    assert (route, args) == ('game_taixiu', [])
+
+
+def test_prefix_args_and_longest_match():
+    router, _ = make_router()
+    assert router.resolve('taixiu_tai_10')[::2] == ('taixiu_*', ['tai', '10'])
+    assert router.resolve('rps_play_rock')[::2] == ('rps_play_*', ['rock'])
+    assert router.resolve('rps_reset')[::2] == ('rps_*', ['reset'])
+    assert router.resolve('rps_play_')[::2] == ('rps_play_*', [])
+
+
+def test_unknown_data_is_counted():
+    router, seen = make_router()
+    assert not dispatch(router, 'nope')
+    assert not dispatch(router, 'taixiu')
+    assert router.unknown == 2
+    assert seen == []
+
+
+def test_dispatch_sets_args_and_counts_hits():
+    router, seen = make_router()
+    assert dispatch(router, 'taixiu_xiu_50')
+    assert dispatch(router, 'help')
+    assert seen == [('taixiu', ['xiu', '50']), ('help', [])]
+    assert router.hits['taixiu_*'] == 1
+    assert router.hits['help'] == 1
+
+
+def test_prefix_must_end_with_separator():
+    with pytest.raises(ValueError):
+        main.CallbackRouter().prefix('rps')
+
+
+def test_every_keyboard_button_has_a_route():
+    keyboards = [main.MENU_KEYBOARD, main.RANKING_KEYBOARD, main.RPS_KEYBOARD, main.COINFLIP_KEYBOARD,
+                 main.TREASURE_KEYBOARD, main.HIGHLOW_KEYBOARD, main.DICEROLL_KEYBOARD, main.CHANLE_KEYBOARD,
+                 main.taixiu_keyboard(10)]
+    for keyboard in keyboards:
+        for row in keyboard.inline_keyboard:
+            for button in row:
+                assert main.callbacks.resolve(button.callback_data)[1], button.callback_data
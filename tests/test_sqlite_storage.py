@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    def use(name):
+        monkeypatch.setattr(main, 'STORAGE_BACKEND', name)
+    use('sqlite')
+    return use
+
+
+async def restart() -> main.DataManager:
+    dm = main.DataManager()
+    await dm.initialize()
+    return dm
+
+
+async def crash(dm: main.DataManager):
+    """Stop without the final flush, as if the process died after the last ledger commit."""
+    dm._autosave_task.cancel()
+    await dm.ledger.close()
+    await dm.storage.close()
+
+
+async def seed(dm: main.DataManager, coins):
+    for uid, amount in coins.items():
+        async with dm.transaction(uid) as user:
+            user['coins'] = amount
+            user['username'] = f'@Player{uid}'
+
+
+def test_records_round_trip(backend):
+    async def scenario():
+        dm = await restart()
+        assert isinstance(dm.storage, main.SqliteStorage)
+        await seed(dm, {1: 50, 2: 75})
+        await dm.shutdown()
+
+        dm = await restart()
+        assert dm.users == {}
+        assert (await dm.get_user(2))['coins'] == 75
+        assert (await dm.get_user(1))['username'] == '@Player1'
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_ranking_views_see_unflushed_changes(backend):
+    async def scenario():
+        dm = await restart()
+        await seed(dm, {uid: uid * 10 for uid in range(1, 6)})
+        await dm.flush()
+        async with dm.transaction(2) as user:
+            user['coins'] = 1000
+            user['username'] = '@Renamed'
+
+        assert [u['user_id'] for u in await dm.get_top_users('coins', 2)] == ['2', '5']
+        assert await dm.get_user_position(3, 'coins') == 4
+        assert await dm.find_user_by_username('@renamed') == 2
+        assert await dm.find_user_by_username('@player2') is None
+        assert await dm.get_percentile(2, 'coins') == 20.0
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_a_view_flushes_at_most_once(backend, monkeypatch):
+    async def scenario():
+        dm = await restart()
+        await seed(dm, {1: 10, 2: 20})
+        flushes = []
+        flush = dm.storage.flush
+
+        async def counting(records, *args, **kwargs):
+            flushes.append(set(records))
+            return await flush(records, *args, **kwargs)
+        monkeypatch.setattr(dm.storage, 'flush', counting)
+
+        for _ in range(2):
+            await dm.get_percentile(1, 'total_exp')
+            await dm.get_percentile(1, 'coins')
+            await dm.get_tier_distribution()
+            await dm.get_user_position(1, 'coins')
+        assert flushes == [{'1', '2'}]
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_json_data_migrates_on_first_open(backend):
+    async def scenario():
+        backend('json')
+        dm = await restart()
+        await seed(dm, {1: 40, 2: 60})
+        await dm.shutdown()
+
+        backend('sqlite')
+        dm = await restart()
+        assert await dm.storage.count_users() == 2
+        assert [u['coins'] for u in await dm.get_top_users('coins', 5)] == [60, 40]
+        assert (await dm.get_user(1))['schema_version'] == main.SCHEMA_VERSION
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_migration_replays_a_crashed_json_run_exactly_once(backend):
+    async def scenario():
+        backend('json')
+        dm = await restart()
+        await seed(dm, {1: 40, 2: 60})
+        await dm.flush()
+        ok, _ = await dm.transfer(1, {2: 15})
+        assert ok
+        await crash(dm)
+
+        backend('sqlite')
+        dm = await restart()
+        assert (await dm.get_user(1))['coins'] == 25
+        assert (await dm.get_user(2))['coins'] == 75
+        assert (await dm.get_user(2))['username'] == '@Player2'
+        await crash(dm)
+
+        dm = await restart()
+        assert (await dm.get_user(1))['coins'] == 25
+        assert (await dm.get_user(2))['coins'] == 75
+        await dm.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,85 @@
+import asyncio
+import itertools
+import types
+
+import pytest
+
+import main
+
+
+class ChatBot:
+    """Keeps the current text of every message it has sent, edited or deleted."""
+
+    def __init__(self):
+        self.texts = {}
+        self.deleted = []
+        self._ids = itertools.count(1)
+
+    async def reply_text(self, text, **kwargs):
+        msg_id = next(self._ids)
+        self.texts[msg_id] = text
+        return types.SimpleNamespace(message_id=msg_id, chat_id=1)
+
+    async def edit_message_text(self, text, chat_id, msg_id, **kwargs):
+        self.texts[msg_id] = text
+
+    async def delete_message(self, chat_id, msg_id):
+        self.deleted.append(msg_id)
+        del self.texts[msg_id]
+
+    def visible(self):
+        return [self.texts[i] for i in sorted(self.texts)]
+
+
+def fake_client(deltas):
+    async def events():
+        for delta in deltas:
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=delta))])
+
+    async def create(**kwargs):
+        return events()
+    return types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    monkeypatch.setattr(main, 'STREAM_EDIT_INTERVAL', 0)
+    main.edit_cache.clear()
+    return ChatBot()
+
+
+def stream(chat, monkeypatch, deltas):
+    monkeypatch.setattr(main, 'ai_client', fake_client(deltas))
+    return asyncio.run(main.stream_ai_reply(chat, chat, 'q'))
+
+
+@pytest.mark.parametrize('size', [main.TELEGRAM_MESSAGE_LIMIT - 1, main.TELEGRAM_MESSAGE_LIMIT,
+                                  3 * main.TELEGRAM_MESSAGE_LIMIT + 100])
+def test_long_reply_leaves_no_cursor_or_stray_parts(chat, monkeypatch, size):
+    deltas = ['x' * 97] * (size // 97) + ['x' * (size % 97)]
+    reply = stream(chat, monkeypatch, deltas)
+
+    parts = chat.visible()
+    assert ''.join(parts) == reply == 'x' * size
+    assert all(len(part) <= main.TELEGRAM_MESSAGE_LIMIT for part in parts)
+    assert not any('▌' in part for part in parts)
+
+
+def test_cursor_never_pushes_a_part_over_the_limit(chat, monkeypatch):
+    seen = []
+    edit = chat.edit_message_text
+
+    async def record(text, chat_id, msg_id, **kwargs):
+        seen.append(text)
+        await edit(text, chat_id, msg_id, **kwargs)
+    monkeypatch.setattr(chat, 'edit_message_text', record)
+
+    stream(chat, monkeypatch, ['y' * 1000] * 9)
+    assert seen and all(len(text) <= main.TELEGRAM_MESSAGE_LIMIT for text in seen)
+    assert chat.deleted == []
+
+
+def test_trailing_newlines_past_a_boundary_do_not_leave_an_empty_part(chat, monkeypatch):
+    body = 'x' * (main.TELEGRAM_MESSAGE_LIMIT - len(main.STREAM_CURSOR))
+    stream(chat, monkeypatch, [body, '\n\n'])
+    assert chat.visible() == [body]
@@ -0,0 +1,38 @@
+import asyncio
+import random
+
+import pytest
+
+import main
+
+
+def brute_force(exps):
+    counts = [0] * len(main.RANKS)
+    for exp in exps:
+        counts[max(i for i, rank in enumerate(main.RANKS) if exp >= rank['exp'] or i == 0)] += 1
+    return counts
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_tier_distribution_matches_a_brute_force_count(monkeypatch, backend):
+    monkeypatch.setattr(main, 'STORAGE_BACKEND', backend)
+    rng = random.Random(13)
+    edges = [t + d for t in main.RANK_THRESHOLDS for d in (-1, 0, 1)]
+    exps = {uid: rng.choice(edges) if rng.random() < 0.5 else rng.uniform(-10, 2e8) for uid in range(1, 301)}
+
+    async def scenario():
+        dm = main.DataManager()
+        await dm.initialize()
+        async def set_exp(uid, exp):
+            async with dm.transaction(uid) as user:
+                user['total_exp'] = exps[uid] = exp
+
+        # Transactions wait for their ledger commit, so run them side by side.
+        await asyncio.gather(*(set_exp(uid, exp) for uid, exp in exps.items()))
+        await dm.flush()
+        # Moves across tiers that are still unflushed must be counted too.
+        await asyncio.gather(*(set_exp(uid, rng.choice(edges)) for uid in range(1, 31)))
+        assert await dm.get_tier_distribution() == brute_force(exps.values())
+        await dm.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,150 @@
+import asyncio
+
+import main
+
+
+async def open_dm() -> main.DataManager:
+    dm = main.DataManager()
+    await dm.initialize()
+    return dm
+
+
+def test_transfer_moves_coins():
+    async def scenario():
+        dm = await open_dm()
+        ok, users = await dm.transfer(1, {2: 30}, memo='tip')
+        assert ok
+        assert users[1]['coins'] == 70
+        assert users[2]['coins'] == 130
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_transfer_rejects_overdraft_without_side_effects():
+    async def scenario():
+        dm = await open_dm()
+        ok, _ = await dm.transfer(1, {2: 60, 3: 60})
+        assert not ok
+        assert dm.users['1']['coins'] == 100
+        assert dm.users['2']['coins'] == 100
+        assert dm.users['3']['coins'] == 100
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_transfers_cannot_overdraw():
+    async def scenario():
+        dm = await open_dm()
+        results = await asyncio.gather(*(dm.transfer(1, {uid: 30}) for uid in range(2, 12)))
+        assert sum(ok for ok, _ in results) == 3
+        assert dm.users['1']['coins'] == 10
+        assert sum(u['coins'] for u in dm.users.values()) == 100 * 11
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_opposite_transfers_do_not_deadlock():
+    async def scenario():
+        dm = await open_dm()
+        await asyncio.wait_for(asyncio.gather(*(dm.transfer(a, {b: 1}) for a, b in [(1, 2), (2, 1)] * 50)), 5)
+        assert dm.users['1']['coins'] == dm.users['2']['coins'] == 100
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_batched_mint():
+    async def scenario():
+        dm = await open_dm()
+        ok, _ = await dm.transfer(None, {uid: 25 for uid in (1, 2, 3)}, memo='give')
+        assert ok
+        assert [dm.users[str(uid)]['coins'] for uid in (1, 2, 3)] == [125, 125, 125]
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_transfer_is_ledgered_before_it_yields():
+    async def scenario():
+        dm = await open_dm()
+        await dm.get_user(1)
+        await dm.get_user(2)
+        seq = dm.ledger.seq
+        task = asyncio.create_task(dm.transfer(1, {2: 30}))
+        await asyncio.sleep(0)
+        # Any task running now (e.g. the autosave flush) must see both legs logged.
+        assert dm.users['1']['coins'] == 70
+        assert dm.ledger.seq == seq + 2
+        await task
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_transfer_survives_crash_exactly_once():
+    async def scenario():
+        dm = await open_dm()
+        await dm.get_user(1)
+        await dm.get_user(2)
+        await dm.flush()
+        task = asyncio.create_task(dm.transfer(1, {2: 30}))
+        await asyncio.sleep(0)
+        await dm.flush()
+        await task
+        dm._autosave_task.cancel()
+        await dm.ledger.close()
+
+        dm = await open_dm()
+        assert dm.users['1']['coins'] == 70
+        assert dm.users['2']['coins'] == 130
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+async def rename(dm, uid, username):
+    async with dm.transaction(uid) as user:
+        user['username'] = username
+
+
+def test_username_lookup_ignores_case():
+    async def scenario():
+        dm = await open_dm()
+        await rename(dm, 1, '@MixedCase')
+        assert await dm.find_user_by_username('@mixedcase') == 1
+        assert await dm.find_user_by_username('@MIXEDCASE') == 1
+        assert await dm.find_user_by_username('@other') is None
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_latest_claim_of_a_handle_wins_and_survives_the_old_owner_renaming():
+    async def scenario():
+        dm = await open_dm()
+        await rename(dm, 1, '@shared')
+        await rename(dm, 2, '@Shared')
+        assert await dm.find_user_by_username('@shared') == 2
+        await rename(dm, 1, '@elsewhere')
+        assert await dm.find_user_by_username('@shared') == 2
+        assert await dm.find_user_by_username('@elsewhere') == 1
+        await dm.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_rename_clears_the_old_handle():
+    async def scenario():
+        dm = await open_dm()
+        await rename(dm, 1, '@before')
+        await rename(dm, 1, '@after')
+        assert await dm.find_user_by_username('@before') is None
+        await rename(dm, 1, 'No Handle')
+        assert await dm.find_user_by_username('@after') is None
+        assert dm._username_of == {}
+        await dm.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,61 @@
+import asyncio
+import time
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+import main
+
+
+def message_update(update_id: int, uid: int) -> Update:
+    chat = Chat(uid, 'private')
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=User(uid, 'p', False), text='1'))
+
+
+def test_updates_of_one_user_keep_their_order():
+    async def scenario():
+        processor = main.PerUserUpdateProcessor(16)
+        seen = {}
+
+        async def handle(update, delay):
+            await asyncio.sleep(delay)
+            seen.setdefault(update.effective_user.id, []).append(update.update_id)
+
+        updates = [message_update(i, i % 4) for i in range(40)]
+        await asyncio.gather(*(processor.process_update(u, handle(u, 0.01 * (40 - u.update_id) / 40)) for u in updates))
+        return seen
+
+    seen = asyncio.run(scenario())
+    assert all(ids == sorted(ids) for ids in seen.values())
+    assert sum(map(len, seen.values())) == 40
+
+
+def test_queued_updates_do_not_hold_slots():
+    async def scenario():
+        processor = main.PerUserUpdateProcessor(4)
+        done = {}
+        start = time.perf_counter()
+
+        async def run(update, delay):
+            await processor.process_update(update, asyncio.sleep(delay))
+            done[update.update_id] = time.perf_counter() - start
+
+        # One slow update from user 1 with three more queued behind it.
+        jobs = [run(message_update(i, 1), 0.3 if i == 0 else 0.05) for i in range(4)]
+        jobs.append(run(message_update(99, 2), 0.01))
+        await asyncio.gather(*jobs)
+        return done
+
+    done = asyncio.run(scenario())
+    assert done[99] < 0.1
+    assert done[3] >= 0.45
+
+
+def test_updates_without_a_user_are_not_serialized():
+    async def scenario():
+        processor = main.PerUserUpdateProcessor(8)
+        start = time.perf_counter()
+        await asyncio.gather(*(processor.process_update(object(), asyncio.sleep(0.05)) for _ in range(8)))
+        return time.perf_counter() - start
+
+    assert asyncio.run(scenario()) < 0.2
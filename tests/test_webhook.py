@@ -0,0 +1,47 @@
+import asyncio
+import types
+
+from aiohttp.test_utils import TestClient, TestServer
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler
+
+import main
+
+
+def post_updates(*requests):
+    queue = asyncio.Queue()
+
+    async def scenario():
+        app = types.SimpleNamespace(update_queue=queue, bot=None)
+        statuses = []
+        async with TestClient(TestServer(main.create_webhook_app(app))) as client:
+            for headers, body in requests:
+                response = await client.post(main.WEBHOOK_PATH, data=body, headers=headers)
+                statuses.append(response.status)
+        return statuses
+
+    return asyncio.run(scenario()), queue.qsize()
+
+
+def test_webhook_secret_is_always_set():
+    assert main.WEBHOOK_SECRET
+
+
+def test_webhook_rejects_missing_or_wrong_secret():
+    statuses, queued = post_updates(({}, '{"update_id": 1}'),
+                                    ({'X-Telegram-Bot-Api-Secret-Token': 'wrong'}, '{"update_id": 2}'))
+    assert statuses == [403, 403]
+    assert queued == 0
+
+
+def test_webhook_accepts_valid_secret_and_rejects_bad_json():
+    headers = {'X-Telegram-Bot-Api-Secret-Token': main.WEBHOOK_SECRET}
+    statuses, queued = post_updates((headers, '{"update_id": 1}'), (headers, 'not json'))
+    assert statuses == [200, 400]
+    assert queued == 1
+
+
+def test_allowed_updates_follow_registered_handlers():
+    app = Application.builder().token('1:test').updater(None).build()
+    app.add_handler(CommandHandler('start', main.start))
+    app.add_handler(CallbackQueryHandler(main.button_handler))
+    assert main.allowed_update_types(app) == ['callback_query', 'message']